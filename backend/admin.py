@@ -5,7 +5,7 @@ from psycopg2 import IntegrityError
 from rest_framework.exceptions import ValidationError
 
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, Brand, Image
+    Contact, Brand, Image, ShopCategory
 
 
 @admin.register(Image)
@@ -53,7 +53,7 @@ class ProductInfoInline(admin.TabularInline):
             'classes': ('baton-tabs-init', 'baton-tab-fs-info', 'order-0',)
         }),
         ('Цены и количество', {
-            'fields': ('quantity', 'price', 'price_rrc'),
+            'fields': ('quantity', 'price', 'price_rrc', 'is_active'),
             'classes': ('tab-fs-pricing', 'order-1',)
         }),
     )
@@ -92,11 +92,18 @@ class CategoryAdmin(admin.ModelAdmin):
     fields = ("name", "shops")
 
 
+class ShopCategoryInline(admin.TabularInline):
+    model = ShopCategory
+    fields = ('external_id', 'category')
+    extra = 0
+
+
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
     model = Shop
     list_filter = ('state', 'user')
     fields = ["user", "name", "address", "state", "image"]
+    inlines = [ShopCategoryInline]
 
 
 @admin.register(Order)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate, post_migrate
 
 
 class CustomConfig(AppConfig):
@@ -8,4 +9,7 @@ class CustomConfig(AppConfig):
     def ready(self):
         from backend.signals import new_user_registered,new_user_registered_signal
         new_user_registered.connect(new_user_registered_signal)
+        from backend.search import create_search_extensions, create_search_indexes
+        pre_migrate.connect(create_search_extensions, sender=self)
+        post_migrate.connect(create_search_indexes, sender=self)
 
@@ -0,0 +1,183 @@
+"""
+Автодополнение поиска по префиксу: названия товаров, модели и бренды.
+
+Индекс - нормализованные названия и отсортированный массив начал слов в них, по которому идёт bisect. Ключ -
+название с начала каждого его слова, поэтому «iph» находит «Смартфон Apple iPhone XR». Ключи не хранятся
+строками: элемент массива - номер названия и смещение слова в нём (8 байт), так что индекс занимает одну копию
+текста каталога, а не по копии хвоста названия на каждое слово. Запрос находит первый ключ с нужным префиксом и
+читает следующие, пока префикс совпадает.
+
+Индекс строится из витрины (только товары в продаже) и хранится в кеше Django сжатым снимком, общим для всех
+процессов. Процесс держит снимок в памяти и сверяет его версию не чаще раза в AUTOCOMPLETE_CHECK_INTERVAL секунд,
+так что нажатие клавиши не обращается ни к базе, ни к кешу. Пока снимка нет (холодный кеш, вытеснение),
+запрос ставит задачу на построение и отвечает по прежнему снимку процесса или пустым списком. После импорта прайс-листа или смены статуса магазина
+из базы заново читаются только строки этого магазина; списки остальных магазинов берутся из кеша. Обновление
+выполняет задача Celery, а не запрос; одновременные обновления идут по очереди под блокировкой в кеше, иначе
+снимок, собранный без списка соседнего магазина, мог бы заменить более новый.
+"""
+import re
+import time
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import ujson
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.models import ProductListing, Shop
+
+INDEX_KEY = 'autocomplete:index'
+VERSION_KEY = 'autocomplete:version'
+SHOP_KEY = 'autocomplete:shop:{}'
+LOCK_KEY = 'autocomplete:lock'
+QUEUED_KEY = 'autocomplete:queued'
+# refreshing the index of a large catalog takes seconds; a lock left by a killed worker expires after this
+LOCK_TIMEOUT = 120
+MAX_LIMIT = 50
+WORD_START = re.compile(r'(?<!\w)\w')
+# a key is stored as (name number << OFFSET_BITS) | offset of the word in the name
+OFFSET_BITS = 16
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+# (version, time of the last version check, index)
+_loaded = (None, 0.0, None)
+
+
+def normalize(text):
+    """
+    Lower case, `ё` as `е`, single spaces.
+    """
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def shop_entries(shop_ids):
+    """
+    {shop id: [[kind, id, name]]} of the shops' goods on sale: products and models by product id, brands by id.
+    """
+    entries = {shop_id: set() for shop_id in shop_ids}
+    for shop_id, product_id, product_name, model, brand_id, brand_name in ProductListing.objects.nocache().filter(
+            shop_id__in=shop_ids, shop_state=True, is_active=True).values_list(
+            'shop_id', 'product_id', 'product_name', 'model', 'brand_id', 'brand_name'):
+        entries[shop_id].add(('product', product_id, product_name))
+        if model:
+            entries[shop_id].add(('model', product_id, model))
+        if brand_id is not None and brand_name:
+            entries[shop_id].add(('brand', brand_id, brand_name))
+    return {shop_id: sorted(shop) for shop_id, shop in entries.items()}
+
+
+def build_index(entries):
+    """
+    {'entries': [[kind, id, name]], 'names': [normalized name], 'keys': [name number << OFFSET_BITS | offset]} with
+    the keys sorted by the text from the offset to the end of the name.
+    """
+    entries = [list(entry) for entry in sorted(entries)]
+    names = [normalize(name) for _, _, name in entries]
+    keys = [number << OFFSET_BITS | match.start()
+            for number, name in enumerate(names) for match in WORD_START.finditer(name)]
+    keys.sort(key=lambda key: names[key >> OFFSET_BITS][key & OFFSET_MASK:])
+    return {'entries': entries, 'names': names, 'keys': keys}
+
+
+def refresh_autocomplete(shop_ids=None):
+    """
+    Read the goods of `shop_ids` (of every shop when None) again and publish a new index snapshot.
+
+    The shop lists are read and the snapshot is built under the lock, so a refresh always sees the lists written
+    by the refreshes before it.
+    """
+    with _lock():
+        all_shops = list(Shop.objects.nocache().values_list('id', flat=True))
+        stored = {} if shop_ids is None else cache.get_many([SHOP_KEY.format(shop_id) for shop_id in all_shops])
+        stale = [shop_id for shop_id in all_shops
+                 if shop_ids is None or shop_id in shop_ids or SHOP_KEY.format(shop_id) not in stored]
+        fresh = shop_entries(stale)
+        cache.set_many({SHOP_KEY.format(shop_id): shop for shop_id, shop in fresh.items()}, None)
+
+        entries = set()
+        for shop_id in all_shops:
+            shop = fresh[shop_id] if shop_id in fresh else stored[SHOP_KEY.format(shop_id)]
+            entries.update(tuple(entry) for entry in shop)
+        index = build_index(entries)
+        version = time.time_ns()
+        cache.set(INDEX_KEY, (version, zlib.compress(ujson.dumps(index, ensure_ascii=False).encode())), None)
+        cache.set(VERSION_KEY, version, None)
+        cache.delete(QUEUED_KEY)
+    return version, index
+
+
+@contextmanager
+def _lock():
+    """
+    Hold the refresh lock; wait for another holder up to LOCK_TIMEOUT, after which its lock has expired anyway.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(LOCK_KEY, token, LOCK_TIMEOUT) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def load_index():
+    """
+    Return the current index, unpacked again only when another process has published a new snapshot.
+
+    Without a snapshot in the cache the refresh is queued, and the process keeps its previous index (or has none).
+    """
+    global _loaded
+    version, checked, index = _loaded
+    now = time.monotonic()
+    if index is not None and now - checked < settings.AUTOCOMPLETE_CHECK_INTERVAL:
+        return index
+    current = cache.get(VERSION_KEY)
+    snapshot = cache.get(INDEX_KEY) if current is not None and current != version else None
+    if current is None or (current != version and snapshot is None):
+        _queue_refresh()
+    elif snapshot is not None:
+        version, index = snapshot[0], ujson.loads(zlib.decompress(snapshot[1]))
+        index['keys'] = array('q', index['keys'])
+    _loaded = (version, now, index)
+    return index
+
+
+def _queue_refresh():
+    # the task module imports this one
+    from djangoProjectFinalWork.tasks import refresh_autocomplete_task
+
+    # one queued rebuild for all the processes that find the snapshot missing
+    if cache.add(QUEUED_KEY, 1, LOCK_TIMEOUT):
+        refresh_autocomplete_task.delay()
+
+
+def autocomplete(text, limit=10):
+    """
+    Up to `limit` {kind, id, name} suggestions with a word starting with `text`, in the order of the matched words.
+    """
+    prefix = normalize(text)
+    if not prefix:
+        return []
+    index = load_index()
+    if index is None:
+        return []
+    keys, names, entries = index['keys'], index['names'], index['entries']
+    found = {}
+    position = bisect_left(keys, prefix, key=lambda key: _key_text(names, key, len(prefix)))
+    while position < len(keys) and len(found) < limit:
+        number, offset = keys[position] >> OFFSET_BITS, keys[position] & OFFSET_MASK
+        if not names[number].startswith(prefix, offset):
+            break
+        found.setdefault(number, None)
+        position += 1
+    return [{'kind': entries[ref][0], 'id': entries[ref][1], 'name': entries[ref][2]} for ref in found]
+
+
+def _key_text(names, key, length):
+    offset = key & OFFSET_MASK
+    return names[key >> OFFSET_BITS][offset:offset + length]
@@ -0,0 +1,162 @@
+"""
+Кеш ответов каталога.
+
+Отрендеренный ответ хранится в кеше Django под ключом из пути, нормализованной строки запроса, запрошенного формата
+и версии каталога. Версия - счётчик в кеше, который увеличивают импорт прайс-листа, смена статуса магазина и
+списание остатков при заказе. После этого старые ответы просто перестают находиться: ключи не перебираются и не
+удаляются, устаревшие записи вытесняются по таймауту.
+
+Из тех же счётчиков (и счётчика заказов пользователя) строятся ETag для условных GET-запросов: совпавший
+If-None-Match получает 304 до обращения к базе. Кеш и ETag подключаются к обработчику GET, а не к dispatch,
+поэтому аутентификация и ограничение частоты запросов DRF действуют и на ответы из кеша.
+
+Строки витрины для выборки товаров по id кешируются по одной под той же версией каталога.
+"""
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+LISTING_KEY = 'catalog:listing:{}:{}'
+CATEGORY_VERSION_KEY = 'catalog:categories:version'
+ORDER_VERSION_KEY = 'orders:version:{}'
+CACHED_HEADERS = ('Content-Type', 'Vary', 'Allow')
+
+
+def _counter(key):
+    version = cache.get(key)
+    if version is None:
+        # a counter evicted from the cache restarts from the clock, so an old version number is never reused
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    def increment():
+        try:
+            cache.incr(key)
+        except ValueError:
+            _counter(key)
+    transaction.on_commit(increment)
+
+
+def catalog_version():
+    return _counter(CATALOG_VERSION_KEY)
+
+
+def category_version():
+    return _counter(CATEGORY_VERSION_KEY)
+
+
+def order_version(user_id):
+    return _counter(ORDER_VERSION_KEY.format(user_id))
+
+
+def bump_catalog_version(categories=False):
+    """
+    Make every cached catalog response and catalog ETag stale, once the current transaction commits.
+    `categories=True` also makes the in-process category and shop snapshot stale (backend/categories.py).
+    """
+    _bump(CATALOG_VERSION_KEY)
+    if categories:
+        _bump(CATEGORY_VERSION_KEY)
+
+
+def bump_order_version(user_id):
+    """
+    Change the ETag of the user's order list, once the current transaction commits.
+    """
+    _bump(ORDER_VERSION_KEY.format(user_id))
+
+
+def fingerprint(request, *versions):
+    """
+    Hash of a GET request's representation: host and path (pagination links are absolute), query string with sorted
+    keys and without empty values, Accept header and the versions of the data behind it.
+    """
+    query = urlencode(sorted(
+        (key, value) for key, values in request.GET.lists() for value in values if value != ''
+    ))
+    raw = '\n'.join(map(str, (
+        request.get_host(), request.path, query, request.META.get('HTTP_ACCEPT', ''), *versions,
+    )))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def response_key(request):
+    return 'catalog:response:' + fingerprint(request, catalog_version())
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    Strong ETag of a catalog GET, computed from counters without building the response.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return fingerprint(request, catalog_version())
+
+
+def order_etag(request, *args, **kwargs):
+    """
+    Strong ETag of the user's order list; totals are priced from the catalog, so its version counts too.
+    """
+    if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+        return None
+    return fingerprint(request, request.user.id, order_version(request.user.id), catalog_version())
+
+
+def cache_catalog_response(view):
+    """
+    Serve GET requests of a catalog view from the response cache; a hit skips the ORM, serializers and renderer.
+
+    Decorates the DRF handler (the `get` / `list` method or the function under @api_view), so authentication and
+    throttling have run before a hit is served. A miss is finalized by the view here to be rendered and stored.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+        key = response_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            if isinstance(response, Response):
+                response = request.parser_context['view'].finalize_response(request, response, *args, **kwargs)
+                response.render()
+            headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+            cache.set(key, (response.content, headers), settings.CATALOG_CACHE_TIMEOUT)
+        return response
+    return wrapper
+
+
+def cached_listings(product_info_ids, values, fetch):
+    """
+    {product info id: ProductListing `.values(*values)` row} of the ids, from the per-row cache; the rows it misses
+    are read with `fetch(ids)` and cached. Ids without a row are left out.
+    """
+    version = catalog_version()
+    keys = {LISTING_KEY.format(version, product_info_id): product_info_id for product_info_id in product_info_ids}
+    rows = {keys[key]: row for key, row in cache.get_many(keys).items()} if settings.CATALOG_CACHE_TIMEOUT else {}
+    missing = [product_info_id for product_info_id in product_info_ids if product_info_id not in rows]
+    if missing:
+        fetched = {row['product_info_id']: row for row in fetch(missing).values(*values)}
+        if settings.CATALOG_CACHE_TIMEOUT:
+            cache.set_many({LISTING_KEY.format(version, product_info_id): row
+                            for product_info_id, row in fetched.items()}, settings.CATALOG_CACHE_TIMEOUT)
+        rows.update(fetched)
+    return rows
@@ -0,0 +1,54 @@
+"""
+Снимок графа категорий и магазинов для CategoryView и ShopView.
+
+Граф читается двумя запросами и хранится в памяти процесса вместе с версией категорий из кеша. Версию увеличивают
+импорт прайс-листа, смена статуса магазина и правки категорий и магазинов по одной (сигналы); пока она не
+изменилась, списки категорий и магазинов отдаются без обращения к базе. При выключенном кеше каталога
+(CATALOG_CACHE_TIMEOUT = 0) снимок строится на каждый запрос.
+"""
+from typing import NamedTuple
+
+from django.conf import settings
+
+from backend.cache import category_version
+from backend.models import Category, Shop
+
+_loaded = (None, None)
+
+
+class Snapshot(NamedTuple):
+    # in the shape of CategorySerializer and ShopSerializer; shared by all requests, so never modified in place
+    categories: list
+    shops: list
+
+
+def build_snapshot():
+    """
+    Read the categories with their shops and the active shops, in the order of the models' Meta.ordering.
+    """
+    shops = {
+        # ShopSerializer renders the Image relation with an ImageField, which always gives None
+        shop_id: {'id': shop_id, 'address': address, 'image': None, 'name': name, 'state': state}
+        for shop_id, address, name, state in Shop.objects.nocache().order_by('-name', 'id').values_list(
+            'id', 'address', 'name', 'state')
+    }
+    categories = {}
+    for category_id, name, shop_id in Category.objects.nocache().order_by(
+            '-name', 'id', '-shops__name', 'shops__id').values_list('id', 'name', 'shops__id'):
+        category = categories.setdefault(category_id, {'id': category_id, 'name': name, 'shops': []})
+        if shop_id is not None:
+            category['shops'].append(shops[shop_id])
+    return Snapshot(list(categories.values()), [shop for shop in shops.values() if shop['state']])
+
+
+def load_snapshot():
+    """
+    Return the current Snapshot, built again only when the category version has changed.
+    """
+    global _loaded
+    if not settings.CATALOG_CACHE_TIMEOUT:
+        return build_snapshot()
+    version = category_version()
+    if version != _loaded[0]:
+        _loaded = (version, build_snapshot())
+    return _loaded[1]
@@ -0,0 +1,71 @@
+"""
+Потоковая выгрузка каталога для агрегаторов и партнёров.
+
+Строки витрины читаются серверным курсором (`.iterator(chunk_size=...)`) пачками по EXPORT_CHUNK_SIZE и сразу
+отдаются клиенту через StreamingHttpResponse, поэтому память не растёт с размером каталога, а первые строки
+уходят после первой пачки. Форматы: NDJSON - по строке товара в форме ответа product_view, и YAML в схеме
+`data/shop.yaml` для одного магазина, который можно снова загрузить импортом.
+"""
+from itertools import islice
+
+import ujson
+
+from backend.fast_serializers import LISTING_FIELDS, listing_rows, listing_values
+from backend.models import Category, ShopCategory
+from backend.renderers import encode_default
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def ndjson_chunks(queryset, request=None, fields=tuple(LISTING_FIELDS), chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield ProductListing rows as NDJSON, one chunk of bytes per batch, in product_view's shape limited to `fields`.
+    """
+    rows = queryset.nocache().order_by('product_info_id').values(*listing_values(fields))
+    for batch in _batches(rows, chunk_size):
+        yield ''.join(
+            ujson.dumps(row, ensure_ascii=False, escape_forward_slashes=False, default=encode_default) + '\n'
+            for row in listing_rows(batch, request, fields)
+        ).encode()
+
+
+def shop_feed_chunks(shop, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the shop's ProductListing rows as a `data/shop.yaml` price list, one chunk of bytes per batch.
+
+    Categories keep the codes of the shop's last imported price list; the others are given by their id.
+    """
+    codes = dict(ShopCategory.objects.filter(shop_id=shop.id).values_list('category_id', 'external_id'))
+    # JSON strings are valid YAML double-quoted scalars, so ujson does the quoting, as in generate_feed
+    dump = _dump
+    header = [f'shop: {dump(shop.name)}\ncategories:\n']
+    for category_id, name in Category.objects.filter(shops=shop).order_by('id').values_list('id', 'name'):
+        header.append(f'  - id: {codes.get(category_id, category_id)}\n    name: {dump(name)}\n')
+    header.append('goods:\n')
+    yield ''.join(header).encode()
+
+    rows = queryset.nocache().filter(shop_id=shop.id).order_by('product_info_id').values_list(
+        'external_id', 'category_id', 'model', 'brand_name', 'product_name', 'price', 'price_rrc', 'quantity',
+        'parameters')
+    for batch in _batches(rows, chunk_size):
+        lines = []
+        for external_id, category_id, model, brand, name, price, price_rrc, quantity, parameters in batch:
+            lines.append(f'  - id: {external_id}\n    category: {codes.get(category_id, category_id)}\n'
+                         f'    model: {dump(model)}\n')
+            if brand is not None:
+                lines.append(f'    brand: {dump(brand)}\n')
+            lines.append(f'    name: {dump(name)}\n    price: {price}\n    price_rrc: {price_rrc}\n'
+                         f'    quantity: {quantity}\n')
+            lines.append('    parameters:\n' if parameters else '    parameters: {}\n')
+            lines.extend(f'      {dump(key)}: {dump(value)}\n' for key, value in parameters.items())
+        yield ''.join(lines).encode()
+
+
+def _batches(queryset, chunk_size):
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while batch := list(islice(rows, chunk_size)):
+        yield batch
+
+
+def _dump(value):
+    return ujson.dumps(value, ensure_ascii=False)
@@ -0,0 +1,288 @@
+"""
+Фасеты каталога: количество товаров по магазинам, категориям, брендам и ценовым диапазонам.
+
+Для каждого значения фасета хранится битовая карта id ProductInfo (ProductFacet). Витрина обновляет карты вместе со
+своими строками, а выдача каталога считает количества пересечением карт вместо GROUP BY по таблице товаров.
+
+Карты распаковываются один раз на процесс и версию индекса. Плотная карта - целое число Python размером
+max_id / 8 байт, пересечение и подсчёт у неё - одна операция над всем числом. Значение, у которого товаров мало
+(бренд или категория с десятком позиций в каталоге из миллионов), так заняло бы столько же памяти, сколько
+«активные» товары, поэтому оно хранится отсортированным массивом id (8 байт на товар), если так меньше.
+Количества редких значений среди всех видимых товаров считаются один раз на версию индекса и набор отключённых
+магазинов, так что выдача без фильтров не перебирает массивы. Только под фильтром массив проверяется по биту
+каждого своего id в отфильтрованной базе: время пропорционально числу его товаров, а не размеру каталога.
+Фильтры по редким значениям разворачиваются в плотную карту на время запроса.
+"""
+import re
+import zlib
+from array import array
+
+from django.db import transaction
+from django.db.models import Max, Q
+
+from backend.models import Brand, Category, ProductFacet, ProductListing, Shop
+from backend.parameters import parameter_matches
+
+ACTIVE = 'active'
+FACETS = ('shop', 'category', 'brand', 'price')
+NAMED_FACETS = {'shop': Shop, 'category': Category, 'brand': Brand}
+FILTER_PARAMS = {'shop': 'shop_id', 'category': 'category_id', 'brand': 'brand_id'}
+FACET_FIELDS = ('product_info_id', 'is_active', 'shop_id', 'category_id', 'brand_id', 'price')
+# нижние границы ценовых диапазонов; после изменения индекс нужно перестроить командой refresh_listings
+PRICE_BUCKETS = (0, 1000, 5000, 10000, 50000, 100000)
+BATCH_SIZE = 10000
+
+# (версия, {фасет: {значение: битовая карта}}) последнего прочитанного индекса
+_loaded = (None, {})
+# (версия индекса, отключённые магазины, карта видимых товаров, {фасет: {редкое значение: видимых товаров}})
+_visible = (None, None, 0, {})
+
+
+def price_bucket(price):
+    return next((bound for bound in reversed(PRICE_BUCKETS) if price >= bound), PRICE_BUCKETS[0])
+
+
+def facet_keys(is_active, shop_id, category_id, brand_id, price):
+    """
+    The (facet, value) pairs a listing row is counted under.
+    """
+    keys = {('shop', shop_id), ('category', category_id), ('price', price_bucket(price))}
+    if brand_id is not None:
+        keys.add(('brand', brand_id))
+    if is_active:
+        keys.add((ACTIVE, 0))
+    return keys
+
+
+def to_bitmap(ids):
+    """
+    Build the bitmap of some ids in a bytearray, setting bits of a big int one by one would copy it every time.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def encode(bitmap):
+    return zlib.compress(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'))
+
+
+def decode(data):
+    return int.from_bytes(zlib.decompress(data), 'little')
+
+
+def compact(bitmap):
+    """
+    Keep a bitmap as a big int, or as a sorted array of its ids when that takes less memory.
+    """
+    if bitmap.bit_count() * 64 >= bitmap.bit_length():
+        return bitmap
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return array('q', [
+        match.start() * 8 + bit
+        for match in re.finditer(rb'[^\x00]', data) for bit in range(8) if match[0][0] >> bit & 1
+    ])
+
+
+def dense(value):
+    """
+    The bitmap of a value loaded by load_index, whichever form it is kept in.
+    """
+    return value if isinstance(value, int) else to_bitmap(value)
+
+
+def update_facets(changes):
+    """
+    Move products between facet values; `changes` maps a ProductInfo id to its (old, new) facet keys.
+    """
+    added, removed = {}, {}
+    for pk, (old, new) in changes.items():
+        for key in old - new:
+            removed.setdefault(key, []).append(pk)
+        for key in new - old:
+            added.setdefault(key, []).append(pk)
+    keys = set(added) | set(removed)
+    if not keys:
+        return
+
+    with transaction.atomic(savepoint=False):
+        _lock()
+        bitmaps = {
+            (facet, value): decode(bitmap)
+            for facet, value, bitmap in ProductFacet.objects.nocache().filter(_keys_query(keys)).values_list(
+                'facet', 'value', 'bitmap')
+        }
+        for key in keys:
+            bitmap = bitmaps.get(key, 0) & ~to_bitmap(removed.get(key, ()))
+            bitmaps[key] = bitmap | to_bitmap(added.get(key, ()))
+        _save(bitmaps)
+
+
+def rebuild_facets(batch_size=BATCH_SIZE):
+    """
+    Recompute the whole index from ProductListing; return the number of non-empty facet values.
+    """
+    with transaction.atomic(savepoint=False):
+        _lock()
+        arrays = {}
+        last_id = 0
+        while rows := list(ProductListing.objects.nocache().filter(product_info_id__gt=last_id).order_by(
+                'product_info_id').values_list(*FACET_FIELDS)[:batch_size]):
+            last_id = rows[-1][0]
+            size = last_id // 8 + 1
+            for pk, *values in rows:
+                for key in facet_keys(*values):
+                    data = arrays.get(key)
+                    if data is None:
+                        data = arrays[key] = bytearray(size)
+                    elif len(data) < size:
+                        data.extend(bytes(size - len(data)))
+                    data[pk >> 3] |= 1 << (pk & 7)
+
+        bitmaps = {key: int.from_bytes(data, 'little') for key, data in arrays.items()}
+        for key in ProductFacet.objects.nocache().values_list('facet', 'value'):
+            bitmaps.setdefault(key, 0)
+        _save(bitmaps)
+    return len(arrays)
+
+
+def _lock():
+    """
+    Serialize index writers on the 'active' row, so that concurrent imports don't overwrite each other's bitmaps.
+    """
+    ProductFacet.objects.bulk_create([ProductFacet(facet=ACTIVE, value=0, bitmap=encode(0))], ignore_conflicts=True)
+    list(ProductFacet.objects.nocache().select_for_update().filter(facet=ACTIVE, value=0).values_list('id'))
+
+
+def _save(bitmaps):
+    # пустые значения остаются с count=0: их удаление не изменило бы версию индекса (Max(updated_at))
+    ProductFacet.objects.bulk_create(
+        [ProductFacet(facet=facet, value=value, bitmap=encode(bitmap), count=bitmap.bit_count())
+         for (facet, value), bitmap in bitmaps.items()],
+        update_conflicts=True, unique_fields=['facet', 'value'], update_fields=['bitmap', 'count', 'updated_at'],
+    )
+
+
+def _keys_query(keys):
+    condition = Q()
+    for facet, value in keys:
+        condition |= Q(facet=facet, value=value)
+    return condition
+
+
+def load_index():
+    """
+    Return {facet: {value: bitmap or array of ids}}, decoded again only when the stored index has changed.
+    """
+    global _loaded
+    version = ProductFacet.objects.nocache().aggregate(version=Max('updated_at'))['version']
+    if version is None or version != _loaded[0]:
+        index = {facet: {} for facet in (ACTIVE,) + FACETS}
+        for facet, value, bitmap in ProductFacet.objects.nocache().filter(count__gt=0).values_list(
+                'facet', 'value', 'bitmap'):
+            index[facet][value] = compact(decode(bitmap))
+        _loaded = (version, index)
+    return _loaded[1]
+
+
+def facet_counts(params):
+    """
+    Count the visible products of every facet value under the shop_id, category_id, brand_id, brand and numeric
+    parameter filters.
+
+    The counts of a facet ignore its own filter, so the other values of that facet stay selectable.
+    """
+    index = load_index()
+    visible, visible_counts = _visible_products(
+        index, tuple(Shop.objects.filter(state=False).order_by('id').values_list('id', flat=True)))
+    filtered = False
+    for product_info_ids in parameter_matches(params):
+        filtered = True
+        visible &= to_bitmap(product_info_ids.values_list('product_info_id', flat=True))
+
+    filters = {}
+    for facet, param in FILTER_PARAMS.items():
+        value = params.get(param)
+        if value:
+            filters[facet] = dense(index[facet].get(_to_int(value), 0))
+    brand = params.get('brand')
+    if brand:
+        bitmap = 0
+        for brand_id in Brand.objects.filter(name=brand).values_list('id', flat=True):
+            bitmap |= dense(index['brand'].get(brand_id, 0))
+        filters['brand'] = filters.get('brand', bitmap) & bitmap
+
+    counts = {}
+    for facet in FACETS:
+        base = visible
+        others = [bitmap for other, bitmap in filters.items() if other != facet]
+        for bitmap in others:
+            base &= bitmap
+        counts[facet] = _count(base, index[facet], None if filtered or others else visible_counts[facet])
+    return _describe(counts)
+
+
+def _visible_products(index, hidden):
+    """
+    The bitmap of the active products of the enabled shops and the counts of the sparse values among them, kept
+    until the index or the set of `hidden` shops changes.
+    """
+    global _visible
+    if _visible[:2] != (_loaded[0], hidden):
+        visible = dense(index[ACTIVE].get(0, 0))
+        for shop_id in hidden:
+            visible &= ~dense(index['shop'].get(shop_id, 0))
+        counts = {
+            facet: _count(visible, {value: ids for value, ids in index[facet].items() if not isinstance(ids, int)})
+            for facet in FACETS
+        }
+        _visible = (_loaded[0], hidden, visible, counts)
+    return _visible[2], _visible[3]
+
+
+def _count(base, values, sparse_counts=None):
+    """
+    {value: number of its products in `base`} for the non-empty values. The sparse ones are taken from
+    `sparse_counts` when given, else `base` is turned into bytes once and their ids are checked in it.
+    """
+    counts = {}
+    data = None
+    for value, bitmap in values.items():
+        if isinstance(bitmap, int):
+            count = (base & bitmap).bit_count()
+        elif sparse_counts is not None:
+            count = sparse_counts.get(value, 0)
+        else:
+            if data is None:
+                data = base.to_bytes((base.bit_length() + 7) // 8, 'little')
+            size = len(data)
+            count = sum(data[pk >> 3] >> (pk & 7) & 1 for pk in bitmap if pk >> 3 < size)
+        if count:
+            counts[value] = count
+    return counts
+
+
+def _describe(counts):
+    result = {}
+    for facet, model in NAMED_FACETS.items():
+        names = dict(model.objects.filter(id__in=counts[facet]).values_list('id', 'name'))
+        result[facet] = [
+            {'id': value, 'name': names.get(value, ''), 'count': count}
+            for value, count in sorted(counts[facet].items(), key=lambda item: (-item[1], item[0]))
+        ]
+    result['price'] = [
+        {'from': low, 'to': high, 'count': counts['price'][low]}
+        for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,)) if low in counts['price']
+    ]
+    return result
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,180 @@
+"""
+Быстрая сериализация для нагруженных списков: товары каталога, заказы покупателя и магазина.
+
+Ответ собирается словарями прямо из строк `.values()` / `.values_list()` и пакетных запросов связанных строк,
+без экземпляров моделей и объектов полей сериализаторов на каждую строку. Результат совпадает с выводом
+ProductListingSerializer и OrderSerializer; это проверяют тесты на совпадение.
+
+Параметры `?fields=` и `?include=` сокращают ответ: `fields` перечисляет нужные поля верхнего уровня, `include` -
+вложенные объекты заказа, которые разворачиваются целиком (остальные отдаются своим id). Столбцы, соединения и
+пакетные запросы для невостребованных полей не выполняются.
+"""
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.db.models import F, Sum
+from rest_framework import serializers
+
+from backend.models import Contact, OrderItem, ProductParameter
+
+# поля DRF, которыми ModelSerializer форматирует цены и даты; одни экземпляры на все строки
+PRICE = serializers.DecimalField(max_digits=18, decimal_places=2)
+DATETIME = serializers.DateTimeField()
+
+# поле ответа: (столбцы ProductListing, значение из строки .values())
+LISTING_FIELDS = {
+    'id': (('product_info_id',), lambda row, request: row['product_info_id']),
+    'product': (('product_name', 'category_name'),
+                lambda row, request: {'name': row['product_name'], 'category': row['category_name']}),
+    'model': (('model',), lambda row, request: row['model']),
+    'brand': (('brand_id', 'brand_name'),
+              lambda row, request: {'name': row['brand_name']} if row['brand_id'] is not None else None),
+    'shop': (('shop_id',), lambda row, request: row['shop_id']),
+    'external_id': (('external_id',), lambda row, request: row['external_id']),
+    'quantity': (('quantity',), lambda row, request: row['quantity']),
+    'price': (('price',), lambda row, request: PRICE.to_representation(row['price'])),
+    'price_rrc': (('price_rrc',), lambda row, request: PRICE.to_representation(row['price_rrc'])),
+    'image': (('image',), lambda row, request: _image_url(row['image'], request)),
+    'parameters': (('parameters',), lambda row, request: [
+        {'parameter': name, 'value': value} for name, value in row['parameters'].items()
+    ]),
+}
+# the keyset pagination reads the cursor position from these columns
+LISTING_KEY_VALUES = ('product_info_id', 'price')
+ORDER_FIELDS = ('id', 'user', 'order_items', 'state', 'created', 'total_sum', 'contact')
+ORDER_INCLUDES = ('product_info', 'parameters', 'contact')
+PRODUCT_INFO_VALUES = (
+    'product_info__product__name', 'product_info__product__category__name', 'product_info__model',
+    'product_info__brand_id', 'product_info__brand__name', 'product_info__shop_id', 'product_info__external_id',
+    'product_info__quantity', 'product_info__price', 'product_info__price_rrc',
+)
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+
+def fieldset(params, fields, includes=()):
+    """
+    Read `?fields=` and `?include=` (comma-separated; missing or empty means all) as (fields, includes) in the
+    order of the known names; an unknown name raises ValueError.
+    """
+    requested = _names(params, 'fields') or set(fields)
+    included = _names(params, 'include') or set(includes)
+    unknown = (requested - set(fields)) | (included - set(includes))
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return tuple(name for name in fields if name in requested), tuple(name for name in includes if name in included)
+
+
+def listing_values(fields=tuple(LISTING_FIELDS)):
+    """
+    ProductListing columns behind the fields, plus the pagination key.
+    """
+    values = dict.fromkeys(LISTING_KEY_VALUES)
+    for name in fields:
+        values.update(dict.fromkeys(LISTING_FIELDS[name][0]))
+    return tuple(values)
+
+
+def listing_rows(rows, request=None, fields=tuple(LISTING_FIELDS)):
+    """
+    ProductListingSerializer output, limited to `fields`, for ProductListing `.values(*listing_values(fields))` rows.
+    """
+    builders = [(name, LISTING_FIELDS[name][1]) for name in fields]
+    return [{name: build(row, request) for name, build in builders} for row in rows]
+
+
+def order_rows(queryset, fields=ORDER_FIELDS, includes=ORDER_INCLUDES):
+    """
+    OrderSerializer output, limited to `fields`, for an Order queryset. `total_sum` is annotated here, so an
+    earlier filter on the order items limits the sum.
+
+    Product infos and contacts missing from `includes` are given by id, parameters missing from it are left out.
+    """
+    values = ['id']
+    if 'user' in fields:
+        values.append('user_id')
+    values += [name for name in ('state', 'created') if name in fields]
+    if 'total_sum' in fields:
+        queryset = queryset.annotate(
+            total_sum=Sum(F('order_items__quantity') * F('order_items__product_info__price')))
+        values.append('total_sum')
+    if 'contact' in fields:
+        values.append('contact_id')
+    orders = list(queryset.values(*values))
+
+    items = _order_items([order['id'] for order in orders], includes) if 'order_items' in fields else {}
+    contacts = {}
+    if 'contact' in fields and 'contact' in includes:
+        contacts = {
+            contact['id']: contact for contact in Contact.objects.filter(
+                id__in={order['contact_id'] for order in orders if order['contact_id'] is not None}
+            ).values(*CONTACT_FIELDS)
+        }
+
+    result = []
+    for order in orders:
+        row = {}
+        for name in fields:
+            if name == 'user':
+                row[name] = order['user_id']
+            elif name == 'order_items':
+                row[name] = items.get(order['id'], [])
+            elif name == 'created':
+                row[name] = DATETIME.to_representation(order['created'])
+            elif name == 'total_sum':
+                row[name] = int(order['total_sum']) if order['total_sum'] is not None else None
+            elif name == 'contact':
+                row[name] = contacts.get(order['contact_id']) if 'contact' in includes else order['contact_id']
+            else:
+                row[name] = order[name]
+        result.append(row)
+    return result
+
+
+def _order_items(order_ids, includes):
+    """
+    {order id: [order item]} in the shape of OrderItemCreateSerializer.
+    """
+    items = defaultdict(list)
+    queryset = OrderItem.objects.filter(order_id__in=order_ids).order_by('id')
+    if 'product_info' not in includes:
+        for pk, order_id, quantity, product_info_id in queryset.values_list(
+                'id', 'order_id', 'quantity', 'product_info_id'):
+            items[order_id].append({'id': pk, 'product_info': product_info_id, 'quantity': quantity})
+        return items
+
+    rows = list(queryset.values_list('id', 'order_id', 'quantity', 'product_info_id', *PRODUCT_INFO_VALUES))
+    parameters = defaultdict(list)
+    if 'parameters' in includes:
+        for product_info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in={row[3] for row in rows}).order_by('id').values_list(
+                'product_info_id', 'parameter__name', 'value'):
+            parameters[product_info_id].append({'parameter': name, 'value': value})
+    for (pk, order_id, quantity, product_info_id, product_name, category_name, model, brand_id, brand_name, shop_id,
+         external_id, stock, price, price_rrc) in rows:
+        product_info = {
+            'product': {'name': product_name, 'category': category_name},
+            'model': model,
+            'brand': {'name': brand_name} if brand_id is not None else None,
+            'shop': shop_id,
+            'external_id': external_id,
+            'quantity': stock,
+            'price': PRICE.to_representation(price),
+            'price_rrc': PRICE.to_representation(price_rrc),
+            # ProductInfoSerializer renders the Image relation with an ImageField, which always gives None
+            'image': None,
+        }
+        if 'parameters' in includes:
+            product_info['parameters'] = parameters[product_info_id]
+        items[order_id].append({'id': pk, 'product_info': product_info, 'quantity': quantity})
+    return items
+
+
+def _names(params, name):
+    return {value.strip() for value in params.get(name, '').split(',') if value.strip()}
+
+
+def _image_url(image, request):
+    if not image:
+        return None
+    url = default_storage.url(image)
+    return request.build_absolute_uri(url) if request is not None else url
@@ -0,0 +1,345 @@
+"""
+Потоковое чтение прайс-листов партнёров.
+
+Прайс-лист принимается в формате YAML (как `data/shop.yaml`), JSON Lines или CSV; формат определяется по
+Content-Type ответа или по расширению файла в URL. Каждый читатель отдаёт один и тот же словарь
+{'shop', 'categories', 'goods'}, где 'goods' - генератор товаров, поэтому в памяти одновременно находится
+только один товар, а не весь файл и не всё дерево Python-объектов.
+"""
+import csv
+import hashlib
+import io
+from pathlib import PurePosixPath
+from tempfile import SpooledTemporaryFile
+from urllib.parse import urlsplit
+
+import ujson
+from requests import get
+from yaml import YAMLError
+from yaml.events import (AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent,
+                         MappingEndEvent, StreamStartEvent, DocumentStartEvent)
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+
+from backend.models import ShopFeed
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+
+class FeedError(YAMLError):
+    """
+    The feed cannot be parsed or does not follow the `data/shop.yaml` layout.
+    """
+
+
+class YAMLFeedReader:
+    """
+    Read a feed of the `data/shop.yaml` shape from a file-like object.
+
+    `read()` parses the document up to the `goods` key and returns a dict whose 'goods' value is a
+    generator, so the import engine pulls products one by one while the stream is still being read.
+    """
+
+    def __init__(self, stream):
+        self.loader = SafeLoader(stream)
+        self.anchors = {}
+
+    def read(self):
+        loader = self.loader
+        self._expect(StreamStartEvent)
+        self._expect(DocumentStartEvent)
+        self._expect(MappingStartEvent)
+        feed = {}
+        while not loader.check_event(MappingEndEvent):
+            key = self._construct(loader.get_event())
+            if key == 'goods':
+                if 'shop' not in feed or 'categories' not in feed:
+                    raise FeedError("'shop' and 'categories' must precede 'goods'")
+                feed['goods'] = self._iter_goods()
+                return feed
+            feed[key] = self._construct(loader.get_event())
+        raise FeedError("The feed has no 'goods' section")
+
+    def _iter_goods(self):
+        loader = self.loader
+        try:
+            self._expect(SequenceStartEvent)
+            while not loader.check_event(SequenceEndEvent):
+                yield self._construct(loader.get_event())
+        finally:
+            loader.dispose()
+
+    def _construct(self, event):
+        return self.loader.construct_document(self._compose(event))
+
+    def _compose(self, event):
+        """
+        Build a node from `event` and the events of its children, like `Composer.compose_node` does.
+        """
+        loader = self.loader
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self.anchors:
+                raise FeedError(f'Found undefined alias {event.anchor!r}')
+            return self.anchors[event.anchor]
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self._compose(loader.get_event()))
+            node.end_mark = loader.get_event().end_mark
+        elif isinstance(event, MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not loader.check_event(MappingEndEvent):
+                item_key = self._compose(loader.get_event())
+                item_value = self._compose(loader.get_event())
+                node.value.append((item_key, item_value))
+            node.end_mark = loader.get_event().end_mark
+        else:
+            raise FeedError(f'Unexpected {event}')
+        if getattr(event, 'anchor', None) is not None:
+            self.anchors[event.anchor] = node
+        return node
+
+    def _expect(self, event_class):
+        event = self.loader.get_event()
+        if not isinstance(event, event_class):
+            raise FeedError(f'Expected {event_class.__name__}, got {event}')
+        return event
+
+
+def read_yaml_feed(stream):
+    """
+    Shortcut for `YAMLFeedReader(stream).read()`.
+    """
+    return YAMLFeedReader(stream).read()
+
+
+class JSONLinesFeedReader:
+    """
+    Read a JSON Lines feed from a binary file-like object.
+
+    The first line holds `shop` and `categories`, every next line is one product shaped like an item of `goods`
+    in `data/shop.yaml`.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self):
+        header = self._parse(self.stream.readline(), 1)
+        if not isinstance(header, dict) or 'shop' not in header or 'categories' not in header:
+            raise FeedError("The first line must hold 'shop' and 'categories'")
+        return {'shop': header['shop'], 'categories': header['categories'], 'goods': self._iter_goods()}
+
+    def _iter_goods(self):
+        for number, line in enumerate(self.stream, 2):
+            if line.strip():
+                yield self._parse(line, number)
+
+    @staticmethod
+    def _parse(line, number):
+        try:
+            return ujson.loads(line)
+        except ValueError as exc:
+            raise FeedError(f'Line {number}: {exc}') from exc
+
+
+CSV_COLUMNS = ('shop', 'category_id', 'category', 'id', 'name', 'model', 'brand', 'price', 'price_rrc', 'quantity',
+               'parameters')
+
+
+class CSVFeedReader:
+    """
+    Read a CSV feed with a header row of CSV_COLUMNS from a binary file-like object.
+
+    Every row repeats the shop and its category, `parameters` holds a JSON object. The shop and the category list
+    are collected in a first pass, then the stream is rewound and the goods are read in a second one, so the stream
+    must be seekable; downloaded feeds always are.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self):
+        shop, categories = None, {}
+        for number, row in self._rows():
+            shop = shop or row['shop']
+            categories.setdefault(self._int(row, 'category_id', number), row['category'])
+        if shop is None:
+            raise FeedError('The feed has no goods')
+        return {
+            'shop': shop,
+            'categories': [{'id': category_id, 'name': name} for category_id, name in categories.items()],
+            'goods': (self._item(row, number) for number, row in self._rows()),
+        }
+
+    def _rows(self):
+        self.stream.seek(0)
+        text = io.TextIOWrapper(self.stream, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.DictReader(text)
+            missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise FeedError(f'Missing columns: {", ".join(sorted(missing))}')
+            try:
+                yield from enumerate(reader, 2)
+            except (csv.Error, UnicodeDecodeError) as exc:
+                raise FeedError(f'Line {reader.line_num}: {exc}') from exc
+        finally:
+            # keep the underlying file open when the wrapper is garbage collected
+            text.detach()
+
+    def _item(self, row, number):
+        try:
+            parameters = ujson.loads(row['parameters'] or '{}')
+        except ValueError as exc:
+            raise FeedError(f'Line {number}: parameters: {exc}') from exc
+        return {
+            'id': self._int(row, 'id', number),
+            'category': self._int(row, 'category_id', number),
+            'model': row['model'],
+            'brand': row['brand'],
+            'name': row['name'],
+            'price': row['price'],
+            'price_rrc': row['price_rrc'],
+            'quantity': self._int(row, 'quantity', number),
+            'parameters': parameters,
+        }
+
+    @staticmethod
+    def _int(row, column, number):
+        try:
+            return int(row[column])
+        except (TypeError, ValueError) as exc:
+            raise FeedError(f'Line {number}: {column}: {exc}') from exc
+
+
+FEED_READERS = {'yaml': YAMLFeedReader, 'jsonl': JSONLinesFeedReader, 'csv': CSVFeedReader}
+
+FEED_CONTENT_TYPES = {
+    'application/x-yaml': 'yaml',
+    'application/yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'text/x-yaml': 'yaml',
+    'application/jsonl': 'jsonl',
+    'application/x-jsonlines': 'jsonl',
+    'application/x-ndjson': 'jsonl',
+    'text/csv': 'csv',
+}
+
+FEED_EXTENSIONS = {'.yaml': 'yaml', '.yml': 'yaml', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+
+
+def feed_format(content_type='', url=''):
+    """
+    Pick the feed format by Content-Type, then by the extension of the URL path; YAML is the default.
+    """
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type in FEED_CONTENT_TYPES:
+        return FEED_CONTENT_TYPES[media_type]
+    return FEED_EXTENSIONS.get(PurePosixPath(urlsplit(url).path).suffix.lower(), 'yaml')
+
+
+def read_feed(stream, content_type='', url=''):
+    """
+    Read a feed of any supported format into {'shop', 'categories', 'goods'} with 'goods' as a generator.
+    """
+    return FEED_READERS[feed_format(content_type, url)](stream).read()
+
+
+class DownloadedFeed:
+    """
+    A feed body spooled to a temporary file together with its SHA-256 and HTTP validators.
+
+    `not_modified` is set when the source answered 304 or the body hashes to the same value as the previous
+    import of the shop, in which case there is nothing to parse.
+    """
+
+    def __init__(self, url, previous=None):
+        self.url = url
+        self.previous = previous if previous is not None and previous.url == url else None
+        self.file = None
+        self.sha256 = ''
+        self.etag = ''
+        self.last_modified = ''
+        self.content_type = ''
+        self.not_modified = False
+
+    def download(self, timeout=60):
+        headers = {}
+        if self.previous is not None:
+            if self.previous.etag:
+                headers['If-None-Match'] = self.previous.etag
+            if self.previous.last_modified:
+                headers['If-Modified-Since'] = self.previous.last_modified
+
+        with get(self.url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                if not headers:
+                    raise FeedError('The source answered 304 Not Modified to an unconditional request')
+                self.not_modified = True
+                return self
+            response.raise_for_status()
+            self.etag = response.headers.get('ETag', '')
+            self.last_modified = response.headers.get('Last-Modified', '')
+            self.content_type = response.headers.get('Content-Type', '')
+            digest = hashlib.sha256()
+            self.file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                self.file.write(chunk)
+            self.file.seek(0)
+
+        self.sha256 = digest.hexdigest()
+        self.not_modified = self.previous is not None and self.previous.sha256 == self.sha256
+        return self
+
+    def read(self):
+        self.file.seek(0)
+        return read_feed(self.file, self.content_type, self.url)
+
+    def validators(self):
+        return {'url': self.url, 'sha256': self.sha256, 'etag': self.etag, 'last_modified': self.last_modified}
+
+    def remember(self, shop):
+        """
+        Store the hash and validators of this feed as the shop's last imported one.
+        """
+        remember_feed(shop.id, self.validators())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def remember_feed(shop_id, validators):
+    ShopFeed.objects.update_or_create(shop_id=shop_id, defaults=validators)
+
+
+def fetch_feed(url, user_id, timeout=60):
+    """
+    Download the feed at `url`, comparing it with the last feed imported for the user's shop.
+    """
+    previous = ShopFeed.objects.filter(shop__user_id=user_id).first()
+    return DownloadedFeed(url, previous).download(timeout=timeout)
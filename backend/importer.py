@@ -0,0 +1,654 @@
+"""
+Импорт прайс-листов партнёров пакетными запросами.
+
+Справочники (категории, товары, бренды, параметры) загружаются в словари name -> id один раз за импорт,
+недостающие записи создаются пачками. Строки ProductInfo сверяются с уже загруженными по артикулу (external_id):
+новые вставляются через bulk_create, изменённые обновляются через bulk_update, пропавшие из прайса снимаются
+с продажи.
+"""
+import io
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from backend.listings import refresh_listings
+from backend.models import Shop, Category, Product, Brand, Parameter, ProductInfo, ProductParameter, ImportJob, \
+    ShopCategory
+from backend.serializers import ImportJobSerializer
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+JOB_STATUS_TIMEOUT = 60 * 60 * 24
+CENT = Decimal('0.01')
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+PRODUCT_INFO_FIELDS = ('product_id', 'brand_id', 'model', 'price', 'price_rrc', 'quantity', 'is_active')
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImportStats:
+    """
+    Counters of a single import run.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.products = 0
+        self.parameters = 0
+        self.parse_time = 0.0
+        self.db_time = 0.0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rows(self):
+        return self.products + self.parameters
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.elapsed
+        return round(self.rows / elapsed, 1) if elapsed else 0.0
+
+    def merge(self, data):
+        """
+        Add up counters of a chunk imported by another worker (`as_dict()` output).
+        """
+        for name in ('products', 'parameters', 'parse_time', 'db_time', 'inserted', 'updated', 'unchanged',
+                     'removed'):
+            setattr(self, name, getattr(self, name) + data[name])
+
+    def as_dict(self):
+        return {
+            'products': self.products,
+            'parameters': self.parameters,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'removed': self.removed,
+            'parse_time': round(self.parse_time, 3),
+            'db_time': round(self.db_time, 3),
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_sec': self.rows_per_sec,
+        }
+
+
+class JobReporter:
+    """
+    Keep an ImportJob up to date while the import task runs.
+
+    The import runs in a single transaction, so batch progress would stay invisible in the job's row until commit.
+    It is published to the cache instead; the row is written when the job starts and finishes.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def start(self):
+        self.job.state = 'running'
+        self.job.started = timezone.now()
+        self.job.save(update_fields=['state', 'started'])
+        self.publish()
+
+    def progress(self, stats):
+        self.apply(stats)
+        self.publish()
+
+    def finish(self, state, stats=None, error='', report=None):
+        self.job.state = state
+        self.job.error = error
+        self.job.finished = timezone.now()
+        if stats is not None:
+            self.apply(stats)
+        if report is not None:
+            self.apply_report(report)
+        self.job.save()
+        self.publish()
+
+    def apply(self, stats):
+        self.job.products_processed = stats.products
+        self.job.rows_per_sec = stats.rows_per_sec
+        self.job.parse_time = round(stats.parse_time, 3)
+        self.job.db_time = round(stats.db_time, 3)
+        self.job.summary = stats.as_dict()
+
+    def apply_report(self, report):
+        """
+        Store a `backend.validation` report of a dry run or a rejected feed as the job's summary.
+        """
+        self.job.products_processed = report['products']
+        self.job.rows_per_sec = report['rows_per_sec']
+        self.job.parse_time = report['elapsed']
+        self.job.summary = report
+
+    def publish(self):
+        cache.set(job_status_key(self.job.id), ImportJobSerializer(self.job).data, JOB_STATUS_TIMEOUT)
+
+
+def job_status_key(job_id):
+    return f'import_job:{job_id}'
+
+
+def get_job_status(job_id, user_id):
+    """
+    Return the serialized state of the user's import job, from the cache when possible, or None.
+    """
+    data = cache.get(job_status_key(job_id))
+    if data is None or data['user'] != user_id:
+        job = ImportJob.objects.filter(id=job_id, user_id=user_id).first()
+        if job is None:
+            return None
+        data = ImportJobSerializer(job).data
+        cache.set(job_status_key(job_id), data, JOB_STATUS_TIMEOUT)
+    return data
+
+
+class ShopImporter:
+    """
+    Import a partner price list of the `data/shop.yaml` shape.
+
+    Rows are matched to the shop's existing ProductInfo by external_id: new SKUs are inserted, changed ones are
+    updated column by column, and SKUs missing from the feed are retired (`is_active=False`) rather than deleted,
+    so baskets and order history keep pointing at them.
+
+    `progress`, if given, is called with the running ImportStats after every batch.
+
+    Usage:
+        stats = ShopImporter(user_id).run(data)
+    """
+
+    def __init__(self, user_id, batch_size=BATCH_SIZE, progress=None):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.progress = progress
+        self.shop = None
+        self.categories = {}
+        self.category_ids = {}
+        self.products = {}
+        self.brands = {}
+        self.parameters = {}
+        self.existing = {}
+        self.seen = set()
+        self.touched = set()
+
+    def run(self, data):
+        stats = ImportStats()
+        with transaction.atomic():
+            self.prepare(data)
+            self.load_existing()
+            chunks = chunked(data['goods'], self.batch_size)
+            while True:
+                started = time.monotonic()
+                chunk = next(chunks, None)
+                stats.parse_time += time.monotonic() - started
+                if chunk is None:
+                    break
+                started = time.monotonic()
+                self.write_records(self.make_records(chunk), stats)
+                stats.db_time += time.monotonic() - started
+                if self.progress is not None:
+                    self.progress(stats)
+            self.retire_missing(stats)
+            started = time.monotonic()
+            refresh_listings(self.touched)
+            stats.db_time += time.monotonic() - started
+        stats.finish()
+        logger.info('Shop %s imported: %s', self.shop.id, stats.as_dict())
+        return stats
+
+    def split(self, data, chunk_size):
+        """
+        Resolve the whole feed against the dictionaries and cut it into chunks of records for `import_records`.
+
+        Everything shared between chunks (shop, categories, brands, parameters, products) is created here and
+        committed, so chunk workers only touch the shop's own ProductInfo/ProductParameter rows.
+        """
+        stats = ImportStats()
+        chunks = []
+        with transaction.atomic():
+            self.prepare(data)
+            for goods in chunked(data['goods'], self.batch_size):
+                chunks.extend(chunked(self.make_records(goods), chunk_size))
+        stats.finish()
+        stats.parse_time = stats.elapsed
+        return chunks, stats
+
+    @classmethod
+    def import_records(cls, shop_id, records, batch_size=BATCH_SIZE):
+        """
+        Upsert one chunk of records produced by `split`; the chunk is written in its own transaction.
+        """
+        stats = ImportStats()
+        importer = cls(None, batch_size=batch_size)
+        with transaction.atomic():
+            importer.shop = Shop.objects.get(id=shop_id)
+            importer.load_existing([record['external_id'] for record in records])
+            importer.write_records(records, stats)
+            refresh_listings(importer.touched)
+        stats.finish()
+        stats.db_time = stats.elapsed
+        return stats
+
+    @classmethod
+    def retire(cls, shop_id, seen):
+        """
+        Retire the shop's SKUs whose external ids are not in `seen`.
+        """
+        stats = ImportStats()
+        importer = cls(None)
+        importer.shop = Shop.objects.get(id=shop_id)
+        importer.seen = set(seen)
+        with transaction.atomic():
+            importer.load_existing()
+            importer.retire_missing(stats)
+            refresh_listings(importer.touched)
+        return stats.removed
+
+    def prepare(self, data):
+        self.shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=self.user_id)
+        self.load_categories(data['categories'])
+        self.load_dictionaries()
+
+    def load_categories(self, categories):
+        """
+        Resolve feed category ids to categories and link them to the shop.
+
+        Ids mapped by an earlier import (ShopCategory) are resolved with a single query; new ids and ids whose
+        name changed in the feed are resolved by name, missing categories are created, and the mapping is saved.
+        """
+        mapped = {
+            external_id: (category_id, name) for external_id, category_id, name in ShopCategory.objects.filter(
+                shop_id=self.shop.id).values_list('external_id', 'category_id', 'category__name')
+        }
+        self.categories = {}
+        unmapped = []
+        for category in categories:
+            category_id, name = mapped.get(category['id'], (None, None))
+            if name == category['name']:
+                self.category_ids[category['id']] = self.categories[name] = category_id
+            else:
+                unmapped.append(category)
+        if unmapped:
+            names = {category['name'] for category in unmapped} - self.categories.keys()
+            self.categories.update(Category.objects.filter(name__in=names).values_list('name', 'id'))
+            self._create_missing(
+                Category, names, self.categories,
+                lambda name: Category(name=name, slug=slugify(name))
+            )
+            for category in unmapped:
+                self.category_ids[category['id']] = self.categories[category['name']]
+            ShopCategory.objects.bulk_create(
+                [ShopCategory(shop_id=self.shop.id, external_id=external_id, category_id=self.category_ids[external_id])
+                 for external_id in {category['id'] for category in unmapped}],
+                update_conflicts=True, unique_fields=['shop', 'external_id'], update_fields=['category'],
+            )
+        through = Category.shops.through
+        through.objects.bulk_create(
+            [through(category_id=category_id, shop_id=self.shop.id) for category_id in set(self.categories.values())],
+            ignore_conflicts=True,
+        )
+
+    def load_dictionaries(self):
+        """
+        Preload brands, parameters and products of the feed categories into name -> id maps.
+        """
+        self.brands = dict(Brand.objects.values_list('name', 'id'))
+        self.parameters = dict(Parameter.objects.values_list('name', 'id'))
+        self.products = {
+            (name, category_id): product_id
+            for product_id, name, category_id in Product.objects.filter(
+                category_id__in=self.categories.values()).values_list('id', 'name', 'category_id')
+        }
+
+    def load_existing(self, external_ids=None):
+        """
+        Load the shop's current rows as external_id -> (id, *PRODUCT_INFO_FIELDS).
+        """
+        queryset = ProductInfo.objects.filter(shop_id=self.shop.id)
+        if external_ids is not None:
+            queryset = queryset.filter(external_id__in=external_ids)
+        self.existing = {
+            row[1]: (row[0],) + row[2:]
+            for row in queryset.values_list(
+                'id', 'external_id', *PRODUCT_INFO_FIELDS).iterator(chunk_size=self.batch_size)
+        }
+
+    def make_records(self, goods):
+        """
+        Turn feed goods into records that refer to dictionaries by id and survive a JSON round trip.
+        """
+        return [{
+            'external_id': item['id'],
+            'product_id': self.products[(item['name'], self.category_id(item))],
+            'brand_id': self.brands.get(item.get('brand')),
+            'model': item['model'],
+            'price': str(to_price(item['price'])),
+            'price_rrc': str(to_price(item['price_rrc'])),
+            'quantity': item['quantity'],
+            'parameters': {str(self.parameters[name]): str(value) for name, value in item['parameters'].items()},
+        } for item in self.resolve_dictionaries(goods)]
+
+    def write_records(self, records, stats):
+        new_records, current_records, updates = [], [], defaultdict(list)
+        for record in records:
+            values = self.product_info_values(record)
+            row = self.existing.get(record['external_id'])
+            if row is None:
+                new_records.append(
+                    (ProductInfo(shop_id=self.shop.id, external_id=record['external_id'], **values), record))
+                continue
+            changed = tuple(field for field, old in zip(PRODUCT_INFO_FIELDS, row[1:]) if old != values[field])
+            if changed:
+                updates[changed].append(ProductInfo(id=row[0], **values))
+            current_records.append((row[0], record, bool(changed)))
+
+        created = ProductInfo.objects.bulk_create([obj for obj, _ in new_records], batch_size=self.batch_size)
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value)
+            for product_info, (_, record) in zip(created, new_records)
+            for parameter_id, value in self.parameter_values(record).items()
+        ], batch_size=self.batch_size)
+        for fields, objs in updates.items():
+            ProductInfo.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+        changed_parameters = self.sync_parameters(current_records)
+
+        stats.inserted += len(created)
+        self.touched.update(product_info.id for product_info in created)
+        for product_info_id, _, changed in current_records:
+            if changed or product_info_id in changed_parameters:
+                self.touched.add(product_info_id)
+                stats.updated += 1
+            else:
+                stats.unchanged += 1
+        stats.products += len(records)
+        stats.parameters += sum(len(record['parameters']) for record in records)
+
+    def resolve_dictionaries(self, goods):
+        """
+        Drop SKUs already seen in this feed and create the brands, parameters and products the chunk refers to.
+        """
+        goods = [item for item in goods if item['id'] not in self.seen]
+        self.seen.update(item['id'] for item in goods)
+        self._create_missing(
+            Brand, {item['brand'] for item in goods if item.get('brand')}, self.brands,
+            lambda name: Brand(name=name, slug=slugify(name))
+        )
+        self._create_missing(
+            Parameter, {name for item in goods for name in item['parameters']}, self.parameters,
+            lambda name: Parameter(name=name)
+        )
+        self._create_missing(
+            Product, {(item['name'], self.category_id(item)) for item in goods}, self.products,
+            lambda key: Product(name=key[0], category_id=key[1]),
+            key=lambda obj: (obj.name, obj.category_id)
+        )
+        return goods
+
+    def sync_parameters(self, current_records):
+        """
+        Bring parameters of already imported SKUs in line with the feed; return ids of the SKUs that changed.
+        """
+        current = defaultdict(dict)
+        for pk, product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                product_info_id__in=[product_info_id for product_info_id, _, _ in current_records]
+        ).values_list('id', 'product_info_id', 'parameter_id', 'value'):
+            current[product_info_id][parameter_id] = (pk, value)
+
+        created, updated, deleted, changed = [], [], [], set()
+        for product_info_id, record, _ in current_records:
+            old = current[product_info_id]
+            new = self.parameter_values(record)
+            for parameter_id, value in new.items():
+                if parameter_id not in old:
+                    created.append(ProductParameter(
+                        product_info_id=product_info_id, parameter_id=parameter_id, value=value))
+                elif old[parameter_id][1] != value:
+                    updated.append(ProductParameter(id=old[parameter_id][0], value=value))
+                else:
+                    continue
+                changed.add(product_info_id)
+            for parameter_id, (pk, _) in old.items():
+                if parameter_id not in new:
+                    deleted.append(pk)
+                    changed.add(product_info_id)
+
+        ProductParameter.objects.bulk_create(created, batch_size=self.batch_size)
+        ProductParameter.objects.bulk_update(updated, ['value'], batch_size=self.batch_size)
+        if deleted:
+            ProductParameter.objects.filter(id__in=deleted).delete()
+        return changed
+
+    def retire_missing(self, stats):
+        """
+        Deactivate the shop's SKUs that are absent from the feed.
+        """
+        missing = [row[0] for external_id, row in self.existing.items()
+                   if external_id not in self.seen and row[-1]]
+        for chunk in chunked(missing, self.batch_size):
+            stats.removed += ProductInfo.objects.filter(id__in=chunk).update(is_active=False)
+        self.touched.update(missing)
+
+    def product_info_values(self, record):
+        return {
+            'product_id': record['product_id'],
+            'brand_id': record['brand_id'],
+            'model': record['model'],
+            'price': to_price(record['price']),
+            'price_rrc': to_price(record['price_rrc']),
+            'quantity': record['quantity'],
+            'is_active': True,
+        }
+
+    @staticmethod
+    def parameter_values(record):
+        return {int(parameter_id): value for parameter_id, value in record['parameters'].items()}
+
+    def category_id(self, item):
+        return self.category_ids[item['category']]
+
+    def _create_missing(self, model, keys, mapping, build, key=lambda obj: obj.name):
+        missing = [value for value in keys if value not in mapping]
+        if missing:
+            for obj in model.objects.bulk_create([build(value) for value in missing], batch_size=self.batch_size):
+                mapping[key(obj)] = obj.id
+
+
+class CopyShopImporter(ShopImporter):
+    """
+    PostgreSQL-only importer for the largest feeds.
+
+    Records are streamed with COPY into temporary staging tables (never WAL-logged, dropped on commit) and merged
+    into backend_productinfo / backend_productparameter with a few set-based statements. Everything happens in one
+    transaction, so readers keep seeing the previous catalog of the shop until the new one is committed.
+    """
+
+    def run(self, data):
+        stats = ImportStats()
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.prepare(data)
+            cursor.execute(CREATE_STAGING_SQL)
+            chunks = chunked(data['goods'], self.batch_size)
+            while True:
+                started = time.monotonic()
+                chunk = next(chunks, None)
+                stats.parse_time += time.monotonic() - started
+                if chunk is None:
+                    break
+                started = time.monotonic()
+                self.copy_records(cursor, self.make_records(chunk), stats)
+                stats.db_time += time.monotonic() - started
+                if self.progress is not None:
+                    self.progress(stats)
+            started = time.monotonic()
+            self.merge(cursor, stats)
+            # ON COMMIT DROP does not fire when the import runs inside an outer transaction
+            cursor.execute(DROP_STAGING_SQL)
+            refresh_listings(self.touched)
+            stats.db_time += time.monotonic() - started
+        stats.finish()
+        logger.info('Shop %s imported with COPY: %s', self.shop.id, stats.as_dict())
+        return stats
+
+    def copy_records(self, cursor, records, stats):
+        product_infos, product_parameters = io.StringIO(), io.StringIO()
+        for record in records:
+            product_infos.write(copy_row((
+                record['external_id'], record['product_id'], record['brand_id'], record['model'], record['price'],
+                record['price_rrc'], record['quantity'],
+            )))
+            for parameter_id, value in record['parameters'].items():
+                product_parameters.write(copy_row((record['external_id'], parameter_id, value)))
+        product_infos.seek(0)
+        product_parameters.seek(0)
+        cursor.copy_expert('COPY import_product_info FROM STDIN', product_infos)
+        cursor.copy_expert('COPY import_product_parameter FROM STDIN', product_parameters)
+        stats.products += len(records)
+        stats.parameters += sum(len(record['parameters']) for record in records)
+
+    def merge(self, cursor, stats):
+        params = {'shop_id': self.shop.id}
+        cursor.execute(INDEX_STAGING_SQL)
+        # NOT EXISTS in the insert only sees committed rows, so merges of the same shop must not overlap
+        cursor.execute(LOCK_SHOP_SQL, params)
+
+        cursor.execute(UPDATE_PRODUCT_INFO_SQL, params)
+        changed = {row[0] for row in cursor.fetchall()}
+        cursor.execute(INSERT_PRODUCT_INFO_SQL, params)
+        inserted = {row[0] for row in cursor.fetchall()}
+        cursor.execute(RETIRE_PRODUCT_INFO_SQL, params)
+        retired = {row[0] for row in cursor.fetchall()}
+        stats.removed = len(retired)
+
+        cursor.execute(UPSERT_PRODUCT_PARAMETER_SQL, params)
+        changed.update(row[0] for row in cursor.fetchall())
+        cursor.execute(DELETE_PRODUCT_PARAMETER_SQL, params)
+        changed.update(row[0] for row in cursor.fetchall())
+
+        self.touched = changed | inserted | retired
+        stats.inserted = len(inserted)
+        stats.updated = len(changed - inserted)
+        stats.unchanged = stats.products - stats.inserted - stats.updated
+
+
+CREATE_STAGING_SQL = """
+    CREATE TEMPORARY TABLE import_product_info (
+        external_id bigint, product_id bigint, brand_id bigint, model varchar(80),
+        price numeric(18, 2), price_rrc numeric(18, 2), quantity integer
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE import_product_parameter (
+        external_id bigint, parameter_id bigint, value varchar(300)
+    ) ON COMMIT DROP;
+"""
+
+DROP_STAGING_SQL = 'DROP TABLE import_product_info, import_product_parameter'
+
+INDEX_STAGING_SQL = """
+    CREATE INDEX ON import_product_info (external_id);
+    CREATE INDEX ON import_product_parameter (external_id, parameter_id);
+    ANALYZE import_product_info;
+    ANALYZE import_product_parameter;
+"""
+
+LOCK_SHOP_SQL = 'SELECT id FROM backend_shop WHERE id = %(shop_id)s FOR UPDATE'
+
+UPDATE_PRODUCT_INFO_SQL = """
+    UPDATE backend_productinfo AS pi
+    SET product_id = s.product_id, brand_id = s.brand_id, model = s.model, price = s.price,
+        price_rrc = s.price_rrc, quantity = s.quantity, is_active = TRUE
+    FROM import_product_info AS s
+    WHERE pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id
+      AND (pi.product_id, pi.brand_id, pi.model, pi.price, pi.price_rrc, pi.quantity, pi.is_active)
+          IS DISTINCT FROM (s.product_id, s.brand_id, s.model, s.price, s.price_rrc, s.quantity, TRUE)
+    RETURNING pi.id
+"""
+
+INSERT_PRODUCT_INFO_SQL = """
+    INSERT INTO backend_productinfo
+        (shop_id, external_id, product_id, brand_id, model, price, price_rrc, quantity, is_active)
+    SELECT %(shop_id)s, s.external_id, s.product_id, s.brand_id, s.model, s.price, s.price_rrc, s.quantity, TRUE
+    FROM import_product_info AS s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM backend_productinfo AS pi WHERE pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id
+    )
+    RETURNING id
+"""
+
+RETIRE_PRODUCT_INFO_SQL = """
+    UPDATE backend_productinfo AS pi
+    SET is_active = FALSE
+    WHERE pi.shop_id = %(shop_id)s AND pi.is_active
+      AND NOT EXISTS (SELECT 1 FROM import_product_info AS s WHERE s.external_id = pi.external_id)
+    RETURNING pi.id
+"""
+
+UPSERT_PRODUCT_PARAMETER_SQL = """
+    INSERT INTO backend_productparameter (product_info_id, parameter_id, value)
+    SELECT pi.id, sp.parameter_id, sp.value
+    FROM import_product_parameter AS sp
+    JOIN backend_productinfo AS pi ON pi.shop_id = %(shop_id)s AND pi.external_id = sp.external_id
+    ON CONFLICT ON CONSTRAINT unique_product_parameter DO UPDATE
+    SET value = EXCLUDED.value
+    WHERE backend_productparameter.value IS DISTINCT FROM EXCLUDED.value
+    RETURNING product_info_id
+"""
+
+DELETE_PRODUCT_PARAMETER_SQL = """
+    DELETE FROM backend_productparameter AS pp
+    USING backend_productinfo AS pi, import_product_info AS s
+    WHERE pp.product_info_id = pi.id AND pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id
+      AND NOT EXISTS (
+          SELECT 1 FROM import_product_parameter AS sp
+          WHERE sp.external_id = s.external_id AND sp.parameter_id = pp.parameter_id
+      )
+    RETURNING pp.product_info_id
+"""
+
+
+def get_importer_class():
+    """
+    ShopImporter, or CopyShopImporter when IMPORT_MODE is 'copy' and the database is PostgreSQL.
+    """
+    if settings.IMPORT_MODE == 'copy' and connection.vendor == 'postgresql':
+        return CopyShopImporter
+    return ShopImporter
+
+
+def copy_row(values):
+    """
+    Render one line of COPY text format.
+    """
+    return '\t'.join(
+        '\\N' if value is None else str(value).translate(COPY_ESCAPES) for value in values
+    ) + '\n'
+
+
+def to_price(value):
+    return Decimal(str(value)).quantize(CENT)
@@ -0,0 +1,106 @@
+"""
+Витрина каталога (ProductListing).
+
+Строки витрины собираются из ProductInfo, Product, Category, Shop, Brand и ProductParameter пачками и
+записываются одним upsert на пачку. Импорт обновляет строки затронутых товаров, сигналы - строки, изменённые
+через ORM по одной (заказы, админка, статус магазина). Вместе со строками обновляются битовые карты фасетов и
+версия каталога, от которой зависят кеш ответов и ETag.
+"""
+from collections import defaultdict
+from itertools import islice
+
+from cacheops import invalidate_model
+
+from backend.cache import bump_catalog_version
+from backend.facets import FACET_FIELDS, facet_keys, rebuild_facets, update_facets
+from backend.models import ProductInfo, ProductParameter, ProductListing
+
+BATCH_SIZE = 1000
+
+SOURCE_FIELDS = (
+    'id', 'external_id', 'model', 'product_id', 'product__name', 'product__category_id', 'product__category__name',
+    'shop_id', 'shop__name', 'shop__state', 'brand_id', 'brand__name', 'price', 'price_rrc', 'quantity', 'is_active',
+    'image__image',
+)
+LISTING_FIELDS = (
+    'product_info_id', 'external_id', 'model', 'product_id', 'product_name', 'category_id', 'category_name',
+    'shop_id', 'shop_name', 'shop_state', 'brand_id', 'brand_name', 'price', 'price_rrc', 'quantity', 'is_active',
+    'image',
+)
+UPDATE_FIELDS = LISTING_FIELDS[1:] + ('parameters',)
+
+
+def refresh_listings(ids=None, shop_id=None, batch_size=BATCH_SIZE):
+    """
+    Rebuild the listing rows of the given ProductInfo ids, or of a whole shop; return the number of rows written.
+
+    The facet index follows: products whose facet values changed are moved, a full rebuild recomputes it.
+    """
+    full = ids is None and shop_id is None
+    if ids is not None:
+        ids = sorted(ids)
+        batches = (ProductInfo.objects.filter(id__in=batch) for batch in _chunked(ids, batch_size))
+    else:
+        queryset = ProductInfo.objects.all()
+        if shop_id is not None:
+            queryset = queryset.filter(shop_id=shop_id)
+        batches = _keyset_batches(queryset, batch_size)
+
+    written = 0
+    changes = {}
+    for queryset in batches:
+        rows = list(queryset.nocache().order_by('id').values_list(*SOURCE_FIELDS))
+        if not rows:
+            continue
+        parameters = defaultdict(dict)
+        for product_info_id, name, value in ProductParameter.objects.nocache().filter(
+                product_info_id__in=[row[0] for row in rows]
+        ).values_list('product_info_id', 'parameter__name', 'value'):
+            parameters[product_info_id][name] = value
+        listings = [ProductListing(parameters=parameters[row[0]], **dict(zip(LISTING_FIELDS, _listing_values(row))))
+                    for row in rows]
+        if not full:
+            old = {pk: facet_keys(*values) for pk, *values in ProductListing.objects.nocache().filter(
+                product_info_id__in=[row[0] for row in rows]).values_list(*FACET_FIELDS)}
+            for listing in listings:
+                new = facet_keys(listing.is_active, listing.shop_id, listing.category_id, listing.brand_id,
+                                 listing.price)
+                if new != old.get(listing.product_info_id):
+                    changes[listing.product_info_id] = (old.get(listing.product_info_id, set()), new)
+        ProductListing.objects.bulk_create(
+            listings, update_conflicts=True, unique_fields=['product_info'], update_fields=UPDATE_FIELDS,
+        )
+        written += len(rows)
+    if written:
+        # bulk upserts bypass cacheops' automatic invalidation
+        invalidate_model(ProductListing)
+        bump_catalog_version()
+    if full:
+        rebuild_facets()
+    else:
+        update_facets(changes)
+    return written
+
+
+def _listing_values(row):
+    *values, image = row
+    return (*values, image or '')
+
+
+def _keyset_batches(queryset, batch_size):
+    """
+    Split a queryset into id-ordered batches without OFFSET.
+    """
+    last_id = 0
+    while True:
+        ids = list(queryset.nocache().filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield queryset.filter(id__gt=last_id, id__lte=ids[-1])
+        last_id = ids[-1]
+
+
+def _chunked(items, size):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,220 @@
+"""
+Замер импорта прайс-листов на синтетических данных.
+
+Для каждого размера генерируется прайс-лист, раздаётся локальным HTTP-сервером и импортируется задачей do_import
+дважды: в пустой каталог и повторно без изменений. Задачи, которые ставит импорт (обновление автодополнения),
+выполняются в том же процессе, поэтому брокер не нужен, а их время входит в замер. Результаты дописываются
+в JSON-файл.
+"""
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import ujson
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from backend.feeds import FEED_READERS
+from backend.management.commands.generate_feed import FeedGenerator
+from backend.models import Brand, Category, ImportJob, Parameter, Shop, ShopFeed
+from djangoProjectFinalWork.tasks import do_import
+
+PREFIX = 'Benchmark'
+BENCHMARK_EMAIL = 'benchmark@example.com'
+
+
+class QueryCounter:
+    """
+    Count queries through `connection.execute_wrapper`; unlike CaptureQueriesContext it has no 9000 query cap.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def peak_rss_mb():
+    """
+    High-water mark of the process RSS; it only grows.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def current_rss_mb():
+    """
+    RSS of the process now, from /proc; None where there is no /proc.
+    """
+    try:
+        with open('/proc/self/statm') as stream:
+            pages = int(stream.read().split()[1])
+    except OSError:
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RSSMonitor:
+    """
+    Peak RSS of one run and its growth over the RSS the run started with, sampled by a thread every INTERVAL
+    seconds. Unlike the process high-water mark, a run after a bigger one reports its own figures. Without /proc
+    the growth of the high-water mark is reported.
+    """
+    INTERVAL = 0.01
+
+    def __enter__(self):
+        self.start = current_rss_mb()
+        self.peak = self.start
+        self.high_water = peak_rss_mb()
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.start is not None:
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(self.INTERVAL):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is None:
+            self.peak_mb = round(peak_rss_mb(), 1)
+            self.growth_mb = round(peak_rss_mb() - self.high_water, 1)
+        else:
+            self.thread.join()
+            self.peak = max(self.peak, current_rss_mb())
+            self.peak_mb = round(self.peak, 1)
+            self.growth_mb = round(self.peak - self.start, 1)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark do_import on synthetic feeds and append the results to a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, nargs='+', default=[10000], help='Feed sizes to benchmark')
+        parser.add_argument('--parameters', type=int, default=8, help='Parameters per good')
+        parser.add_argument('--brands', type=int, default=50, help='Number of brands')
+        parser.add_argument('--categories', type=int, default=20, help='Number of categories')
+        parser.add_argument('--format', choices=sorted(FEED_READERS), default='yaml', help='Feed format')
+        parser.add_argument('--mode', choices=('bulk', 'copy'), default=settings.IMPORT_MODE, help='IMPORT_MODE')
+        parser.add_argument('--output', default='import_benchmark.json', help='Results file')
+        parser.add_argument('--keep', action='store_true', help='Keep the imported benchmark catalog')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('--mode copy needs PostgreSQL')
+        user = self.get_user()
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                for goods in sorted(options['goods']):
+                    name = f'feed-{goods}.{options["format"]}'
+                    started = time.monotonic()
+                    generator = FeedGenerator(
+                        goods=goods, parameters=options['parameters'], brands=options['brands'],
+                        categories=options['categories'], shop=PREFIX, prefix=PREFIX,
+                    )
+                    with open(os.path.join(directory, name), 'w', encoding='utf-8', newline='') as stream:
+                        generator.write(stream, options['format'])
+                    self.stderr.write(f'{name}: generated in {time.monotonic() - started:.1f}s')
+                    url = f'http://127.0.0.1:{server.server_port}/{name}'
+                    for run in ('initial', 'reimport'):
+                        result = dict(self.run_import(user, url, options['mode']), run=run, goods=goods,
+                                      parameters=options['parameters'], format=options['format'],
+                                      mode=options['mode'])
+                        self.stderr.write(
+                            f'{name} {run}: {result["wall_time"]}s, {result["queries"]} queries, '
+                            f'{result["rows_per_sec"]} rows/sec, peak RSS {result["peak_rss_mb"]} MB '
+                            f'(+{result["rss_growth_mb"]} MB)')
+                        results.append(result)
+            finally:
+                server.shutdown()
+                server.server_close()
+                if not options['keep']:
+                    self.cleanup(user)
+        self.save(options['output'], results)
+        self.stdout.write(ujson.dumps(results, indent=2))
+
+    def get_user(self):
+        user, _ = get_user_model().objects.get_or_create(
+            email=BENCHMARK_EMAIL, defaults={'username': BENCHMARK_EMAIL, 'type': 'shop', 'is_active': True})
+        self.cleanup(user)
+        return user
+
+    def run_import(self, user, url, mode):
+        # the hash check would skip the unchanged reimport
+        ShopFeed.objects.filter(shop__user=user).delete()
+        job = ImportJob.objects.create(user=user, url=url)
+        counter = QueryCounter()
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        try:
+            with override_settings(IMPORT_MODE=mode, IMPORT_CHUNK_SIZE=0), connection.execute_wrapper(counter), \
+                    RSSMonitor() as rss:
+                started = time.monotonic()
+                status = do_import(user.id, url, job.id)
+                wall_time = time.monotonic() - started
+        finally:
+            current_app.conf.task_always_eager = always_eager
+        job.refresh_from_db()
+        if job.state != 'done':
+            raise CommandError(f'Import failed: {status} {job.error}')
+        return {
+            'wall_time': round(wall_time, 3),
+            'queries': counter.count,
+            'rows_per_sec': job.rows_per_sec,
+            'products': job.products_processed,
+            'parse_time': job.parse_time,
+            'db_time': job.db_time,
+            'summary': job.summary,
+            'peak_rss_mb': rss.peak_mb,
+            'rss_growth_mb': rss.growth_mb,
+        }
+
+    @staticmethod
+    def cleanup(user):
+        Shop.objects.filter(user=user).delete()
+        user.import_jobs.all().delete()
+        Category.objects.filter(name__startswith=f'{PREFIX} category').delete()
+        Brand.objects.filter(name__startswith=f'{PREFIX} brand').delete()
+        Parameter.objects.filter(name__startswith=f'{PREFIX} parameter').delete()
+
+    @staticmethod
+    def save(path, results):
+        """
+        Append this benchmark run to the list stored in `path`.
+        """
+        runs = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as stream:
+                runs = ujson.load(stream)
+        runs.append({
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'results': results,
+        })
+        with open(path, 'w', encoding='utf-8') as stream:
+            ujson.dump(runs, stream, indent=2, ensure_ascii=False)
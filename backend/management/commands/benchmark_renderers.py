@@ -0,0 +1,80 @@
+"""
+Замер рендеринга страницы каталога разными рендерерами.
+
+Строки витрины строятся в памяти из синтетического прайс-листа (generate_feed), сериализуются
+ProductListingSerializer и рендерятся каждым рендерером; база не используется.
+"""
+import platform
+import time
+from decimal import Decimal
+
+import ujson
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework_yaml.renderers import YAMLRenderer as PythonYAMLRenderer
+
+from backend.management.commands.generate_feed import FeedGenerator
+from backend.models import ProductListing
+from backend.renderers import MessagePackRenderer, UJSONRenderer, YAMLRenderer, msgpack
+from backend.serializers import ProductListingSerializer
+
+RENDERERS = {
+    'yaml (rest_framework_yaml)': PythonYAMLRenderer,
+    'yaml (libyaml)': YAMLRenderer,
+    'json (DRF)': JSONRenderer,
+    'json (ujson)': UJSONRenderer,
+    'msgpack': MessagePackRenderer,
+}
+
+
+def build_listings(rows, parameters):
+    generator = FeedGenerator(goods=rows, parameters=parameters)
+    categories = {category['id']: category['name'] for category in generator.categories}
+    return [
+        ProductListing(
+            product_info_id=number + 1, external_id=item['id'], model=item['model'], product_id=number + 1,
+            product_name=item['name'], category_id=item['category'], category_name=categories[item['category']],
+            shop_id=1, shop_name=generator.shop, brand_id=1, brand_name=item['brand'], price=Decimal(item['price']),
+            price_rrc=Decimal(item['price_rrc']), quantity=item['quantity'],
+            parameters={name: str(value) for name, value in item['parameters'].items()},
+        )
+        for number, item in enumerate(generator.iter_goods())
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API renderers on a page of catalog rows and print the render time per 1000 rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows in the rendered page')
+        parser.add_argument('--parameters', type=int, default=8, help='Parameters per row')
+        parser.add_argument('--repeat', type=int, default=5, help='Renders per renderer, the best one is reported')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be >= 1')
+        data = {
+            'next': None, 'previous': None,
+            'results': ProductListingSerializer(build_listings(options['rows'], options['parameters']), many=True).data,
+        }
+        results = []
+        for name, renderer_class in RENDERERS.items():
+            if renderer_class is MessagePackRenderer and msgpack is None:
+                self.stderr.write(f'{name}: skipped, msgpack is not installed')
+                continue
+            renderer = renderer_class()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                content = renderer.render(data, renderer.media_type, {})
+                timings.append(time.perf_counter() - started)
+            results.append({
+                'renderer': name,
+                'media_type': renderer.media_type,
+                'ms_per_1k_rows': round(min(timings) * 1000 * 1000 / options['rows'], 2),
+                'bytes_per_row': round(len(content) / options['rows']),
+            })
+            self.stderr.write(f'{name}: {results[-1]["ms_per_1k_rows"]} ms per 1k rows, '
+                              f'{results[-1]["bytes_per_row"]} bytes per row')
+        self.stdout.write(ujson.dumps(
+            {'python': platform.python_version(), 'rows': options['rows'], 'results': results}, indent=2))
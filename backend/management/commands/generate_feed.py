@@ -0,0 +1,120 @@
+"""
+Генерация синтетических прайс-листов в схеме `data/shop.yaml` для замеров импорта.
+"""
+import csv
+import random
+
+import ujson
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.feeds import CSV_COLUMNS, FEED_READERS
+
+COLORS = ('черный', 'белый', 'серебристый', 'золотистый', 'красный', 'синий', 'зеленый')
+KINDS = ('Смартфон', 'Планшет', 'Ноутбук', 'Телевизор', 'Наушники', 'Flash-накопитель', 'Монитор')
+
+
+class FeedGenerator:
+    """
+    Deterministic generator of a partner feed with `goods` products, `parameters` parameters per product,
+    `brands` brands and `categories` categories.
+
+    Goods are produced one by one, so feeds of millions of products are written without being held in memory.
+    Dictionary names carry the `prefix`, which lets the benchmark clean up what it created.
+    """
+
+    def __init__(self, goods=10000, parameters=8, brands=50, categories=20, seed=0, shop='Benchmark',
+                 prefix='Benchmark'):
+        self.goods = goods
+        self.parameters = parameters
+        self.brands = [f'{prefix} brand {number}' for number in range(brands)]
+        self.categories = [{'id': 1000 + number, 'name': f'{prefix} category {number}'} for number in range(categories)]
+        self.parameter_names = [f'{prefix} parameter {number}' for number in range(max(parameters * 2, 1))]
+        self.seed = seed
+        self.shop = shop
+
+    def iter_goods(self):
+        rnd = random.Random(self.seed)
+        for number in range(self.goods):
+            category = rnd.choice(self.categories)
+            brand = rnd.choice(self.brands)
+            price = rnd.randrange(500, 300000, 10)
+            yield {
+                'id': 10_000_000 + number,
+                'category': category['id'],
+                'model': f'{brand.split()[-1]}/{category["id"]}/{number}',
+                'brand': brand,
+                'name': f'{rnd.choice(KINDS)} {brand} {number} ({rnd.choice(COLORS)})',
+                'price': price,
+                'price_rrc': price + rnd.randrange(0, 20000, 10),
+                'quantity': rnd.randrange(0, 100),
+                'parameters': {
+                    name: rnd.choice((rnd.randrange(1, 4096), round(rnd.uniform(1, 100), 1), rnd.choice(COLORS)))
+                    for name in rnd.sample(self.parameter_names, self.parameters)
+                },
+            }
+
+    def write(self, stream, feed_format='yaml'):
+        getattr(self, f'write_{feed_format}')(stream)
+
+    def write_yaml(self, stream):
+        # JSON strings are valid YAML double-quoted scalars, so ujson does the quoting
+        dump = self._dump
+        stream.write(f'shop: {dump(self.shop)}\ncategories:\n')
+        for category in self.categories:
+            stream.write(f'  - id: {category["id"]}\n    name: {dump(category["name"])}\n')
+        stream.write('goods:\n')
+        for item in self.iter_goods():
+            stream.write(
+                f'  - id: {item["id"]}\n    category: {item["category"]}\n    model: {dump(item["model"])}\n'
+                f'    brand: {dump(item["brand"])}\n    name: {dump(item["name"])}\n    price: {item["price"]}\n'
+                f'    price_rrc: {item["price_rrc"]}\n    quantity: {item["quantity"]}\n    parameters:\n'
+            )
+            stream.writelines(f'      {dump(name)}: {dump(value)}\n' for name, value in item['parameters'].items())
+
+    def write_jsonl(self, stream):
+        dump = self._dump
+        stream.write(dump({'shop': self.shop, 'categories': self.categories}) + '\n')
+        for item in self.iter_goods():
+            stream.write(dump(item) + '\n')
+
+    def write_csv(self, stream):
+        categories = {category['id']: category['name'] for category in self.categories}
+        writer = csv.DictWriter(stream, CSV_COLUMNS)
+        writer.writeheader()
+        for item in self.iter_goods():
+            writer.writerow(dict(
+                {key: value for key, value in item.items() if key != 'category'}, shop=self.shop,
+                category_id=item['category'], category=categories[item['category']],
+                parameters=self._dump(item['parameters'])))
+
+    @staticmethod
+    def _dump(value):
+        return ujson.dumps(value, ensure_ascii=False)
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic partner feed in the data/shop.yaml schema'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Output file, "-" for stdout')
+        parser.add_argument('--goods', type=int, default=10000, help='Number of goods')
+        parser.add_argument('--parameters', type=int, default=8, help='Parameters per good')
+        parser.add_argument('--brands', type=int, default=50, help='Number of brands')
+        parser.add_argument('--categories', type=int, default=20, help='Number of categories')
+        parser.add_argument('--format', choices=sorted(FEED_READERS), default='yaml', help='Feed format')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--shop', default='Benchmark', help='Shop name')
+
+    def handle(self, *args, **options):
+        if options['goods'] < 0 or options['parameters'] < 0 or options['brands'] < 1 or options['categories'] < 1:
+            raise CommandError('--goods and --parameters must be >= 0, --brands and --categories >= 1')
+        generator = FeedGenerator(
+            goods=options['goods'], parameters=options['parameters'], brands=options['brands'],
+            categories=options['categories'], seed=options['seed'], shop=options['shop'],
+        )
+        if options['output'] == '-':
+            generator.write(self.stdout, options['format'])
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+            generator.write(stream, options['format'])
+        self.stderr.write(f'{options["goods"]} goods written to {options["output"]}')
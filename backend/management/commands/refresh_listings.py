@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.listings import refresh_listings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the ProductListing read model from ProductInfo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='Only rebuild the rows of this shop id')
+
+    def handle(self, *args, **options):
+        written = refresh_listings(shop_id=options['shop'])
+        self.stdout.write(f'{written} listing rows refreshed')
@@ -2,9 +2,12 @@ from datetime import datetime
 from decimal import Decimal
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Cast, Replace
 from django.contrib.auth.base_user import BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
@@ -21,6 +24,28 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+# Конфигурация полнотекстового поиска PostgreSQL для витрины каталога
+SEARCH_CONFIG = 'russian'
+
+# Значение параметра, которое считается числом: "6.5", "256", "-10", "5,8"; не больше 15 цифр в целой части
+NUMERIC_VALUE_PATTERN = r'^\s*[-+]?[0-9]{1,15}([.,][0-9]+)?\s*$'
+
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('not_modified', 'Без изменений'),
+    ('failed', 'Ошибка'),
+)
+
+FACET_CHOICES = (
+    ('active', 'В продаже'),
+    ('shop', 'Магазин'),
+    ('category', 'Категория'),
+    ('brand', 'Брэнд'),
+    ('price', 'Цена'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -158,6 +183,56 @@ class Shop(models.Model):
         return self.name
 
 
+class ShopFeed(models.Model):
+    """
+    Последний импортированный прайс-лист магазина
+    """
+    shop = models.OneToOneField(Shop, verbose_name='Магазин', related_name='feed', on_delete=models.CASCADE)
+    url = models.URLField(max_length=500, verbose_name='Адрес прайс-листа')
+    sha256 = models.CharField(max_length=64, verbose_name='SHA-256')
+    etag = models.CharField(max_length=200, blank=True, verbose_name='ETag')
+    last_modified = models.CharField(max_length=100, blank=True, verbose_name='Last-Modified')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата импорта')
+
+    class Meta:
+        verbose_name = 'Прайс-лист магазина'
+        verbose_name_plural = 'Прайс-листы магазинов'
+
+    def __str__(self):
+        return self.url
+
+
+class ImportJob(models.Model):
+    """
+    Задача импорта прайс-листа
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='import_jobs',
+        on_delete=models.CASCADE)
+    url = models.URLField(max_length=500, verbose_name='Адрес прайс-листа')
+    dry_run = models.BooleanField(verbose_name='Пробный импорт', default=False)
+    state = models.CharField(verbose_name='статус', choices=IMPORT_STATE_CHOICES, max_length=15, default='pending')
+    products_processed = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    rows_per_sec = models.FloatField(verbose_name='Строк в секунду', default=0)
+    parse_time = models.FloatField(verbose_name='Время разбора, с', default=0)
+    db_time = models.FloatField(verbose_name='Время записи в БД, с', default=0)
+    summary = models.JSONField(verbose_name='Итоги', default=dict, blank=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Импорт прайс-листа'
+        verbose_name_plural = 'Импорт прайс-листов'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.url} ({self.state})'
+
+
 class Category(models.Model):
     name = models.CharField(max_length=200)
     shops = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories')
@@ -181,6 +256,27 @@ class Category(models.Model):
         return self.name
 
 
+class ShopCategory(models.Model):
+    """
+    Код категории в прайс-листе магазина
+    """
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='feed_categories', on_delete=models.CASCADE)
+    category = models.ForeignKey(
+        Category,
+        verbose_name='Категория',
+        related_name='feed_categories',
+        on_delete=models.CASCADE)
+    external_id = models.PositiveIntegerField(verbose_name='Код категории в прайс-листе')
+
+    class Meta:
+        verbose_name = 'Категория прайс-листа'
+        verbose_name_plural = 'Категории прайс-листов'
+        constraints = [models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_shop_category')]
+
+    def __str__(self):
+        return f'{self.shop} {self.external_id}: {self.category}'
+
+
 class Product(models.Model):
     name = models.CharField(max_length=150)
     category = models.ForeignKey(
@@ -220,6 +316,7 @@ class ProductInfo(models.Model):
         on_delete=models.CASCADE)
     external_id = models.PositiveIntegerField(verbose_name='Артикул')
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    is_active = models.BooleanField(verbose_name='В продаже', default=True)
     price = models.DecimalField(
         max_digits=18,
         decimal_places=2,
@@ -275,11 +372,106 @@ class ProductParameter(models.Model):
         on_delete=models.CASCADE
     )
     value = models.CharField(verbose_name='Значение', max_length=300)
+    # число из value, если оно записано числом; вычисляется базой, поэтому заполняется при любом способе записи
+    numeric_value = models.GeneratedField(
+        expression=models.Case(
+            models.When(value__regex=NUMERIC_VALUE_PATTERN,
+                        then=Cast(Replace('value', models.Value(','), models.Value('.')), models.FloatField())),
+            default=None,
+        ),
+        output_field=models.FloatField(null=True),
+        db_persist=True,
+        verbose_name='Числовое значение')
 
     class Meta:
         verbose_name = 'Параметр продукта'
         verbose_name_plural = 'Параметры продуктов'
         constraints = [models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter')]
+        indexes = [
+            # диапазонные фильтры по числовым параметрам: parameter_id = X AND numeric_value BETWEEN a AND b
+            models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric',
+                         condition=models.Q(numeric_value__isnull=False)),
+        ]
+
+
+class ProductListing(models.Model):
+    """
+    Плоская строка каталога для выдачи товаров.
+
+    Копия ProductInfo вместе с названиями товара, категории, магазина, бренда и параметрами, чтобы список
+    товаров читался из одной таблицы без соединений. Обновляется импортом и сигналами при изменении исходных строк.
+    """
+    product_info = models.OneToOneField(
+        ProductInfo,
+        verbose_name='Информация о продукте',
+        related_name='listing',
+        primary_key=True,
+        on_delete=models.CASCADE)
+    external_id = models.PositiveIntegerField(verbose_name='Артикул')
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    product_id = models.BigIntegerField(verbose_name='Продукт')
+    product_name = models.CharField(max_length=150, verbose_name='Название продукта')
+    category_id = models.BigIntegerField(verbose_name='Категория', db_index=True)
+    category_name = models.CharField(max_length=200, verbose_name='Название категории')
+    shop_id = models.BigIntegerField(verbose_name='Магазин', db_index=True)
+    shop_name = models.CharField(max_length=200, verbose_name='Название магазина')
+    shop_state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    brand_id = models.BigIntegerField(verbose_name='Брэнд', blank=True, null=True, db_index=True)
+    brand_name = models.CharField(max_length=200, verbose_name='Название брэнда', blank=True, null=True)
+    price = models.DecimalField(max_digits=18, decimal_places=2, verbose_name='Цена')
+    price_rrc = models.DecimalField(max_digits=18, decimal_places=2, verbose_name='Рекомендуемая розничная цена')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    is_active = models.BooleanField(verbose_name='В продаже', default=True)
+    image = models.CharField(max_length=255, verbose_name='Изображение', blank=True)
+    parameters = models.JSONField(verbose_name='Параметры', default=dict, blank=True)
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('product_name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('brand_name', 'model', weight='B', config=SEARCH_CONFIG)
+            + SearchVector('category_name', weight='C', config=SEARCH_CONFIG)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+        verbose_name='Поисковый вектор')
+
+    class Meta:
+        verbose_name = 'Строка каталога'
+        verbose_name_plural = 'Витрина каталога'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='listing_search_vector'),
+            # ключи постраничной выдачи витрины, только по товарам в продаже
+            models.Index(fields=['product_info'], name='listing_visible_id',
+                         condition=models.Q(is_active=True, shop_state=True)),
+            models.Index(fields=['price', 'product_info'], name='listing_visible_price_id',
+                         condition=models.Q(is_active=True, shop_state=True)),
+        ]
+
+    def __str__(self):
+        return f'{self.product_name} ({self.shop_name})'
+
+
+class ProductFacet(models.Model):
+    """
+    Значение фасета каталога и битовая карта товаров с этим значением.
+
+    Бит с номером N установлен, если у ProductInfo с id=N это значение фасета. Карта хранится сжатой zlib.
+    Для цены значение - нижняя граница ценового диапазона, для 'active' - всегда 0.
+    """
+    facet = models.CharField(max_length=20, verbose_name='Фасет', choices=FACET_CHOICES)
+    value = models.BigIntegerField(verbose_name='Значение')
+    bitmap = models.BinaryField(verbose_name='Битовая карта товаров')
+    count = models.PositiveIntegerField(verbose_name='Количество товаров', default=0)
+    updated_at = models.DateTimeField(verbose_name='Обновлено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Значение фасета'
+        verbose_name_plural = 'Фасеты каталога'
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_product_facet'),
+        ]
+
+    def __str__(self):
+        return f'{self.facet}={self.value} ({self.count})'
 
 
 class Contact(models.Model):
@@ -0,0 +1,180 @@
+"""
+Постраничная выдача по ключу (keyset pagination).
+
+Следующая страница выбирается условием "после последней строки предыдущей" по упорядоченным полям, а не OFFSET,
+поэтому глубокие страницы стоят столько же, сколько первая. Курсор непрозрачен для клиента: это base64 от
+позиции, порядка сортировки и направления.
+"""
+import base64
+import binascii
+from decimal import Decimal, InvalidOperation
+
+import ujson
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique composite key.
+
+    `orderings` maps the values accepted in `?ordering=` to the fields the queryset is ordered by; the last field
+    must be unique. `?ordering=-price` orders every field of the 'price' ordering descending.
+    """
+    page_size = api_settings.PAGE_SIZE or 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    orderings = {'id': ('id',)}
+    default_ordering = 'id'
+    converters = {'id': int}
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            self.ordering, position, self.reverse = self.get_ordering(request), None, False
+        else:
+            self.ordering, position, self.reverse = cursor
+
+        fields = self.get_fields(self.ordering, self.reverse)
+        queryset = queryset.order_by(*fields)
+        if position is not None:
+            queryset = queryset.filter(self.after(fields, position))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        del results[page_size:]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        fields = self.get_fields(self.ordering, False)
+        self.first = self.position(results[0], fields) if results else None
+        self.last = self.position(results[-1], fields) if results else None
+        if not results and position is not None:
+            # an empty page reached from a cursor: its neighbour is the cursor position itself
+            self.first = self.last = position
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': 'The pagination cursor value.', 'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': f'Number of results per page, at most {self.max_page_size}.',
+             'schema': {'type': 'integer'}},
+            {'name': self.ordering_query_param, 'required': False, 'in': 'query',
+             'description': 'Which field to use when ordering the results.',
+             'schema': {'type': 'string', 'enum': [prefix + name for name in self.orderings for prefix in ('', '-')]}},
+        ]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        return ordering if ordering.lstrip('-') in self.orderings else self.default_ordering
+
+    def get_fields(self, ordering, reverse):
+        descending = ordering.startswith('-') != reverse
+        return tuple(('-' if descending else '') + field for field in self.orderings[ordering.lstrip('-')])
+
+    @staticmethod
+    def after(fields, position):
+        """
+        Rows strictly after `position` in the order of `fields`: (a, b) > (x, y) is a > x OR (a = x AND b > y).
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(fields, position):
+            name = field.lstrip('-')
+            lookup = f'{name}__lt' if field.startswith('-') else f'{name}__gt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def position(obj, fields):
+        if isinstance(obj, dict):  # a `.values()` row
+            return [obj[field.lstrip('-')] for field in fields]
+        return [getattr(obj, field.lstrip('-')) for field in fields]
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        data = {'o': self.ordering, 'p': [str(value) for value in position], 'r': reverse}
+        cursor = base64.urlsafe_b64encode(ujson.dumps(data).encode()).decode()
+        url = remove_query_param(self.base_url, self.ordering_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = ujson.loads(base64.urlsafe_b64decode(encoded.encode()))
+            ordering, values, reverse = data['o'], data['p'], bool(data['r'])
+            fields = self.orderings[ordering.lstrip('-')]
+            if len(values) != len(fields):
+                raise ValueError(values)
+            position = [self.converters[field](value) for field, value in zip(fields, values)]
+        except (binascii.Error, ValueError, TypeError, KeyError, AttributeError, InvalidOperation):
+            raise NotFound(self.invalid_cursor_message)
+        return ordering, position, reverse
+
+
+class ProductListingPagination(KeysetPagination):
+    """
+    Catalog pages ordered by id or by (price, id).
+    """
+    orderings = {'id': ('product_info_id',), 'price': ('price', 'product_info_id')}
+    converters = {'product_info_id': int, 'price': Decimal}
+
+
+class ProductSearchPagination(KeysetPagination):
+    """
+    Search results, best rank first.
+    """
+    orderings = {'rank': ('rank', 'product_info_id')}
+    default_ordering = '-rank'
+    converters = {'rank': float, 'product_info_id': int}
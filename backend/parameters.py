@@ -0,0 +1,42 @@
+"""
+Фильтры каталога по диапазонам числовых параметров.
+
+`?param.<id>__gte=6&param.<id>__lte=7` отбирает товары, у которых числовое значение параметра с этим id лежит в
+диапазоне. Условия одного параметра выполняются одним сканированием индекса (parameter, numeric_value).
+"""
+import math
+import re
+
+from backend.models import ProductParameter
+
+PARAMETER_FILTER = re.compile(r'^param\.(\d+)__(gt|gte|lt|lte)$')
+
+
+def parameter_ranges(params):
+    """
+    Collect the `param.<id>__<lookup>` filters as {parameter_id: {lookup: number}}; a bad number raises ValueError.
+    """
+    ranges = {}
+    for key in params:
+        match = PARAMETER_FILTER.match(key)
+        if not match:
+            continue
+        value = params.get(key)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = math.nan
+        if not math.isfinite(number):
+            raise ValueError(f'Значение фильтра {key} должно быть числом: {value}')
+        ranges.setdefault(int(match[1]), {})[f'numeric_value__{match[2]}'] = number
+    return ranges
+
+
+def parameter_matches(params):
+    """
+    Querysets of the ProductInfo ids that pass each parameter's range, to be used as `id__in` subqueries.
+    """
+    return [
+        ProductParameter.objects.filter(parameter_id=parameter_id, **lookups).values('product_info_id')
+        for parameter_id, lookups in parameter_ranges(params).items()
+    ]
@@ -0,0 +1,73 @@
+"""
+Рендереры ответов API.
+
+YAML остаётся форматом по умолчанию для старых клиентов; JSON (ujson) и MessagePack выбираются заголовком Accept
+или параметром `?format=`. MessagePack подключается, только если установлен пакет msgpack.
+"""
+import ujson
+import yaml
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_yaml import encoders, renderers
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+# the values ujson and msgpack cannot encode themselves (lazy strings, dates, UUIDs) go through DRF's encoder
+encode_default = JSONEncoder().default
+
+if hasattr(yaml, 'CSafeDumper'):
+    class SafeDumper(yaml.CSafeDumper):
+        """
+        rest_framework_yaml's dumper on top of libyaml's emitter: same representers, so the same documents.
+        """
+        yaml_representers = encoders.SafeDumper.yaml_representers
+        represent_mapping = encoders.SafeDumper.represent_mapping
+        represent_decimal = encoders.SafeDumper.represent_decimal
+else:  # PyYAML built without libyaml
+    SafeDumper = encoders.SafeDumper
+
+
+class YAMLRenderer(renderers.YAMLRenderer):
+    encoder = SafeDumper
+
+
+class UJSONRenderer(BaseRenderer):
+    """
+    JSON through ujson, with the output options of DRF's JSONRenderer: UTF-8 text and compact separators.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False, default=encode_default).encode()
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        assert msgpack, 'MessagePackRenderer requires msgpack to be installed'
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class NDJSONRenderer(UJSONRenderer):
+    """
+    Newline-delimited JSON; streamed exports write their lines themselves, other data is rendered as one line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        content = super().render(data, accepted_media_type, renderer_context)
+        return content + b'\n' if content else content
@@ -0,0 +1,82 @@
+"""
+Поиск товаров по витрине каталога.
+
+В PostgreSQL поиск идёт по полю ProductListing.search_vector (GIN-индекс), а при установленном расширении pg_trgm
+дополнительно по триграммному сходству названия, что прощает опечатки. На других СУБД остаётся поиск подстроки.
+"""
+import logging
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+
+from backend.models import SEARCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_EXTENSION = 'pg_trgm'
+TRIGRAM_INDEX = 'listing_product_name_trgm'
+TRIGRAM_INDEX_SQL = (
+    f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON backend_productlisting USING gin (product_name gin_trgm_ops)'
+)
+
+_trigram_available = {}
+
+
+def has_trigram(using='default'):
+    """
+    Whether pg_trgm is installed in the database; checked once per process.
+    """
+    if using not in _trigram_available:
+        db = connections[using]
+        available = False
+        if db.vendor == 'postgresql':
+            with db.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM pg_extension WHERE extname = %s', [TRIGRAM_EXTENSION])
+                available = cursor.fetchone() is not None
+        _trigram_available[using] = available
+    return _trigram_available[using]
+
+
+def search_listings(queryset, text):
+    """
+    Filter listing rows matching `text` and annotate them with a `rank`, higher is better.
+    """
+    if connection.vendor != 'postgresql':
+        condition = Q()
+        for field in ('product_name', 'brand_name', 'model', 'category_name'):
+            condition |= Q(**{f'{field}__icontains': text})
+        return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    rank = SearchRank(F('search_vector'), query)
+    condition = Q(search_vector=query)
+    if has_trigram():
+        rank = rank + TrigramSimilarity('product_name', text)
+        condition |= Q(product_name__trigram_similar=text)
+    return queryset.filter(condition).annotate(rank=Cast(rank, FloatField()))
+
+
+def create_search_extensions(sender, using='default', **kwargs):
+    """
+    pre_migrate handler: install pg_trgm when the database user is allowed to; search works without it.
+    """
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=using), db.cursor() as cursor:
+            cursor.execute(f'CREATE EXTENSION IF NOT EXISTS {TRIGRAM_EXTENSION}')
+    except DatabaseError as exc:
+        logger.warning('Trigram search is disabled, %s is not available: %s', TRIGRAM_EXTENSION, exc)
+    _trigram_available.pop(using, None)
+
+
+def create_search_indexes(sender, using='default', **kwargs):
+    """
+    post_migrate handler: the trigram index needs pg_trgm, so it lives outside the model's Meta.indexes.
+    """
+    if has_trigram(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(TRIGRAM_INDEX_SQL)
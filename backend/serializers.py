@@ -1,8 +1,11 @@
+from django.core.files.storage import default_storage
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import User, Category, Shop, ProductInfo, Product, Brand, ProductParameter, Image, OrderItem, Contact, \
-    Order
+    Order, ImportJob, ProductListing
 
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -172,7 +175,7 @@ class ProductInfoSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(required=False)
     product = ProductSerializer(read_only=True)
     brand = BrandRelatedSerializer(read_only=True)
-    parameters = ProductParameterSerializer(many=True, read_only=True)
+    parameters = ProductParameterSerializer(source='product_parameter', many=True, read_only=True)
 
     class Meta:
         model = ProductInfo
@@ -182,6 +185,46 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class ProductListingSerializer(serializers.ModelSerializer):
+    """
+    A ProductListing row in the shape of ProductInfoSerializer plus the product info id, built from the row alone.
+    """
+    id = serializers.IntegerField(source='product_info_id', read_only=True)
+    product = serializers.SerializerMethodField()
+    brand = serializers.SerializerMethodField()
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    image = serializers.SerializerMethodField()
+    parameters = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductListing
+        fields = (
+            'id', 'product', 'model', 'brand', 'shop', 'external_id', 'quantity', 'price', 'price_rrc', 'image',
+            'parameters'
+        )
+        read_only_fields = fields
+
+    @extend_schema_field(ProductSerializer)
+    def get_product(self, obj):
+        return {'name': obj.product_name, 'category': obj.category_name}
+
+    @extend_schema_field(BrandRelatedSerializer(allow_null=True))
+    def get_brand(self, obj):
+        return {'name': obj.brand_name} if obj.brand_id is not None else None
+
+    @extend_schema_field(OpenApiTypes.URI)
+    def get_image(self, obj):
+        if not obj.image:
+            return None
+        url = default_storage.url(obj.image)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    @extend_schema_field(ProductParameterSerializer(many=True))
+    def get_parameters(self, obj):
+        return [{'parameter': name, 'value': value} for name, value in obj.parameters.items()]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
@@ -225,3 +268,11 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ('id', 'user', 'order_items', 'state', 'created', 'total_sum', 'contact',)
         read_only_fields = ('id',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'user', 'url', 'dry_run', 'state', 'products_processed', 'rows_per_sec', 'parse_time', 'db_time',
+                  'summary', 'error', 'created', 'started', 'finished',)
+        read_only_fields = fields
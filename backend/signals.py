@@ -1,11 +1,15 @@
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver, Signal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django_rest_passwordreset.signals import reset_password_token_created
 
 from djangoProjectFinalWork.tasks import register_confirm_email, send_order_email, password_reset_email_task, \
     generate_thumbnails
-from .models import ConfirmEmailToken, User, Image
+from .cache import bump_catalog_version, bump_order_version
+from .facets import FACET_FIELDS, facet_keys, update_facets
+from .listings import refresh_listings
+from .models import ConfirmEmailToken, User, Image, ProductInfo, ProductParameter, ProductListing, Shop, Category, \
+    Brand, Product, Parameter, Order
 
 new_order = Signal()
 new_user_registered = Signal()
@@ -57,3 +61,105 @@ def new_image_signal(sender, instance, created, **kwargs):
     """
     if created:
         generate_thumbnails.delay(instance.image.path)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed_signal(sender, instance, **kwargs):
+    """
+    Orders saved one by one (admin, basket) change the ETag of their owner's order list.
+    """
+    bump_order_version(instance.user_id)
+
+
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved_signal(sender, instance, **kwargs):
+    """
+    Keep the listing row of a product changed one by one (orders, admin) in line with it.
+    Bulk writes of the importer bypass signals and refresh the listing themselves.
+    """
+    refresh_listings([instance.id])
+
+
+@receiver(pre_delete, sender=ProductInfo)
+def product_info_deleting_signal(sender, instance, origin=None, **kwargs):
+    """
+    Remember the facet values of the listing row, which the cascade deletes before the product info itself.
+
+    A delete sends pre_delete for every collected row before removing any, so the rows of one delete (of a product
+    info, or the cascade of a product, category or shop) are gathered on the object it started from.
+    """
+    row = ProductListing.objects.nocache().filter(product_info_id=instance.id).values_list(*FACET_FIELDS).first()
+    pending, _ = _facet_removals(origin if origin is not None else instance)
+    pending[instance.id] = facet_keys(*row[1:]) if row else set()
+
+
+@receiver(post_delete, sender=ProductInfo)
+def product_info_deleted_signal(sender, instance, origin=None, **kwargs):
+    """
+    Drop the deleted products from the facet index in one batch, once the last of them is gone.
+    """
+    origin = origin if origin is not None else instance
+    pending, removed = _facet_removals(origin)
+    removed[instance.id] = (pending.pop(instance.id, set()), set())
+    if not pending:
+        del origin._facet_removals
+        update_facets(removed)
+        bump_catalog_version()
+
+
+def _facet_removals(origin):
+    if not hasattr(origin, '_facet_removals'):
+        origin._facet_removals = ({}, {})
+    return origin._facet_removals
+
+
+@receiver(post_save, sender=ProductParameter)
+@receiver(post_delete, sender=ProductParameter)
+def product_parameter_changed_signal(sender, instance, **kwargs):
+    refresh_listings([instance.product_info_id])
+
+
+@receiver(post_save, sender=Shop)
+def shop_saved_signal(sender, instance, created, **kwargs):
+    if not created:
+        ProductListing.objects.filter(shop_id=instance.id).update(shop_name=instance.name, shop_state=instance.state)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Category.shops.through)
+def category_tree_changed_signal(sender, **kwargs):
+    """
+    Shops and categories edited one by one (admin) make the category snapshot stale.
+    The importer links categories in bulk and bumps the version itself.
+    """
+    bump_catalog_version(categories=True)
+
+
+@receiver(post_save, sender=Category)
+def category_saved_signal(sender, instance, created, **kwargs):
+    if not created:
+        ProductListing.objects.filter(category_id=instance.id).update(category_name=instance.name)
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved_signal(sender, instance, created, **kwargs):
+    if not created:
+        ProductListing.objects.filter(brand_id=instance.id).update(brand_name=instance.name)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def product_saved_signal(sender, instance, created, **kwargs):
+    if not created:
+        # a new category moves the products between facet values, so the rows are rebuilt rather than updated
+        refresh_listings(ProductInfo.objects.nocache().filter(product_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Parameter)
+def parameter_saved_signal(sender, instance, created, **kwargs):
+    if not created:
+        refresh_listings(ProductParameter.objects.filter(parameter=instance).values_list('product_info_id', flat=True))
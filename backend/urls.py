@@ -3,9 +3,9 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 
-from backend.views import (RegisterView, confirm_acc, AccountDetails, login, partner_update,
-    ShopView, BrandView, product_view, PartnerState, BasketView, OrdersView, ContactView,
-    PartnerOrders, image_upload_view, login_page, CategoryView, )
+from backend.views import (RegisterView, confirm_acc, AccountDetails, login, partner_update, partner_update_status,
+    ShopView, BrandView, product_view, product_search, product_export, PartnerState, BasketView, OrdersView,
+    product_autocomplete, product_batch, ContactView, PartnerOrders, image_upload_view, login_page, CategoryView, )
 
 
 
@@ -15,6 +15,7 @@ app_name = 'backend'
 urlpatterns = [
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/update', partner_update, name='partner-update'),
+    path('partner/update/<int:job_id>', partner_update_status, name='partner-update-status'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     path('register', RegisterView.as_view(), name='user-register'),
     path('register/confirm', confirm_acc, name='user-register-confirm'),
@@ -25,7 +26,11 @@ urlpatterns = [
     path('brand', BrandView.as_view(), name='brands'),
     path('shops', ShopView.as_view(), name='shops'),
     path('categories', CategoryView.as_view(), name='categories'),
-    path('products', product_view, name='shops'),
+    path('products', product_view, name='products'),
+    path('products/search', product_search, name='product-search'),
+    path('products/export', product_export, name='product-export'),
+    path('products/autocomplete', product_autocomplete, name='product-autocomplete'),
+    path('products/batch', product_batch, name='product-batch'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrdersView.as_view(), name='order'),
     path('user/login', login, name='user-login'),
@@ -0,0 +1,186 @@
+"""
+Проверка прайс-листов партнёров перед импортом.
+
+Товары проверяются pydantic-моделями в один потоковый проход, без обращения к базе, поэтому импорт начинается
+только на чистых данных. В режиме пробного импорта (dry run) тот же проход сравнивает прайс-лист с текущим
+каталогом магазина и возвращает предварительный список изменений.
+"""
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from backend.models import ProductInfo, ProductParameter
+
+MAX_ERRORS = 100
+MAX_SAMPLES = 20
+CENT = Decimal('0.01')
+# ProductInfo.price is DecimalField(max_digits=18, decimal_places=2)
+MAX_PRICE = Decimal('1e16')
+
+
+class FeedCategory(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    id: int
+    name: str = Field(min_length=1, max_length=200)
+
+
+class FeedHeader(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    shop: str = Field(min_length=1, max_length=200)
+    categories: List[FeedCategory]
+
+
+class FeedItem(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    id: int = Field(ge=0)
+    category: int
+    model: str = Field(max_length=80)
+    brand: Optional[str] = Field(default=None, max_length=200)
+    name: str = Field(min_length=1, max_length=150)
+    price: Decimal = Field(ge=0, lt=MAX_PRICE)
+    price_rrc: Decimal = Field(ge=0, lt=MAX_PRICE)
+    quantity: int = Field(ge=0)
+    parameters: Dict[str, Union[str, bool, int, float]]
+
+
+class FeedValidator:
+    """
+    Validate a feed read by `backend.feeds.read_feed` in a single pass over its goods.
+
+    `diff`, if given, receives every valid item and its `as_dict()` is added to the report under 'diff'.
+
+    Usage:
+        report = FeedValidator().validate(feed)
+    """
+
+    def __init__(self, diff=None, max_errors=MAX_ERRORS):
+        self.diff = diff
+        self.max_errors = max_errors
+
+    def validate(self, feed):
+        started = time.monotonic()
+        errors, error_count, products = [], 0, 0
+        try:
+            header = FeedHeader.model_validate({'shop': feed.get('shop'), 'categories': feed.get('categories')})
+        except ValidationError as exc:
+            return self.report(started, 0, 1, [{'row': 0, 'id': None, 'errors': self.format(exc)}])
+        category_ids = {category.id for category in header.categories}
+
+        for row, item in enumerate(feed['goods'], 1):
+            products += 1
+            try:
+                goods = FeedItem.model_validate(item)
+                problems = self.check(goods, category_ids)
+            except ValidationError as exc:
+                goods, problems = None, self.format(exc)
+            if problems:
+                error_count += 1
+                if len(errors) < self.max_errors:
+                    errors.append({'row': row, 'id': item.get('id') if isinstance(item, dict) else None,
+                                   'errors': problems})
+            elif self.diff is not None:
+                self.diff.add(goods)
+        return self.report(started, products, error_count, errors)
+
+    @staticmethod
+    def check(item, category_ids):
+        """
+        Checks that need the feed header or more than one field of the item.
+        """
+        problems = []
+        if item.category not in category_ids:
+            problems.append({'loc': 'category', 'msg': f'Unknown category {item.category}'})
+        for name, value in item.parameters.items():
+            if not 0 < len(name) <= 50:
+                problems.append({'loc': f'parameters.{name}', 'msg': 'Parameter name must have 1 to 50 characters'})
+            if len(str(value)) > 300:
+                problems.append({'loc': f'parameters.{name}', 'msg': 'Value must have at most 300 characters'})
+        return problems
+
+    @staticmethod
+    def format(exc):
+        return [{'loc': '.'.join(str(part) for part in error['loc']), 'msg': error['msg']} for error in exc.errors()]
+
+    def report(self, started, products, error_count, errors):
+        elapsed = time.monotonic() - started
+        report = {
+            'valid': not error_count,
+            'products': products,
+            'error_count': error_count,
+            'errors': errors,
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(products / elapsed, 1) if elapsed else 0.0,
+        }
+        if self.diff is not None:
+            report['diff'] = self.diff.as_dict()
+        return report
+
+
+class FeedDiff:
+    """
+    Compare validated feed items with the user's current catalog without writing anything.
+    """
+
+    fields = ('name', 'brand', 'model', 'price', 'price_rrc', 'quantity', 'is_active', 'parameters')
+
+    def __init__(self, user_id, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        queryset = ProductInfo.objects.filter(shop__user_id=user_id)
+        self.existing = {
+            external_id: {'name': name, 'brand': brand, 'model': model, 'price': price, 'price_rrc': price_rrc,
+                          'quantity': quantity, 'is_active': is_active, 'parameters': {}}
+            for external_id, name, brand, model, price, price_rrc, quantity, is_active in queryset.values_list(
+                'external_id', 'product__name', 'brand__name', 'model', 'price', 'price_rrc', 'quantity',
+                'is_active').iterator()
+        }
+        for external_id, name, value in ProductParameter.objects.filter(
+                product_info__shop__user_id=user_id).values_list(
+                'product_info__external_id', 'parameter__name', 'value').iterator():
+            self.existing[external_id]['parameters'][name] = value
+        self.seen = set()
+        self.inserted, self.updated, self.unchanged = [], [], 0
+        self.inserted_count = self.updated_count = 0
+
+    def add(self, item):
+        if item.id in self.seen:
+            return
+        self.seen.add(item.id)
+        row = self.existing.get(item.id)
+        if row is None:
+            self.inserted_count += 1
+            if len(self.inserted) < self.max_samples:
+                self.inserted.append(item.id)
+            return
+        new = {'name': item.name, 'brand': item.brand or None, 'model': item.model, 'price': item.price.quantize(CENT),
+               'price_rrc': item.price_rrc.quantize(CENT), 'quantity': item.quantity, 'is_active': True,
+               'parameters': {name: str(value) for name, value in item.parameters.items()}}
+        changes = {field: [str(row[field]), str(new[field])] for field in self.fields if row[field] != new[field]}
+        if not changes:
+            self.unchanged += 1
+            return
+        self.updated_count += 1
+        if len(self.updated) < self.max_samples:
+            self.updated.append({'id': item.id, 'changes': changes})
+
+    def as_dict(self):
+        removed = [external_id for external_id, row in self.existing.items()
+                   if row['is_active'] and external_id not in self.seen]
+        return {
+            'inserted': self.inserted_count,
+            'updated': self.updated_count,
+            'unchanged': self.unchanged,
+            'removed': len(removed),
+            'samples': {'inserted': self.inserted, 'updated': self.updated, 'removed': removed[:self.max_samples]},
+        }
+
+
+def validate_feed(feed, diff=None):
+    """
+    Shortcut for `FeedValidator(diff).validate(feed)`.
+    """
+    return FeedValidator(diff).validate(feed)
@@ -2,20 +2,25 @@ from distutils.util import strtobool
 
 import sentry_sdk
 from django.shortcuts import render
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, inline_serializer, OpenApiParameter
 from rest_framework.throttling import AnonRateThrottle
 from yaml.representer import RepresenterError
 
-from djangoProjectFinalWork.tasks import do_import, generate_thumbnails, notify_low_stock
+from djangoProjectFinalWork.tasks import do_import, generate_thumbnails, notify_low_stock, \
+    refresh_autocomplete_after_commit
 from django.contrib.auth import authenticate
 from django.db import IntegrityError, transaction
-from rest_framework import status
+from rest_framework import serializers, status
 from django.core.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.generics import ListAPIView
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework.request import Request
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from django.contrib.auth.password_validation import validate_password
@@ -23,10 +28,24 @@ from django.db.models import Q, Sum, F
 from ujson import loads as load_json
 
 from .forms import ImageForm
-from .models import ConfirmEmailToken, Category, Shop, ProductInfo, Order, OrderItem, Contact, Brand
+from .importer import get_job_status
+from .autocomplete import MAX_LIMIT, autocomplete
+from .cache import bump_catalog_version, bump_order_version, cache_catalog_response, cached_listings, catalog_etag, \
+    order_etag
+from .export import ndjson_chunks, shop_feed_chunks
+from .facets import facet_counts
+from .categories import load_snapshot
+from .fast_serializers import LISTING_FIELDS, ORDER_FIELDS, ORDER_INCLUDES, fieldset, listing_rows, listing_values, \
+    order_rows
+from .parameters import parameter_matches
+from .search import search_listings
+from .pagination import ProductListingPagination, ProductSearchPagination
+from .renderers import NDJSONRenderer, YAMLRenderer
+from .models import ConfirmEmailToken, Category, Shop, ProductInfo, Order, OrderItem, Contact, Brand, ImportJob, \
+    ProductListing
 from .serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, OrderSerializer, \
     OrderItemSerializer, ContactSerializer, BrandSerializer, UserDetailsSerializer, ConfirmAccountSerializer, \
-    UserAuthSerializer, ErrorResponseSerializer, SuccessResponseSerializer
+    UserAuthSerializer, ErrorResponseSerializer, SuccessResponseSerializer, ImportJobSerializer, ProductListingSerializer
 from .signals import new_order
 
 
@@ -239,6 +258,8 @@ class BrandView(APIView):
         },
         description="Retrieve the list of brands."
     )
+    @method_decorator(condition(etag_func=catalog_etag))
+    @method_decorator(cache_catalog_response)
     def get(self, request, *args, **kwargs):
         queryset = Brand.objects.all()
         serializer = BrandSerializer(queryset, many=True)
@@ -268,6 +289,7 @@ class BrandView(APIView):
         serializer = BrandSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
+            bump_catalog_version()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -295,6 +317,7 @@ class BrandView(APIView):
             serializer = BrandSerializer(brand, data=request.data, partial=True)
             if serializer.is_valid():
                 serializer.save()
+                bump_catalog_version()
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response({'Status': False, 'Error': 'Brand was not found'})
@@ -316,6 +339,15 @@ class CategoryView(ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    @method_decorator(condition(etag_func=catalog_etag))
+    @method_decorator(cache_catalog_response)
+    def list(self, request, *args, **kwargs):
+        categories = load_snapshot().categories
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(categories)
+
 
 @extend_schema(
     request=ShopSerializer,
@@ -334,51 +366,247 @@ class ShopView(ListAPIView):
     queryset = Shop.objects.filter(state=True)
     serializer_class = ShopSerializer
 
+    @method_decorator(condition(etag_func=catalog_etag))
+    @method_decorator(cache_catalog_response)
+    def list(self, request, *args, **kwargs):
+        shops = load_snapshot().shops
+        page = self.paginate_queryset(shops)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(shops)
+
+
+def listing_query(params):
+    """
+    Build the filter of visible ProductListing rows from the shop_id, category_id, brand_id and brand parameters
+    and the `param.<id>__gte` / `__lte` / `__gt` / `__lt` numeric parameter ranges; a bad range raises ValueError.
+    """
+    query = Q(shop_state=True, is_active=True)
+    shop_id = params.get('shop_id')
+    category_id = params.get('category_id')
+    brand_id = params.get('brand_id')
+    brand = params.get('brand')
+
+    if shop_id:
+        query = query & Q(shop_id=shop_id)
+
+    if brand:
+        query = query & Q(brand_name=brand)
+
+    if brand_id:
+        query = query & Q(brand_id=brand_id)
+
+    if category_id:
+        query = query & Q(category_id=category_id)
+
+    for product_info_ids in parameter_matches(params):
+        query = query & Q(product_info_id__in=product_info_ids)
+    return query
+
 
 @extend_schema(
     request=ProductInfoSerializer,
     responses={
-        200: SuccessResponseSerializer(many=True),
+        200: ProductListingSerializer(many=True),
         400: {'description': 'Bad request, including missing fields and validation errors.'},
-        404: {'description': 'Product not found.'},
+        404: {'description': 'Product not found or invalid cursor.'},
     },
-    description="Retrieve the product information based on the specified filters."
+    parameters=[
+        OpenApiParameter(name, OpenApiTypes.STR, OpenApiParameter.QUERY)
+        for name in ('cursor', 'page_size', 'ordering', 'shop_id', 'category_id', 'brand_id', 'brand', 'fields')
+    ],
+    description="Retrieve the product information based on the specified filters, one page at a time, "
+                "with the product counts per shop, category, brand and price range. Numeric parameters are "
+                "filtered by range with `param.<parameter id>__gte`, `__lte`, `__gt` and `__lt`, "
+                "e.g. `?param.3__gte=6&param.3__lte=7`. `fields` is a comma-separated list of the fields to return."
 )
 @api_view(['GET'])
+@condition(etag_func=catalog_etag)
+@cache_catalog_response
 def product_view(request, *args, **kwargs):
     """
        Retrieve the product information based on the specified filters.
 
+       Results are paginated by key: `ordering` is `id`, `-id`, `price` or `-price`, `page_size` is at most 100,
+       and the `next` / `previous` links carry an opaque `cursor`. `facets` holds the product counts per shop,
+       category, brand and price range under the current filters. `param.<id>__gte=6` style filters keep the
+       products whose numeric value of that parameter is in range. `fields=id,price` returns only those fields
+       and reads only their columns.
+
        Args:
        - request (Request): The Django request object.
 
        Returns:
-       - Response: The response containing the product information.
+       - Response: The response containing a page of the product information.
     """
-    query = Q(shop__state=True)
-    shop_id = request.query_params.get('shop_id')
-    category_id = request.query_params.get('category_id')
-    brand_id = request.query_params.get('brand_id')
-    brand = request.query_params.get('brand')
+    try:
+        fields, _ = fieldset(request.query_params, LISTING_FIELDS)
+        queryset = ProductListing.objects.filter(listing_query(request.query_params))
+    except ValueError as error:
+        return Response({'Status': False, 'Error': str(error)}, status=400)
+    paginator = ProductListingPagination()
+    page = paginator.paginate_queryset(queryset.values(*listing_values(fields)), request)
+    response = paginator.get_paginated_response(listing_rows(page, request, fields))
+    response.data['facets'] = facet_counts(request.query_params)
+    return response
 
-    if shop_id:
-        query = query & Q(shop_id=shop_id)
 
-    if brand:
-        query = query & Q(brand__name=brand)
+@extend_schema(
+    responses={
+        200: ProductListingSerializer(many=True),
+        400: {'description': 'The search text is missing or a parameter range is not a number.'},
+        404: {'description': 'Invalid cursor.'},
+    },
+    parameters=[
+        OpenApiParameter('q', OpenApiTypes.STR, OpenApiParameter.QUERY, required=True,
+                         description='Search text, web search syntax: quoted phrases, "or", "-" to exclude.'),
+    ] + [
+        OpenApiParameter(name, OpenApiTypes.STR, OpenApiParameter.QUERY)
+        for name in ('cursor', 'page_size', 'shop_id', 'category_id', 'brand_id', 'brand')
+    ],
+    description="Search products by name, brand, model and category, best matches first."
+)
+@api_view(['GET'])
+def product_search(request, *args, **kwargs):
+    """
+       Full-text product search over the catalog listing.
 
-    if brand_id:
-        query = query & Q(brand_id=brand_id)
+       Matches are ranked by PostgreSQL full-text rank, plus trigram similarity of the product name when pg_trgm
+       is installed, so misspelled names still match. Results are paginated like product_view.
+    """
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return Response({'Status': False, 'Error': 'Не указан поисковый запрос'}, status=400)
 
-    if category_id:
-        query = query & Q(product__category_id=category_id)
+    try:
+        queryset = search_listings(ProductListing.objects.filter(listing_query(request.query_params)), text)
+    except ValueError as error:
+        return Response({'Status': False, 'Error': str(error)}, status=400)
+    paginator = ProductSearchPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = ProductListingSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
-    queryset = ProductInfo.objects.filter(query).select_related(
-        'shop', 'product__category', 'brand', 'image').prefetch_related('product',
-                                                                        'product_parameter__parameter').distinct(
-    )
-    serializer = ProductInfoSerializer(queryset, many=True)
-    return Response(serializer.data)
+
+PRODUCT_BATCH_SIZE = 100
+
+
+@extend_schema(
+    responses={
+        200: inline_serializer('ProductBatch', {
+            'results': ProductListingSerializer(many=True),
+            'missing': serializers.ListField(child=serializers.IntegerField()),
+        }),
+        400: {'description': 'No ids, too many ids, an id is not a number or an unknown field.'},
+    },
+    parameters=[
+        OpenApiParameter('ids', OpenApiTypes.STR, OpenApiParameter.QUERY, required=True,
+                         description=f'Comma-separated product ids, at most {PRODUCT_BATCH_SIZE}.'),
+        OpenApiParameter('fields', OpenApiTypes.STR, OpenApiParameter.QUERY),
+    ],
+    description="Retrieve the products with the given ids, in the order of the ids. `missing` lists the ids that "
+                "are not found or not on sale."
+)
+@api_view(['GET'])
+def product_batch(request, *args, **kwargs):
+    """
+       Retrieve several products by id in one request, for basket, wishlist and comparison screens.
+
+       Rows are taken from the per-row catalog cache; the ones it misses are read with a single `id__in` query.
+    """
+    try:
+        ids = [int(value) for values in request.query_params.getlist('ids') for value in values.split(',')
+               if value.strip()]
+    except ValueError:
+        return Response({'Status': False, 'Error': 'ids должны быть числами'}, status=400)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return Response({'Status': False, 'Error': 'Не указаны ids'}, status=400)
+    if len(ids) > PRODUCT_BATCH_SIZE:
+        return Response({'Status': False, 'Error': f'Не больше {PRODUCT_BATCH_SIZE} ids за запрос'}, status=400)
+    try:
+        fields, _ = fieldset(request.query_params, LISTING_FIELDS)
+    except ValueError as error:
+        return Response({'Status': False, 'Error': str(error)}, status=400)
+
+    rows = cached_listings(ids, listing_values(), lambda missing: ProductListing.objects.filter(
+        shop_state=True, is_active=True, product_info_id__in=missing))
+    return Response({
+        'results': listing_rows([rows[pk] for pk in ids if pk in rows], request, fields),
+        'missing': [pk for pk in ids if pk not in rows],
+    })
+
+
+@extend_schema(
+    responses={
+        200: {'description': 'Suggestions {kind, id, name}: kind is "product", "model" (the id is the product\'s) '
+                             'or "brand".'},
+    },
+    parameters=[
+        OpenApiParameter('q', OpenApiTypes.STR, OpenApiParameter.QUERY, description='Typed text.'),
+        OpenApiParameter('limit', OpenApiTypes.INT, OpenApiParameter.QUERY,
+                         description=f'Number of suggestions, at most {MAX_LIMIT}, 10 by default.'),
+    ],
+    description="Suggest product names, models and brands with a word starting with the typed text."
+)
+@api_view(['GET'])
+def product_autocomplete(request, *args, **kwargs):
+    """
+       Suggest product names, models and brands of the goods on sale for a search box.
+
+       Served from an in-memory prefix index shared between workers through a cache snapshot, so a keystroke
+       does not touch the database.
+    """
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), MAX_LIMIT)
+    except ValueError:
+        return Response({'Status': False, 'Error': 'limit должен быть числом'}, status=400)
+    return Response({'results': autocomplete(request.query_params.get('q', ''), limit)})
+
+
+@extend_schema(
+    responses={
+        (200, 'application/x-ndjson'): ProductListingSerializer,
+        (200, 'application/yaml'): OpenApiTypes.STR,
+        400: {'description': 'Bad filter or field, or no shop_id for the shop.yaml format.'},
+        404: {'description': 'Shop not found.'},
+    },
+    parameters=[
+        OpenApiParameter(name, OpenApiTypes.STR, OpenApiParameter.QUERY)
+        for name in ('shop_id', 'category_id', 'brand_id', 'brand', 'fields')
+    ],
+    description="Stream the whole catalog under the product_view filters: NDJSON, one product per line, or with "
+                "`?format=yaml` and a `shop_id` the shop's price list in the `data/shop.yaml` format."
+)
+@api_view(['GET'])
+@renderer_classes([NDJSONRenderer, YAMLRenderer])
+def product_export(request, *args, **kwargs):
+    """
+       Stream the catalog for price aggregators and partners.
+
+       Rows are read with a server-side cursor and sent batch by batch, so memory stays flat and the first rows
+       arrive before the last ones are read. NDJSON lines have the shape of product_view results (`fields`
+       applies); the YAML format needs `shop_id` and can be imported again as that shop's price list.
+    """
+    try:
+        fields, _ = fieldset(request.query_params, LISTING_FIELDS)
+        queryset = ProductListing.objects.filter(listing_query(request.query_params))
+        if request.accepted_renderer.format == 'yaml':
+            shop_id = request.query_params.get('shop_id')
+            if not shop_id:
+                return Response({'Status': False, 'Error': 'Для выгрузки в формате shop.yaml нужен shop_id'},
+                                status=400)
+            shop = Shop.objects.filter(id=shop_id).first()
+            if shop is None:
+                return Response({'Status': False, 'Error': 'Магазин не найден'}, status=404)
+            chunks = shop_feed_chunks(shop, queryset)
+        else:
+            chunks = ndjson_chunks(queryset, request, fields)
+    except ValueError as error:
+        return Response({'Status': False, 'Error': str(error)}, status=400)
+    renderer = request.accepted_renderer
+    charset = f'; charset={renderer.charset}' if renderer.charset else ''
+    return StreamingHttpResponse(chunks, content_type=renderer.media_type + charset)
 
 
 class BasketView(APIView):
@@ -477,7 +705,7 @@ class BasketView(APIView):
                     continue
 
                 try:
-                    product_info = ProductInfo.objects.get(id=product_info_id)
+                    product_info = ProductInfo.objects.get(id=product_info_id, is_active=True)
 
                     if quantity > product_info.quantity:
                         errors.append(f"Недостаточное количество для товара с ID {product_info_id}")
@@ -637,6 +865,9 @@ def partner_update(request, *args, **kwargs):
     - post: upload validated goods data.The authorization token is required. The data must be passed in yaml format via
     raw link  the request body.
     for example: url: https://raw.githubusercontent.com/netology-code/python-final-diplom/master/data/shop1.yaml
+    Returns the id of the import job, its progress is available at partner/update/<job_id>.
+    The feed is validated before anything is written. With `dry_run` set, nothing is written at all: the job's
+    summary holds the validation report and a preview of inserted, updated and removed goods.
     """
     if not request.user.is_authenticated:
         return Response({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -651,8 +882,13 @@ def partner_update(request, *args, **kwargs):
         if user_id:
             url = request.data.get('url')
             if url:
-                do_import.delay(user_id, url)
-                return Response({'Status': user_id})
+                try:
+                    dry_run = bool(strtobool(str(request.data.get('dry_run', 'false'))))
+                except ValueError as error:
+                    return Response({'Status': False, 'Error': str(error)}, status=400)
+                job = ImportJob.objects.create(user_id=user_id, url=url, dry_run=dry_run)
+                do_import.delay(user_id, url, job.id, dry_run)
+                return Response({'Status': True, 'Job': job.id})
             else:
                 return Response({'Status': False, 'Error': 'No URL'})
         else:
@@ -661,6 +897,29 @@ def partner_update(request, *args, **kwargs):
         return Response({'Status': False, 'Error': {e}})
 
 
+@extend_schema(
+    responses={
+        200: ImportJobSerializer,
+        403: {'description': 'Log in required'},
+        404: {'description': 'Not found'}
+    },
+    description="Retrieve the progress of a price list import."
+)
+@api_view(['GET'])
+def partner_update_status(request, job_id, *args, **kwargs):
+    """
+    Poll the state of an import started with partner/update.
+    The authorization token is required; only the owner of the job can see it.
+    """
+    if not request.user.is_authenticated:
+        return Response({'Status': False, 'Error': 'Log in required'}, status=403)
+
+    data = get_job_status(job_id, request.user.id)
+    if data is None:
+        return Response({'Status': False, 'Error': 'Job not found'}, status=404)
+    return Response(data)
+
+
 class PartnerState(APIView):
     """
     Retrieve the state of the partner.
@@ -718,19 +977,36 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                state = strtobool(state)
+                Shop.objects.filter(user_id=request.user.id).update(state=state)
+                ProductListing.objects.filter(shop_id__in=Shop.objects.filter(user_id=request.user.id).values('id')
+                                              ).update(shop_state=state)
+                bump_catalog_version(categories=True)
+                refresh_autocomplete_after_commit(
+                    Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
                 return Response({'Status': True})
             except ValueError as error:
                 return Response({'Status': False, 'Errors': str(error)})
         return Response({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+ORDER_FIELDSET_PARAMETERS = [
+    OpenApiParameter('fields', OpenApiTypes.STR, OpenApiParameter.QUERY,
+                     description=f'Comma-separated order fields to return, of {", ".join(ORDER_FIELDS)}.'),
+    OpenApiParameter('include', OpenApiTypes.STR, OpenApiParameter.QUERY,
+                     description=f'Comma-separated nested objects to embed, of {", ".join(ORDER_INCLUDES)}; '
+                                 f'the others are given by id (parameters are left out).'),
+]
+
+
 class PartnerOrders(APIView):
     @extend_schema(
         responses={
             status.HTTP_200_OK: OrderSerializer(many=True),
+            status.HTTP_400_BAD_REQUEST: ErrorResponseSerializer,
             status.HTTP_403_FORBIDDEN: ErrorResponseSerializer,
         },
+        parameters=ORDER_FIELDSET_PARAMETERS,
         description="Retrieve the items in the user's basket."
     )
     def get(self, request, *args, **kwargs):
@@ -748,14 +1024,16 @@ class PartnerOrders(APIView):
 
         if request.user.type != 'shop':
             return Response({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+        try:
+            fields, includes = fieldset(request.query_params, ORDER_FIELDS, ORDER_INCLUDES)
+        except ValueError as error:
+            return Response({'Status': False, 'Error': str(error)}, status=400)
+        # the sum is annotated after this filter, so it only counts the partner's items
         queryset = Order.objects.filter(
-            order_items__product_info__shop__user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'order_items__product_info__product__category',
-            'order_items__product_info__product_parameter__parameter').annotate(
-            total_sum=Sum(F('order_items__quantity') * F('order_items__product_info__price'))).distinct()
+            order_items__product_info__shop__user_id=request.user.id).exclude(state='basket').distinct().order_by(
+            '-created', '-id')
 
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(order_rows(queryset, fields, includes))
 
 
 class ContactView(APIView):
@@ -897,8 +1175,10 @@ class OrdersView(APIView):
                    '400': ErrorResponseSerializer,
                    '403': ErrorResponseSerializer,
                    },
+        parameters=ORDER_FIELDSET_PARAMETERS,
         description="Get an order."
     )
+    @method_decorator(condition(etag_func=order_etag))
     def get(self, request, *args, **kwargs):
         """
         Retrieve the details of a specific order.The request header must contain the 'Authorization' and 'Token' and
@@ -907,14 +1187,14 @@ class OrdersView(APIView):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        orders = Order.objects.filter(user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'order_items__product_info__product__category',
-            'order_items__product_info__brand',
-            'order_items__product_info__product_parameter__parameter').annotate(
-            total_sum=Sum(F('order_items__quantity') * F('order_items__product_info__price'))).distinct()
+        try:
+            fields, includes = fieldset(request.query_params, ORDER_FIELDS, ORDER_INCLUDES)
+        except ValueError as error:
+            return Response({'Status': False, 'Error': str(error)}, status=400)
+        orders = Order.objects.filter(user_id=request.user.id).exclude(state='basket').distinct().order_by(
+            '-created', '-id')
 
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return Response(order_rows(orders, fields, includes))
 
     @extend_schema(
         request=OrderSerializer,
@@ -947,6 +1227,7 @@ class OrdersView(APIView):
                                 user_id=request.user.id,
                                 id=order_id
                             ).update(contact_id=contact_id, state='new')
+                            bump_order_version(request.user.id)
 
                             if not is_updated:
                                 return Response({'Status': False, 'Error': 'Order not found'}, status=404)
@@ -958,11 +1239,14 @@ class OrdersView(APIView):
 
                             for pq in product_quantities:
                                 product_info = ProductInfo.objects.get(id=pq['product_info_id'])
+                                if not product_info.is_active:
+                                    raise ValueError(f"Product {product_info.id} is no longer on sale")
                                 product_info.quantity -= pq['total_quantity']
                                 if product_info.quantity < 0:
                                     raise ValueError(f"Insufficient stock for product {product_info.id}")
                                 product_info.save()
                                 notify_low_stock.delay(product_info.id)
+                            bump_catalog_version()
 
                             new_order.send(sender=request.user.id, user_id=request.user.id)
                             return Response({'Status': True}, status=200)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
+from importlib.util import find_spec
 from pathlib import Path
 import django.db.models.signals
 from dotenv import load_dotenv
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -154,9 +156,11 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
         'rest_framework_yaml.parsers.YAMLParser',
     ],
+    # YAML - формат по умолчанию (без Accept), JSON и MessagePack выбираются заголовком Accept
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework_yaml.renderers.YAMLRenderer',
-        ],
+        'backend.renderers.YAMLRenderer',
+        'backend.renderers.UJSONRenderer',
+    ] + (['backend.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
@@ -222,6 +226,12 @@ INTERNAL_IPS = [
     "mysite.com",
 ]
 
+# Способ записи прайс-листа: 'bulk' - bulk_create/bulk_update, 'copy' - COPY во временные таблицы и слияние
+# одним запросом (только PostgreSQL)
+IMPORT_MODE = os.getenv('IMPORT_MODE', 'bulk')
+# Товаров в одной задаче параллельного импорта прайс-листа; 0 - весь прайс-лист импортируется одной задачей
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 0))
+
 CELERY_BROKER_URL = os.environ.get("BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get("RESULT_BACKEND", "redis://redis:6379/0")
 RUNSERVERPLUS_SERVER_ADDRESS_PORT = 'mysite.com:443'
@@ -392,6 +402,12 @@ DEBUG_TOOLBAR_CONFIG = {
 
 CACHEOPS_REDIS = "redis://redis:6379/1"
 
+# Время жизни ответов каталога в кеше, с; изменения каталога делают их устаревшими раньше (backend/cache.py)
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 15 * 60))
+
+# Как часто процесс сверяет версию снимка индекса автодополнения в кеше, с (backend/autocomplete.py)
+AUTOCOMPLETE_CHECK_INTERVAL = float(os.getenv('AUTOCOMPLETE_CHECK_INTERVAL', 1))
+
 CACHEOPS = {
     'backend.*': {'ops': 'all', 'timeout': 60 * 60},
 }
@@ -7,17 +7,23 @@ from django.core.mail import EmailMultiAlternatives
 from django.core.validators import URLValidator
 
 import celery
-from django.http import HttpResponse
-from requests import get
-from rest_framework.exceptions import ValidationError
-from yaml import safe_load
+from celery import chord
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from easy_thumbnails.files import generate_all_aliases
 from easy_thumbnails.exceptions import InvalidImageFormatError
 
 
-from backend.models import ConfirmEmailToken, Shop, Category, ProductInfo, Brand, Product, Parameter, \
-    ProductParameter
-from djangoProjectFinalWork import settings
+from backend.autocomplete import refresh_autocomplete
+from backend.cache import bump_catalog_version
+from backend.feeds import fetch_feed, remember_feed, FeedError
+from backend.importer import ShopImporter, JobReporter, ImportStats, job_status_key, get_importer_class
+from backend.validation import validate_feed, FeedDiff
+from backend.models import ConfirmEmailToken, ProductInfo, ImportJob
 
 app = celery.Celery(
     'tasks',
@@ -89,59 +95,132 @@ def send_order_email(user_id):
 
 
 @shared_task
-def do_import(user_id, url):
+def do_import(user_id, url, job_id=None, dry_run=False):
     """
-    Импортируем данные из yaml файла
+    Импортируем данные из прайс-листа в формате YAML, JSON Lines или CSV.
+    Если прайс-лист не изменился с прошлого импорта магазина, разбор и запись в базу пропускаются.
+    Перед записью прайс-лист целиком проверяется; импорт с ошибками не начинается.
+    При dry_run база не изменяется, в ImportJob сохраняются отчёт проверки и список предстоящих изменений.
+    Ход и результат импорта сохраняются в ImportJob.
     """
     user_model = get_user_model()
-    user = user_model.objects.get(pk=user_id)
     try:
-        validate_url = URLValidator()
-        try:
-            validate_url(url)
-        except ValidationError as err:
-            return f'Status: False, Error: {str(err)}',
-        else:
-            try:
-                stream = get(url).content
-                yaml_file = safe_load(stream)
-            except yaml.YAMLError as exc:
-                return HttpResponse(f'Status: False, Error: YAML Error: {exc}')
-            shop, _ = Shop.objects.get_or_create(name=yaml_file['shop'], user_id=user.pk)
-            for category in yaml_file['categories']:
-                category_obj, _ = Category.objects.get_or_create(name=category['name'])
-                category_obj.shops.add(shop.id)
-                category_obj.save()
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-            for product in yaml_file['goods']:
-                product_obj, _ = Product.objects.get_or_create(name=product['name'], category=category_obj)
-                if product['brand']:
-                    brand, _ = Brand.objects.get_or_create(name=product.get('brand'))
-                    brand_name = Brand.objects.filter(name=product.get('brand')).first()
-                product_info = ProductInfo.objects.create(
-                    product_id=product_obj.id,
-                    external_id=product['id'],
-                    model=product['model'],
-                    price=product['price'],
-                    price_rrc=product['price_rrc'],
-                    quantity=product['quantity'],
-                    shop_id=shop.id,
-                    brand=brand_name,
-                )
-                product_info.save()
-                print(product_info)
-                for name, value in product['parameters'].items():
-                    parameter_obj, _ = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(
-                        product_info_id=product_info.id,
-                        parameter_id=parameter_obj.id,
-                        value=value,
-                    )
-
+        user = user_model.objects.get(pk=user_id)
     except user_model.DoesNotExist:
+        ImportJob.objects.filter(pk=job_id).update(state='failed', error='User does not exist')
         return 'Status: False, Error: User does not exist'
-    finally:
-        return 'Status: True'
+    job = ImportJob.objects.filter(pk=job_id).first() if job_id else None
+    reporter = JobReporter(job or ImportJob.objects.create(user_id=user.pk, url=url))
+    reporter.start()
+    validate_url = URLValidator()
+    try:
+        validate_url(url)
+    except ValidationError as err:
+        reporter.finish('failed', error=str(err))
+        return f'Status: False, Error: {str(err)}'
+    try:
+        with fetch_feed(url, user.pk) as feed:
+            if feed.not_modified:
+                reporter.finish('not_modified')
+                return 'Status: True, Not modified'
+            report = validate_feed(feed.read(), FeedDiff(user.pk) if dry_run else None)
+            if not report['valid']:
+                error = f"Feed validation failed: {report['error_count']} invalid rows"
+                reporter.finish('failed', error=error, report=report)
+                return f'Status: False, Error: {error}'
+            if dry_run:
+                reporter.finish('done', report=report)
+                return 'Status: True, Dry run'
+            importer = get_importer_class()(user.pk, progress=reporter.progress)
+            data = feed.read()
+            if settings.IMPORT_CHUNK_SIZE and type(importer) is ShopImporter:
+                chunks = import_in_parallel(importer, data, feed, reporter.job.id)
+                return f'Status: True, Chunks: {chunks}'
+            stats = importer.run(data)
+            feed.remember(importer.shop)
+            bump_catalog_version(categories=True)
+            refresh_autocomplete_after_commit([importer.shop.id])
+    except FeedError as exc:
+        reporter.finish('failed', error=f'Feed Error: {exc}')
+        return f'Status: False, Error: Feed Error: {exc}'
+    except yaml.YAMLError as exc:
+        reporter.finish('failed', error=f'YAML Error: {exc}')
+        return f'Status: False, Error: YAML Error: {exc}'
+    except Exception as exc:
+        reporter.finish('failed', error=repr(exc))
+        raise
+    reporter.finish('done', stats)
+    logging.info('Import for user %s finished: %s rows/sec', user.pk, stats.rows_per_sec)
+    return 'Status: True'
+
+
+def import_in_parallel(importer, data, feed, job_id):
+    """
+    Split the feed into chunks of IMPORT_CHUNK_SIZE goods and import them with a group of import_chunk tasks.
+    The chord callback retires SKUs missing from the feed and closes the job.
+    """
+    chunks, stats = importer.split(data, settings.IMPORT_CHUNK_SIZE)
+    callback = finish_import.s(job_id, importer.shop.id, feed.validators(), stats.parse_time)
+    if not chunks:
+        callback.apply(args=([],))
+    else:
+        chord(import_chunk.s(importer.shop.id, records, job_id) for records in chunks)(
+            callback.on_error(fail_import.s(job_id)))
+    return len(chunks)
+
+
+@shared_task
+def import_chunk(shop_id, records, job_id):
+    """
+    Импортируем одну пачку товаров параллельного импорта
+    """
+    stats = ShopImporter.import_records(shop_id, records)
+    ImportJob.objects.filter(pk=job_id).update(products_processed=F('products_processed') + stats.products)
+    cache.delete(job_status_key(job_id))
+    return dict(stats.as_dict(), seen=[record['external_id'] for record in records])
+
+
+@shared_task
+def finish_import(results, job_id, shop_id, validators, parse_time):
+    """
+    Завершаем параллельный импорт: снимаем с продажи пропавшие товары и сохраняем итоги
+    """
+    job = ImportJob.objects.get(pk=job_id)
+    stats = ImportStats()
+    for result in results:
+        stats.merge(result)
+    stats.parse_time += parse_time
+    seen = [external_id for result in results for external_id in result['seen']]
+    stats.removed += ShopImporter.retire(shop_id, seen)
+    remember_feed(shop_id, validators)
+    bump_catalog_version(categories=True)
+    refresh_autocomplete_after_commit([shop_id])
+    # rows/sec is measured over the whole job, not over this callback
+    stats.finish()
+    stats.started = stats.finished - (timezone.now() - job.started).total_seconds()
+    JobReporter(job).finish('done', stats)
+    return 'Status: True'
+
+
+@shared_task
+def fail_import(request, exc, traceback, job_id):
+    JobReporter(ImportJob.objects.get(pk=job_id)).finish('failed', error=repr(exc))
+
+
+@shared_task
+def refresh_autocomplete_task(shop_ids=None):
+    """
+    Обновляем индекс автодополнения для товаров магазинов shop_ids (всех магазинов, если None)
+    """
+    refresh_autocomplete(shop_ids)
+
+
+def refresh_autocomplete_after_commit(shop_ids):
+    """
+    Queue the autocomplete refresh of the shops once the current transaction commits.
+    """
+    shop_ids = list(shop_ids)
+    transaction.on_commit(lambda: refresh_autocomplete_task.delay(shop_ids))
 
 
 @shared_task
@@ -2,11 +2,11 @@ from .settings import *
 
 
 REST_FRAMEWORK = {
-    'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.UJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',  # Для отладки
-
-    ),
+        'backend.renderers.YAMLRenderer',
+    ] + (['backend.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',  # Для отладки
@@ -25,3 +25,14 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
     }
 }
+
+# Панель отладки не подключает свои URL при DEBUG=False и ломает ответы в тестах
+DEBUG_TOOLBAR_CONFIG = {
+    'SHOW_TOOLBAR_CALLBACK': lambda request: False,
+}
+
+# Ответы каталога не кешируются: тесты меняют базу без увеличения версии каталога. Тесты кеша включают его сами
+CATALOG_CACHE_TIMEOUT = 0
+
+# Индекс автодополнения сверяется с кешем на каждый запрос: тесты очищают кеш между собой
+AUTOCOMPLETE_CHECK_INTERVAL = 0
@@ -0,0 +1,57 @@
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from backend.feeds import read_feed
+from backend.models import Category, ProductInfo
+from backend.validation import validate_feed
+
+
+class GenerateFeedCommandTestCase(TestCase):
+    def test_generated_feeds_are_valid_in_every_format(self):
+        for feed_format in ('yaml', 'jsonl', 'csv'):
+            with self.subTest(feed_format=feed_format):
+                stdout = io.StringIO()
+                call_command('generate_feed', '-', goods=25, parameters=3, brands=4, categories=5,
+                             format=feed_format, stdout=stdout)
+                feed = read_feed(io.BytesIO(stdout.getvalue().encode()), url=f'feed.{feed_format}')
+                self.assertEqual(len(feed['categories']), 5)
+                goods = list(feed['goods'])
+                self.assertEqual(len(goods), 25)
+                self.assertTrue(all(len(item['parameters']) == 3 for item in goods))
+                report = validate_feed(read_feed(io.BytesIO(stdout.getvalue().encode()), url=f'feed.{feed_format}'))
+                self.assertTrue(report['valid'], report['errors'])
+
+
+class BenchmarkImportCommandTestCase(TestCase):
+    def test_results_are_appended_and_catalog_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            for _ in range(2):
+                call_command('benchmark_import', goods=[30], parameters=2, output=output,
+                             stdout=io.StringIO(), stderr=io.StringIO())
+            with open(output, encoding='utf-8') as stream:
+                runs = json.load(stream)
+
+        self.assertEqual(len(runs), 2)
+        initial, reimport = runs[0]['results']
+        self.assertEqual((initial['run'], initial['products'], initial['summary']['inserted']), ('initial', 30, 30))
+        self.assertEqual((reimport['run'], reimport['summary']['unchanged']), ('reimport', 30))
+        self.assertGreater(initial['queries'], 0)
+        self.assertGreater(initial['peak_rss_mb'], 0)
+        self.assertGreaterEqual(reimport['rss_growth_mb'], 0)
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(Category.objects.filter(name__startswith='Benchmark').exists())
+
+
+class BenchmarkRenderersCommandTestCase(TestCase):
+    def test_every_renderer_is_timed(self):
+        stdout = io.StringIO()
+        call_command('benchmark_renderers', rows=20, repeat=1, stdout=stdout, stderr=io.StringIO())
+        results = json.loads(stdout.getvalue())['results']
+        self.assertIn('json (ujson)', [result['renderer'] for result in results])
+        self.assertTrue(all(result['ms_per_1k_rows'] >= 0 and result['bytes_per_row'] > 0 for result in results))
@@ -0,0 +1,489 @@
+import csv
+import hashlib
+import io
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import GeneratorType
+from unittest import skipUnless
+
+import ujson
+import yaml
+from django.core.cache import cache
+from django.db import connection
+from celery import current_app
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from backend.feeds import read_yaml_feed, read_feed, feed_format, FeedError, CSV_COLUMNS
+from backend.importer import ShopImporter, CopyShopImporter
+from backend.models import User, Shop, Category, Brand, Product, Parameter, ProductInfo, ProductParameter, Order, \
+    OrderItem, ShopFeed, ImportJob, ShopCategory, ProductListing
+from djangoProjectFinalWork.tasks import do_import
+
+SHOP_YAML = Path(__file__).resolve().parents[2] / 'data' / 'shop.yaml'
+
+
+class GeneratedFeed(io.RawIOBase):
+    """
+    A file-like feed of `size` goods rendered on demand, so the test itself never holds the whole document.
+    """
+
+    def __init__(self, size):
+        self.chunks = self._render(size)
+        self.buffer = b''
+
+    def _render(self, size):
+        yield 'shop: Generated\ncategories:\n  - id: 1\n    name: Category\ngoods:\n'.encode()
+        for number in range(size):
+            yield (
+                f'  - id: {number}\n    category: 1\n    model: model/{number}\n    brand: Brand\n'
+                f'    name: Product {number}\n    price: 100\n    price_rrc: 110\n    quantity: 5\n'
+                f'    parameters:\n      "Цвет": черный\n      "Память (Гб)": 256\n'
+            ).encode()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.buffer) < len(buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size], self.buffer = self.buffer[:size], self.buffer[size:]
+        return size
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY import needs PostgreSQL')
+class CopyShopImporterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            self.data = yaml.safe_load(stream)
+
+    def test_copy_import_matches_bulk_import(self):
+        stats = CopyShopImporter(self.user.id).run(self.data)
+        self.assertEqual((stats.products, stats.inserted), (14, 14))
+        self.assertEqual(ProductInfo.objects.count(), 14)
+        self.assertEqual(ProductParameter.objects.count(), 47)
+        copied = set(ProductParameter.objects.values_list(
+            'product_info__external_id', 'product_info__price', 'parameter__name', 'value', 'numeric_value'))
+
+        ProductInfo.objects.all().delete()
+        ShopImporter(self.user.id).run(self.data)
+        self.assertEqual(copied, set(ProductParameter.objects.values_list(
+            'product_info__external_id', 'product_info__price', 'parameter__name', 'value', 'numeric_value')))
+
+    def test_copy_reimport_merges_changes(self):
+        CopyShopImporter(self.user.id).run(self.data)
+        self.data['goods'][0]['price'] = 99990
+        self.data['goods'][1]['parameters']['Цвет'] = 'бел\tый\\'
+        removed = self.data['goods'].pop()
+        stats = CopyShopImporter(self.user.id).run(self.data)
+
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.removed), (0, 2, 11, 1))
+        self.assertEqual(ProductInfo.objects.get(external_id=self.data['goods'][0]['id']).price, 99990)
+        self.assertEqual(ProductListing.objects.get(external_id=self.data['goods'][0]['id']).price, 99990)
+        self.assertFalse(ProductListing.objects.get(external_id=removed['id']).is_active)
+        self.assertFalse(ProductInfo.objects.get(external_id=removed['id']).is_active)
+        self.assertEqual(
+            ProductParameter.objects.get(
+                product_info__external_id=self.data['goods'][1]['id'], parameter__name='Цвет').value, 'бел\tый\\')
+
+
+class YAMLFeedReaderTestCase(TestCase):
+    def test_stream_matches_safe_load(self):
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            expected = yaml.safe_load(stream)
+        with open(SHOP_YAML, 'rb') as stream:
+            feed = read_yaml_feed(stream)
+            self.assertIsInstance(feed['goods'], GeneratorType)
+            self.assertEqual(feed['shop'], expected['shop'])
+            self.assertEqual(feed['categories'], expected['categories'])
+            self.assertEqual(list(feed['goods']), expected['goods'])
+
+    def test_goods_must_follow_header(self):
+        with self.assertRaises(FeedError):
+            read_yaml_feed(io.BytesIO(b'goods: []\nshop: Late\ncategories: []\n'))
+
+    def test_memory_does_not_grow_with_feed_size(self):
+        def peak(size):
+            tracemalloc.start()
+            for _ in read_yaml_feed(GeneratedFeed(size))['goods']:
+                pass
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result
+
+        self.assertLess(peak(5000), peak(500) * 2)
+
+
+def render_jsonl(data):
+    lines = [{'shop': data['shop'], 'categories': data['categories']}] + data['goods']
+    return ''.join(ujson.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode()
+
+
+def render_csv(data):
+    categories = {category['id']: category['name'] for category in data['categories']}
+    stream = io.StringIO()
+    writer = csv.DictWriter(stream, CSV_COLUMNS)
+    writer.writeheader()
+    for item in data['goods']:
+        writer.writerow(dict(
+            {key: value for key, value in item.items() if key != 'category'}, shop=data['shop'],
+            category_id=item['category'], category=categories[item['category']],
+            parameters=ujson.dumps(item['parameters'], ensure_ascii=False)))
+    return stream.getvalue().encode()
+
+
+class FeedFormatTestCase(TestCase):
+    def setUp(self):
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            self.data = yaml.safe_load(stream)
+
+    def test_format_is_picked_by_content_type_then_extension(self):
+        self.assertEqual(feed_format('application/x-ndjson; charset=utf-8', 'http://x/feed.yaml'), 'jsonl')
+        self.assertEqual(feed_format('text/plain', 'http://x/feed.csv?token=1'), 'csv')
+        self.assertEqual(feed_format('', 'http://x/feed.jsonl'), 'jsonl')
+        self.assertEqual(feed_format('application/octet-stream', 'http://x/feed'), 'yaml')
+
+    def test_jsonl_matches_yaml(self):
+        feed = read_feed(io.BytesIO(render_jsonl(self.data)), 'application/x-ndjson')
+        self.assertIsInstance(feed['goods'], GeneratorType)
+        self.assertEqual((feed['shop'], feed['categories']), (self.data['shop'], self.data['categories']))
+        self.assertEqual(list(feed['goods']), self.data['goods'])
+
+    def test_csv_matches_yaml(self):
+        feed = read_feed(io.BytesIO(render_csv(self.data)), 'text/csv')
+        self.assertEqual(feed['shop'], self.data['shop'])
+        self.assertEqual(
+            sorted(feed['categories'], key=lambda category: category['id']),
+            sorted(self.data['categories'], key=lambda category: category['id']))
+        goods = list(feed['goods'])
+        self.assertEqual([item['parameters'] for item in goods], [item['parameters'] for item in self.data['goods']])
+        self.assertEqual([str(item['price']) for item in goods], [str(item['price']) for item in self.data['goods']])
+
+    def test_malformed_lines_raise_feed_error(self):
+        body = render_jsonl(self.data) + b'{"id": \n'
+        with self.assertRaises(FeedError):
+            list(read_feed(io.BytesIO(body), url='feed.jsonl')['goods'])
+        with self.assertRaises(FeedError):
+            read_feed(io.BytesIO(b'shop,id\nShop,1\n'), url='feed.csv')
+
+
+class ShopImporterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            self.data = yaml.safe_load(stream)
+
+    def test_import_creates_catalog(self):
+        stats = ShopImporter(self.user.id).run(self.data)
+        shop = Shop.objects.get(user=self.user)
+        self.assertEqual(shop.name, 'Связной')
+        self.assertEqual(ProductInfo.objects.filter(shop=shop).count(), 14)
+        self.assertEqual(ProductParameter.objects.filter(product_info__shop=shop).count(), 47)
+        self.assertEqual(Brand.objects.count(), 3)
+        self.assertEqual(Category.objects.filter(shops=shop).count(), 4)
+        self.assertEqual(Parameter.objects.count(), 10)
+        self.assertEqual(stats.products, 14)
+        self.assertEqual(stats.parameters, 47)
+        self.assertGreater(stats.rows_per_sec, 0)
+
+        product_info = ProductInfo.objects.select_related('product__category', 'brand').get(external_id=88889990)
+        self.assertEqual(product_info.product.category.name, 'Смартфоны')
+        self.assertEqual(product_info.brand.name, 'Nicarho')
+        self.assertEqual(product_info.product_parameter.get(parameter__name='Цвет').value, 'золотистый')
+
+    def test_reimport_does_not_duplicate_dictionaries(self):
+        ShopImporter(self.user.id).run(self.data)
+        ShopImporter(self.user.id).run(self.data)
+        self.assertEqual(ProductInfo.objects.count(), 14)
+        self.assertEqual(Product.objects.count(), 14)
+        self.assertEqual(Brand.objects.count(), 3)
+        self.assertEqual(Parameter.objects.count(), 10)
+
+    def test_reimport_updates_only_changed_rows(self):
+        ShopImporter(self.user.id).run(self.data)
+        shop = Shop.objects.get(user=self.user)
+        kept = ProductInfo.objects.get(external_id=self.data['goods'][0]['id'])
+        buyer = User.objects.create_user(email='buyer@example.com', password='testpassword')
+        order = Order.objects.create(user=buyer, state='new')
+        OrderItem.objects.create(order=order, product_info=kept, quantity=1)
+
+        self.data['goods'][0]['price'] = 99990
+        self.data['goods'][1]['parameters']['Цвет'] = 'белый'
+        removed = self.data['goods'].pop()
+        stats = ShopImporter(self.user.id).run(self.data)
+
+        self.assertEqual(
+            (stats.inserted, stats.updated, stats.unchanged, stats.removed), (0, 2, 11, 1))
+        kept.refresh_from_db()
+        self.assertEqual(kept.price, 99990)
+        self.assertTrue(OrderItem.objects.filter(order=order, product_info=kept).exists())
+        self.assertFalse(ProductInfo.objects.get(shop=shop, external_id=removed['id']).is_active)
+        self.assertEqual(
+            ProductParameter.objects.get(
+                product_info__external_id=self.data['goods'][1]['id'], parameter__name='Цвет').value, 'белый')
+
+        self.data['goods'].append(removed)
+        stats = ShopImporter(self.user.id).run(self.data)
+        self.assertEqual((stats.updated, stats.unchanged, stats.removed), (1, 13, 0))
+        self.assertTrue(ProductInfo.objects.get(shop=shop, external_id=removed['id']).is_active)
+
+    def test_goods_follow_feed_category_ids(self):
+        ShopImporter(self.user.id).run(self.data)
+        feed_categories = {category['id']: category['name'] for category in self.data['categories']}
+        for item in self.data['goods']:
+            self.assertEqual(
+                ProductInfo.objects.get(external_id=item['id']).product.category.name, feed_categories[item['category']])
+        self.assertEqual(
+            dict(ShopCategory.objects.values_list('external_id', 'category__name')), feed_categories)
+
+    def test_mapped_categories_are_reused_and_renames_remapped(self):
+        ShopImporter(self.user.id).run(self.data)
+        smartphones = Category.objects.get(name='Смартфоны')
+        self.data['categories'][0]['name'] = 'Телефоны'
+        ShopImporter(self.user.id).run(self.data)
+
+        self.assertEqual(ShopCategory.objects.get(external_id=224).category.name, 'Телефоны')
+        self.assertEqual(ShopCategory.objects.get(external_id=15).category.name, 'Аксессуары')
+        self.assertEqual(ShopCategory.objects.count(), 4)
+        self.assertTrue(Category.objects.filter(pk=smartphones.pk).exists())
+        self.assertEqual(ProductInfo.objects.filter(product__category__name='Телефоны').count(),
+                         sum(item['category'] == 224 for item in self.data['goods']))
+        self.assertFalse(ProductInfo.objects.filter(product__category=smartphones).exists())
+
+    def test_import_refreshes_listing(self):
+        ShopImporter(self.user.id).run(self.data)
+        self.assertEqual(ProductListing.objects.filter(is_active=True).count(), 14)
+        item = self.data['goods'][0]
+        listing = ProductListing.objects.get(external_id=item['id'])
+        self.assertEqual((listing.product_name, listing.category_name, listing.brand_name),
+                         (item['name'], 'Смартфоны', item['brand']))
+        self.assertEqual(listing.parameters, {name: str(value) for name, value in item['parameters'].items()})
+
+        item['price'] = 1
+        removed = self.data['goods'].pop()
+        ShopImporter(self.user.id).run(self.data)
+        self.assertEqual(ProductListing.objects.get(external_id=item['id']).price, 1)
+        self.assertFalse(ProductListing.objects.get(external_id=removed['id']).is_active)
+
+    def test_import_query_count_does_not_grow_with_feed(self):
+        with CaptureQueriesContext(connection) as queries:
+            ShopImporter(self.user.id).run(self.data)
+        self.assertLess(len(queries), 30)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    Serves `server.body` and answers 304 when the client sends the current ETag, or always with
+    `server.always_not_modified`.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        etag = f'"{hashlib.md5(server.body).hexdigest()}"' if server.use_etag else None
+        if server.always_not_modified or etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        server.downloads += 1
+        self.send_response(200)
+        self.send_header('Content-Type', server.content_type)
+        self.send_header('Content-Length', str(len(server.body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServerMixin:
+    """
+    Runs a local HTTP stand-in for the partner's feed URL.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        self.server.body = SHOP_YAML.read_bytes()
+        self.server.use_etag = False
+        self.server.always_not_modified = False
+        self.server.content_type = 'application/x-yaml'
+        self.server.requests = self.server.downloads = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/shop.yaml'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FeedHashTestCase(FeedServerMixin, TestCase):
+    def test_unchanged_feed_is_skipped(self):
+        self.assertEqual(do_import(self.user.id, self.url), 'Status: True')
+        feed = ShopFeed.objects.get(shop__user=self.user)
+        self.assertEqual(feed.sha256, hashlib.sha256(self.server.body).hexdigest())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(do_import(self.user.id, self.url), 'Status: True, Not modified')
+        self.assertFalse([query for query in queries if 'backend_productinfo' in query['sql']])
+
+    def test_changed_feed_is_imported(self):
+        do_import(self.user.id, self.url)
+        self.server.body = self.server.body.replace(b'price: 110000', b'price: 100000')
+        self.assertEqual(do_import(self.user.id, self.url), 'Status: True')
+        self.assertEqual(ProductInfo.objects.get(external_id=88889990).price, 100000)
+
+    def test_job_reports_outcome(self):
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        do_import(self.user.id, self.url, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.products_processed, 14)
+        self.assertEqual(job.summary['inserted'], 14)
+        self.assertGreater(job.rows_per_sec, 0)
+        self.assertIsNotNone(job.finished)
+
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        do_import(self.user.id, self.url, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'not_modified')
+
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        self.server.body = b'shop: [broken'
+        do_import(self.user.id, self.url, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('YAML Error', job.error)
+
+    def test_unexpected_not_modified_fails(self):
+        self.server.always_not_modified = True
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        self.assertIn('Feed Error', do_import(self.user.id, self.url, job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertFalse(ProductInfo.objects.exists())
+
+    def test_etag_avoids_download(self):
+        self.server.use_etag = True
+        do_import(self.user.id, self.url)
+        self.assertTrue(ShopFeed.objects.get(shop__user=self.user).etag)
+        self.assertEqual(do_import(self.user.id, self.url), 'Status: True, Not modified')
+        self.assertEqual((self.server.requests, self.server.downloads), (2, 1))
+
+
+class FeedFormatImportTestCase(FeedServerMixin, TestCase):
+    def imported_rows(self):
+        return set(ProductParameter.objects.values_list(
+            'product_info__external_id', 'product_info__price', 'product_info__quantity', 'parameter__name', 'value'))
+
+    def test_formats_import_the_same_catalog(self):
+        do_import(self.user.id, self.url)
+        expected = self.imported_rows()
+        data = yaml.safe_load(self.server.body)
+        for content_type, body in (('application/x-ndjson', render_jsonl(data)), ('text/csv', render_csv(data))):
+            with self.subTest(content_type=content_type):
+                ProductInfo.objects.all().delete()
+                ShopFeed.objects.all().delete()
+                self.server.body, self.server.content_type = body, content_type
+                self.assertEqual(do_import(self.user.id, self.url), 'Status: True')
+                self.assertEqual(self.imported_rows(), expected)
+
+    def test_broken_feed_fails_job(self):
+        self.server.body, self.server.content_type = b'{"shop": "Shop"}\n', 'application/x-ndjson'
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        do_import(self.user.id, self.url, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('Feed Error', job.error)
+
+
+class FeedValidationTestCase(FeedServerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = yaml.safe_load(self.server.body)
+
+    def serve(self, data):
+        self.server.body = yaml.safe_dump(data, allow_unicode=True, sort_keys=False).encode()
+
+    def test_invalid_feed_is_rejected_before_writing(self):
+        del self.data['goods'][3]['name']
+        self.data['goods'][5]['category'] = 999
+        self.data['goods'][6]['price'] = 'free'
+        self.serve(self.data)
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        self.assertIn('3 invalid rows', do_import(self.user.id, self.url, job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.summary['products'], 14)
+        self.assertEqual([error['row'] for error in job.summary['errors']], [4, 6, 7])
+        self.assertEqual(job.summary['errors'][1]['errors'][0]['loc'], 'category')
+        self.assertFalse(ProductInfo.objects.exists())
+
+    def test_dry_run_previews_changes(self):
+        job = ImportJob.objects.create(user=self.user, url=self.url, dry_run=True)
+        self.assertEqual(do_import(self.user.id, self.url, job.id, dry_run=True), 'Status: True, Dry run')
+        job.refresh_from_db()
+        self.assertTrue(job.summary['valid'])
+        self.assertEqual(job.summary['diff']['inserted'], 14)
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(ShopFeed.objects.exists())
+
+        do_import(self.user.id, self.url)
+        self.data['goods'][0]['price'] = 99990
+        self.data['goods'][1]['parameters']['Цвет'] = 'белый'
+        removed = self.data['goods'].pop()
+        self.serve(self.data)
+        job = ImportJob.objects.create(user=self.user, url=self.url, dry_run=True)
+        do_import(self.user.id, self.url, job.id, dry_run=True)
+        job.refresh_from_db()
+        diff = job.summary['diff']
+        self.assertEqual((diff['inserted'], diff['updated'], diff['unchanged'], diff['removed']), (0, 2, 11, 1))
+        self.assertEqual(diff['samples']['removed'], [removed['id']])
+        self.assertEqual(diff['samples']['updated'][0]['changes'], {'price': ['110000.00', '99990.00']})
+        self.assertEqual(ProductInfo.objects.get(external_id=self.data['goods'][0]['id']).price, 110000)
+        self.assertTrue(ProductInfo.objects.get(external_id=removed['id']).is_active)
+
+
+@override_settings(IMPORT_CHUNK_SIZE=4)
+class ParallelImportTestCase(FeedServerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+
+    def tearDown(self):
+        current_app.conf.task_always_eager = self.always_eager
+        super().tearDown()
+
+    def test_chunks_import_whole_feed(self):
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        self.assertEqual(do_import(self.user.id, self.url, job.id), 'Status: True, Chunks: 4')
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.products_processed, 14)
+        self.assertEqual(job.summary['inserted'], 14)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.user).count(), 14)
+        self.assertEqual(ProductParameter.objects.count(), 47)
+        self.assertEqual(Product.objects.count(), 14)
+        self.assertEqual(ProductListing.objects.count(), 14)
+
+    def test_chunks_retire_missing_rows(self):
+        do_import(self.user.id, self.url)
+        data = yaml.safe_load(self.server.body)
+        removed = data['goods'].pop()
+        self.server.body = yaml.safe_dump(data, allow_unicode=True, sort_keys=False).encode()
+        job = ImportJob.objects.create(user=self.user, url=self.url)
+        do_import(self.user.id, self.url, job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.summary['unchanged'], job.summary['removed']), (13, 1))
+        self.assertFalse(ProductInfo.objects.get(external_id=removed['id']).is_active)
@@ -1,21 +1,44 @@
 import json
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
 
+import yaml
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
+from rest_framework.throttling import AnonRateThrottle
 
 from backend.models import User, ConfirmEmailToken, Shop, Category, Brand, Product, Parameter, ProductParameter, \
-    ProductInfo, Order, OrderItem, Contact
+    ProductInfo, Order, OrderItem, Contact, ImportJob, ProductListing
 from django.test import TestCase
 
-from backend.views import OrdersView
+from backend.autocomplete import LOCK_KEY, QUEUED_KEY, refresh_autocomplete
+from backend.cache import bump_catalog_version
+from backend.categories import load_snapshot
+from backend.renderers import msgpack
+from backend.export import ndjson_chunks
+from backend.facets import compact, dense, rebuild_facets, to_bitmap, update_facets
+from backend.importer import ShopImporter
+from backend.listings import refresh_listings
+from backend.search import has_trigram
+from backend.serializers import CategorySerializer, OrderSerializer, ProductListingSerializer
+from backend.validation import FeedDiff, validate_feed
+from backend.views import OrdersView, product_view
+
+SHOP_YAML = Path(__file__).resolve().parents[2] / 'data' / 'shop.yaml'
 
 
 class RegisterViewTestCase(APITestCase):
     def setUp(self):
         self.client = APIClient()
-        self.url = reverse('user-register')
+        self.url = reverse('backend:user-register')
 
     def test_register_valid_data(self):
         data = {
@@ -39,7 +62,7 @@ class RegisterViewTestCase(APITestCase):
 class ConfirmEmailTestCase(APITestCase):
     def setUp(self):
         self.client = APIClient()
-        self.url = reverse('user-register-confirm')
+        self.url = reverse('backend:user-register-confirm')
         self.user = User.objects.create(email='test@example.com', is_active=False)
         self.token = ConfirmEmailToken.objects.create(user=self.user)
 
@@ -81,7 +104,7 @@ class TestBasketItems(APITestCase):
             product_info=self.product_info,
             parameter=self.parameter
         )
-        self.url = reverse('basket')
+        self.url = reverse('backend:basket')
 
     def test_add_basket_items(self):
         self.client.force_authenticate(user=self.user, token=self.token)
@@ -89,12 +112,27 @@ class TestBasketItems(APITestCase):
                     {'product_info': self.product_info.id, 'quantity': 1},
                 ]
         response = self.client.post(self.url, {'items': json.dumps(items)}, format='json')
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         order_item1 = OrderItem.objects.filter(order__user_id=self.user.id, product_info=self.product_info).first()
         self.assertEqual(Order.objects.filter(user_id=self.user.id, state='basket').count(), 1)
         self.assertEqual(OrderItem.objects.filter(order__user_id=self.user.id).count(), 1)
         self.assertEqual(order_item1.quantity, 1)
 
+    def test_retired_products_are_not_ordered(self):
+        order = Order.objects.create(user_id=self.user.id, state='basket')
+        OrderItem.objects.create(order=order, product_info=self.product_info, quantity=1)
+        contact = Contact.objects.create(user=self.user, city='City', street='Street', house='1', apartment='1',
+                                         phone='79990000000')
+        self.product_info.is_active = False
+        self.product_info.save()
+        self.client.force_authenticate(user=self.user, token=self.token)
+        with patch('backend.views.notify_low_stock'), patch('backend.views.new_order'):
+            response = self.client.post(reverse('backend:order'), {'id': str(order.id), 'contact': contact.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.get(id=order.id).state, 'basket')
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 10)
+
     def test_get_basket_items(self):
         self.client.force_authenticate(user=self.user, token=self.token)
         response = self.client.get(self.url)
@@ -120,7 +158,7 @@ class TestBasketItems(APITestCase):
 class PartnerUpdateViewTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
-        self.url = reverse('partner-update')
+        self.url = reverse('backend:partner-update')
         self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@example.com')
         self.token = Token.objects.create(user=self.user)
 
@@ -138,7 +176,7 @@ class PartnerUpdateViewTestCase(TestCase):
         self.client.force_authenticate(user=self.user, token=self.token)
         self.user.type = 'buyer'
         self.user.save()
-        url = reverse('partner-update')
+        url = reverse('backend:partner-update')
         response = self.client.post(url, {
             'url': 'https://raw.githubusercontent.com/netology-code/python-final-diplom/master/data/shop1.yaml'},
             )
@@ -153,7 +191,42 @@ class PartnerUpdateViewTestCase(TestCase):
             self.url,
             {'url': 'https://raw.githubusercontent.com/netology-code/python-final-diplom/master/data/shop1.yaml'})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), {'Status': self.user.id})
+        job = ImportJob.objects.get(user=self.user)
+        self.assertEqual(response.json(), {'Status': True, 'Job': job.id})
+
+    @patch('backend.views.do_import.delay')
+    def test_partner_update_dry_run(self, delay):
+        self.user.type = 'shop'
+        self.user.save()
+        self.client.force_authenticate(user=self.user, token=self.token)
+        url = 'https://example.com/shop.yaml'
+        response = self.client.post(self.url, {'url': url, 'dry_run': 'true'})
+        job = ImportJob.objects.get(user=self.user)
+        self.assertEqual(response.json(), {'Status': True, 'Job': job.id})
+        self.assertTrue(job.dry_run)
+        delay.assert_called_once_with(self.user.id, url, job.id, True)
+
+
+class PartnerUpdateStatusTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        self.other = User.objects.create_user(email='other@example.com', password='testpassword', type='shop')
+        self.job = ImportJob.objects.create(
+            user=self.user, url='https://example.com/shop.yaml', state='done', products_processed=14)
+
+    def test_owner_sees_job_state(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('backend:partner-update-status', args=[self.job.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['state'], 'done')
+        self.assertEqual(response.json()['products_processed'], 14)
+
+    def test_other_user_gets_not_found(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get(reverse('backend:partner-update-status', args=[self.job.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class PartnerOrdersTestCase(TestCase):
@@ -192,7 +265,7 @@ class PartnerOrdersTestCase(TestCase):
     def test_partner_orders_view(self):
         self.client.login(username='testuser', password='testpassword')
         self.client.force_authenticate(user=self.user, token=self.token)
-        response = self.client.get(reverse('partner-orders'))
+        response = self.client.get(reverse('backend:partner-orders'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
         order = response.data[0]
@@ -206,3 +279,821 @@ class PartnerOrdersTestCase(TestCase):
         self.assertEqual(order_item['id'], self.order_item.id)
         self.assertEqual(order_item['product_info']['model'], self.product_info.model)
         self.assertEqual(order_item['quantity'], 2)
+
+
+class ProductViewPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        shop = Shop.objects.create(name='Test Shop', user=user)
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=category)
+        self.rows = ProductInfo.objects.bulk_create([
+            ProductInfo(shop=shop, product=product, external_id=number, model=f'model {number}', quantity=1,
+                        price=(number % 5) * 100, price_rrc=1000)
+            for number in range(25)
+        ])
+        refresh_listings(shop_id=shop.id)
+        self.shop = shop
+        self.url = reverse('backend:products')
+
+    def walk(self, **params):
+        ids, pages, url = [], [], self.url
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            ids.extend(item['external_id'] for item in response.json()['results'])
+            if not response.json()['next']:
+                return ids, pages
+            response = self.client.get(response.json()['next'])
+
+    def test_pages_follow_price_and_id(self):
+        ids, pages = self.walk(ordering='price', page_size=7)
+        expected = [row.external_id for row in sorted(self.rows, key=lambda row: (row.price, row.id))]
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page['results']) for page in pages], [7, 7, 7, 4])
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(previous['previous']).json()['results'], pages[0]['results'])
+
+    def test_descending_order_and_default_page_size(self):
+        ids, pages = self.walk(ordering='-price')
+        self.assertEqual(ids, [row.external_id for row in sorted(self.rows, key=lambda row: (-row.price, -row.id))])
+        self.assertEqual(len(pages[0]['results']), 10)
+
+    def test_deep_page_query_does_not_use_offset(self):
+        _, pages = self.walk(ordering='price', page_size=5)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(pages[-1]['next'] or pages[-2]['next'])
+        self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rows_come_from_listing_in_one_query(self):
+        parameter = Parameter.objects.create(name='Цвет')
+        ProductParameter.objects.create(product_info=self.rows[0], parameter=parameter, value='черный')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(len([query for query in queries if 'backend_productlisting' in query['sql']]), 1)
+        self.assertEqual(response.json()['results'][0], {
+            'id': self.rows[0].id, 'product': {'name': 'Test Product', 'category': 'Test Category'},
+            'model': 'model 0', 'brand': None, 'shop': self.shop.id, 'external_id': 0, 'quantity': 1,
+            'price': '0.00', 'price_rrc': '1000.00', 'image': None,
+            'parameters': [{'parameter': 'Цвет', 'value': 'черный'}],
+        })
+
+    def test_listing_follows_stock_and_shop_state(self):
+        row = self.rows[1]
+        row.quantity = 0
+        row.is_active = False
+        row.save()
+        self.shop.state = False
+        self.shop.name = 'Renamed'
+        self.shop.save()
+        listing = ProductListing.objects.get(product_info=row)
+        self.assertEqual((listing.quantity, listing.is_active, listing.shop_state, listing.shop_name),
+                         (0, False, False, 'Renamed'))
+        self.assertEqual(self.client.get(self.url).json()['results'], [])
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        shop = Shop.objects.create(name='Test Shop', user=user)
+        phones = Category.objects.create(name='Смартфоны')
+        tvs = Category.objects.create(name='Телевизоры')
+        apple = Brand.objects.create(name='Apple')
+        samsung = Brand.objects.create(name='Samsung')
+        goods = [
+            ('Смартфон Apple iPhone XS Max', phones, apple, True),
+            ('Смартфон Samsung Galaxy S10', phones, samsung, True),
+            ('Телевизор Samsung QE55', tvs, samsung, True),
+            ('Смартфон Apple iPhone 6', phones, apple, False),
+        ]
+        self.rows = {}
+        for number, (name, category, brand, is_active) in enumerate(goods):
+            product = Product.objects.create(name=name, category=category)
+            self.rows[name] = ProductInfo.objects.create(
+                shop=shop, product=product, brand=brand, external_id=number, model=f'model-{number}', quantity=1,
+                price=1000, price_rrc=1000, is_active=is_active)
+        self.phones = phones
+        self.url = reverse('backend:product-search')
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['product']['name'] for item in response.json()['results']]
+
+    def test_stemmed_words_match_active_goods(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT datctype FROM pg_database WHERE datname = current_database()')
+            if cursor.fetchone()[0] in ('C', 'POSIX'):
+                self.skipTest('The database locale does not know Cyrillic letters')
+        self.assertCountEqual(self.search(q='смартфоны'),
+                              ['Смартфон Apple iPhone XS Max', 'Смартфон Samsung Galaxy S10'])
+
+    def test_filters_and_ranking(self):
+        self.assertEqual(self.search(q='samsung', category_id=self.phones.id), ['Смартфон Samsung Galaxy S10'])
+        self.assertEqual(self.search(q='samsung qe55')[0], 'Телевизор Samsung QE55')
+        self.assertEqual(self.search(q='iphone'), ['Смартфон Apple iPhone XS Max'])
+
+    def test_pages(self):
+        first = self.client.get(self.url, {'q': 'samsung', 'page_size': 1}).json()
+        second = self.client.get(first['next']).json()
+        names = [item['product']['name'] for item in first['results'] + second['results']]
+        self.assertCountEqual(names, ['Смартфон Samsung Galaxy S10', 'Телевизор Samsung QE55'])
+        self.assertIsNone(second['next'])
+
+    def test_missing_text(self):
+        response = self.client.get(self.url, {'q': ' '})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_typos_need_trigram_extension(self):
+        if not has_trigram():
+            self.skipTest('pg_trgm is not installed')
+        self.assertIn('Смартфон Samsung Galaxy S10', self.search(q='Смартфон Samsnug Galaxy'))
+
+
+class ProductFacetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shops = [
+            Shop.objects.create(name=f'Shop {number}', user=User.objects.create_user(
+                email=f'shop{number}@example.com', password='testpassword', type='shop'))
+            for number in range(2)
+        ]
+        self.phones = Category.objects.create(name='Phones')
+        self.tvs = Category.objects.create(name='TVs')
+        self.apple = Brand.objects.create(name='Apple')
+        self.samsung = Brand.objects.create(name='Samsung')
+        goods = [
+            (0, self.phones, self.apple, 500),
+            (0, self.phones, self.samsung, 4000),
+            (0, self.tvs, self.samsung, 60000),
+            (1, self.phones, self.apple, 700),
+            (1, self.tvs, None, 120000),
+        ]
+        self.rows = []
+        for number, (shop, category, brand, price) in enumerate(goods):
+            product = Product.objects.create(name=f'Product {number}', category=category)
+            self.rows.append(ProductInfo.objects.create(
+                shop=self.shops[shop], product=product, brand=brand, external_id=number, quantity=1, price=price,
+                price_rrc=price))
+        self.url = reverse('backend:products')
+
+    def facets(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {facet: {item.get('id', item.get('from')): item['count'] for item in values}
+                for facet, values in response.json()['facets'].items()}
+
+    def test_counts_without_filters(self):
+        self.assertEqual(self.facets(), {
+            'shop': {self.shops[0].id: 3, self.shops[1].id: 2},
+            'category': {self.phones.id: 3, self.tvs.id: 2},
+            'brand': {self.apple.id: 2, self.samsung.id: 2},
+            'price': {0: 2, 1000: 1, 50000: 1, 100000: 1},
+        })
+
+    def test_counts_of_a_facet_ignore_its_own_filter(self):
+        facets = self.facets(category_id=self.phones.id, shop_id=self.shops[0].id)
+        self.assertEqual(facets['category'], {self.phones.id: 2, self.tvs.id: 1})
+        self.assertEqual(facets['shop'], {self.shops[0].id: 2, self.shops[1].id: 1})
+        self.assertEqual(facets['brand'], {self.apple.id: 1, self.samsung.id: 1})
+        self.assertEqual(self.facets(brand='Samsung')['category'], {self.phones.id: 1, self.tvs.id: 1})
+
+    def test_names_and_price_ranges(self):
+        response = self.client.get(self.url, {'brand_id': self.apple.id}).json()['facets']
+        self.assertEqual(response['brand'][0], {'id': self.apple.id, 'name': 'Apple', 'count': 2})
+        self.assertEqual(response['price'], [{'from': 0, 'to': 1000, 'count': 2}])
+
+    def test_index_follows_changes(self):
+        self.rows[0].is_active = False
+        self.rows[0].save()
+        self.shops[1].state = False
+        self.shops[1].save()
+        product = self.rows[1].product
+        product.category = self.tvs
+        product.save()
+        facets = self.facets()
+        self.assertEqual(facets['category'], {self.tvs.id: 2})
+        self.assertEqual(facets['shop'], {self.shops[0].id: 2})
+
+        with patch('backend.signals.update_facets', wraps=update_facets) as update:
+            self.shops[0].delete()
+        update.assert_called_once()
+        self.assertEqual(self.facets()['category'], {})
+
+    def test_deleted_products_leave_the_index(self):
+        self.rows[3].delete()
+        facets = self.facets()
+        self.assertEqual(facets['shop'], {self.shops[0].id: 3, self.shops[1].id: 1})
+        self.assertEqual(facets['price'], {0: 1, 1000: 1, 50000: 1, 100000: 1})
+
+        self.tvs.delete()
+        self.assertEqual(self.facets()['category'], {self.phones.id: 2})
+        rebuild_facets()
+        self.assertEqual(self.facets()['category'], {self.phones.id: 2})
+
+    def test_sparse_values_count_like_dense_ones(self):
+        self.assertIsInstance(compact(to_bitmap(range(100))), int)
+        self.assertEqual(list(compact(to_bitmap([3, 70, 1000]))), [3, 70, 1000])
+        self.assertEqual(dense(compact(to_bitmap([3, 70, 1000]))), to_bitmap([3, 70, 1000]))
+
+        rare = Brand.objects.create(name='Rare')
+        ProductInfo.objects.create(
+            id=1000000, shop=self.shops[1], product=self.rows[0].product, brand=rare, external_id=99, quantity=1,
+            price=700, price_rrc=700)
+        self.assertEqual(self.facets(), {
+            'shop': {self.shops[0].id: 3, self.shops[1].id: 3},
+            'category': {self.phones.id: 4, self.tvs.id: 2},
+            'brand': {self.apple.id: 2, self.samsung.id: 2, rare.id: 1},
+            'price': {0: 3, 1000: 1, 50000: 1, 100000: 1},
+        })
+        facets = self.facets(brand_id=rare.id)
+        self.assertEqual(facets['shop'], {self.shops[1].id: 1})
+        self.assertEqual(facets['brand'], {self.apple.id: 2, self.samsung.id: 2, rare.id: 1})
+
+    def test_rebuild_matches_incremental_index(self):
+        self.rows[2].brand = self.apple
+        self.rows[2].price = 999
+        self.rows[2].save()
+        before = self.facets()
+        rebuild_facets(batch_size=2)
+        self.assertEqual(self.facets(), before)
+        self.assertEqual(before['brand'], {self.apple.id: 3, self.samsung.id: 1})
+
+
+class ParameterRangeTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            self.data = yaml.safe_load(stream)
+        ShopImporter(user.id).run(self.data)
+        self.diagonal = Parameter.objects.get(name='Диагональ (дюйм)').id
+        self.memory = Parameter.objects.get(name='Встроенная память (Гб)').id
+        self.url = reverse('backend:products')
+
+    def expected(self, check):
+        return sorted(item['id'] for item in self.data['goods'] if check(item['parameters']))
+
+    def external_ids(self, **params):
+        response = self.client.get(self.url, dict(params, page_size=100))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item['external_id'] for item in response.json()['results'])
+
+    def test_numbers_are_detected(self):
+        parameter = Parameter.objects.create(name='Вес (г)')
+        info = ProductInfo.objects.first()
+        for value, number in (('6.5', 6.5), (' 5,8 ', 5.8), ('-10', -10), ('2688x1242', None), ('1e5', None)):
+            ProductParameter.objects.update_or_create(product_info=info, parameter=parameter, defaults={'value': value})
+            self.assertEqual(ProductParameter.objects.get(product_info=info, parameter=parameter).numeric_value, number)
+
+    def test_range_filters(self):
+        ids = self.external_ids(**{f'param.{self.diagonal}__gte': 6, f'param.{self.diagonal}__lte': 6.2})
+        self.assertEqual(ids, self.expected(lambda parameters: 6 <= parameters.get('Диагональ (дюйм)', 0) <= 6.2))
+        self.assertTrue(ids)
+
+        ids = self.external_ids(**{f'param.{self.memory}__gte': 256, f'param.{self.diagonal}__lt': 6.5})
+        self.assertEqual(ids, self.expected(lambda parameters: parameters.get('Встроенная память (Гб)', 0) >= 256
+                                            and parameters.get('Диагональ (дюйм)', 99) < 6.5))
+
+    def test_facets_follow_range_filters(self):
+        response = self.client.get(self.url, {f'param.{self.memory}__gt': 256}).json()
+        expected = len(self.expected(lambda parameters: parameters.get('Встроенная память (Гб)', 0) > 256))
+        self.assertEqual(sum(item['count'] for item in response['facets']['shop']), expected)
+
+    def test_range_uses_parameter_index(self):
+        queryset = ProductParameter.objects.filter(parameter_id=self.diagonal, numeric_value__gte=6)
+        with connection.cursor() as cursor:
+            # fresh statistics, so the plan does not depend on when autovacuum last analyzed the table
+            cursor.execute('ANALYZE backend_productparameter')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            # on a table this small the plain parameter_id index costs the same, so the planner may pick either;
+            # the test transaction rolls the drop back
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'backend_productparameter' "
+                           "AND indexdef LIKE '%(parameter_id)'")
+            for name, in cursor.fetchall():
+                cursor.execute(f'DROP INDEX {name}')
+        self.assertIn('product_parameter_numeric', queryset.explain())
+
+    def test_bad_number(self):
+        response = self.client.get(self.url, {f'param.{self.diagonal}__gte': 'шесть'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.json()['Status'])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=60)
+class CatalogCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        self.shop = Shop.objects.create(name='Test Shop', user=self.user)
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=category)
+        self.info = ProductInfo.objects.create(
+            shop=self.shop, product=product, external_id=1, quantity=5, price=100, price_rrc=100)
+
+    def test_hit_skips_database(self):
+        url = reverse('backend:products')
+        first = self.client.get(url, {'category_id': self.info.product.category_id, 'shop_id': ''})
+        with self.assertNumQueries(0):
+            second = self.client.get(f'{url}?shop_id=&category_id={self.info.product.category_id}')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+    def test_accept_header_is_part_of_key(self):
+        url = reverse('backend:products')
+        self.client.get(url, HTTP_ACCEPT='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT='text/html')
+        self.assertTrue(queries)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_partner_state_makes_responses_stale(self):
+        url = reverse('backend:shops')
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('backend:partner-state'), {'state': 'false'})
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(url).json(), [])
+
+    def test_model_edits_make_responses_stale(self):
+        url = reverse('backend:products')
+        self.assertEqual(self.client.get(url).json()['results'][0]['price'], '100.00')
+        self.client.get(reverse('backend:product-batch'), {'ids': self.info.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.info.price = 150
+            self.info.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['price'], '150.00')
+        batch = self.client.get(reverse('backend:product-batch'), {'ids': self.info.id}).json()
+        self.assertEqual(batch['results'][0]['price'], '150.00')
+
+        brand = Brand.objects.create(name='Brand')
+        self.assertEqual([item['name'] for item in self.client.get(reverse('backend:brands')).json()], ['Brand'])
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.name = 'Renamed'
+            brand.save()
+        self.assertEqual([item['name'] for item in self.client.get(reverse('backend:brands')).json()], ['Renamed'])
+
+    def test_order_makes_products_stale(self):
+        url = reverse('backend:products')
+        self.assertEqual(self.client.get(url).json()['results'][0]['quantity'], 5)
+        buyer = User.objects.create_user(email='buyer@example.com', password='testpassword', type='buyer')
+        contact = Contact.objects.create(user=buyer, city='City', street='Street', house='1', apartment='1', phone='79990000000')
+        order = Order.objects.create(user=buyer, state='basket')
+        OrderItem.objects.create(order=order, product_info=self.info, quantity=2)
+        self.client.force_authenticate(user=buyer)
+        with patch('backend.views.notify_low_stock'), patch('backend.views.new_order'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('backend:order'), {'id': str(order.id), 'contact': contact.id})
+        self.assertEqual(response.json(), {'Status': True})
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(url).json()['results'][0]['quantity'], 3)
+
+
+class CategorySnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        shops = [Shop.objects.create(name='Shop 0', user=self.user)] + [
+            Shop.objects.create(name=f'Shop {number}', user=User.objects.create_user(
+                email=f'shop{number}@example.com', password='testpassword', type='shop'))
+            for number in (1, 2)
+        ]
+        for number in range(5):
+            Category.objects.create(name=f'Category {number}').shops.set(shops[:number])
+
+    def test_categories_in_two_queries(self):
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('backend:categories'), HTTP_ACCEPT='application/json').json()
+        self.assertEqual(data, json.loads(json.dumps(CategorySerializer(Category.objects.all(), many=True).data)))
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=60)
+    def test_snapshot_follows_partner_state(self):
+        snapshot = load_snapshot()
+        with self.assertNumQueries(0):
+            self.assertIs(load_snapshot(), snapshot)
+        self.assertEqual([shop['name'] for shop in snapshot.shops], ['Shop 2', 'Shop 1', 'Shop 0'])
+
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('backend:partner-state'), {'state': 'false'})
+        snapshot = load_snapshot()
+        self.assertEqual([shop['name'] for shop in snapshot.shops], ['Shop 2', 'Shop 1'])
+        self.assertEqual(snapshot.categories[0]['shops'][-1], {
+            'id': self.user.shop.id, 'address': '', 'image': None, 'name': 'Shop 0', 'state': False})
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='buyer@example.com', password='testpassword', type='buyer')
+        shop = Shop.objects.create(name='Test Shop', user=User.objects.create_user(
+            email='shop@example.com', password='testpassword', type='shop'))
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=category)
+        self.info = info = ProductInfo.objects.create(shop=shop, product=product, external_id=1, quantity=5,
+                                                      price=100, price_rrc=100)
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=order, product_info=info, quantity=1)
+
+    def test_catalog_etag(self):
+        for name in ('backend:products', 'backend:categories', 'backend:shops', 'backend:brands'):
+            url = reverse(name)
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertFalse(etag.startswith('W/'))
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertNotEqual(self.client.get(url, {'page': 2})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=60)
+    def test_cached_and_unchanged_responses_are_throttled(self):
+        cache.clear()
+        url = reverse('backend:products')
+        # the test settings turn throttling off
+        with patch.object(product_view.cls, 'throttle_classes', [AnonRateThrottle]), \
+                patch.object(AnonRateThrottle, 'THROTTLE_RATES', {'anon': '2/day'}):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_writes_ignore_conditional_headers(self):
+        self.client.force_authenticate(user=User.objects.get(email='shop@example.com'))
+        response = self.client.post(reverse('backend:brands'), {'name': 'New Brand'}, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_model_edits_change_etag(self):
+        url = reverse('backend:products')
+        brand = Brand.objects.create(name='Old Brand')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.info.brand = brand
+            self.info.save()
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.info.price = 200
+            self.info.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['price'], '200.00')
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.name = 'New Brand'
+            brand.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['brand'], {'name': 'New Brand'})
+
+    def test_order_list_etag(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse('backend:order')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.user, state='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 2)
+
+        other = User.objects.create_user(email='other@example.com', password='testpassword', type='buyer')
+        self.client.force_authenticate(user=other)
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+
+class RendererNegotiationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        shop = Shop.objects.create(name='Test Shop', user=User.objects.create_user(
+            email='shop@example.com', password='testpassword', type='shop'))
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Смартфон "Apple": iPhone', category=category)
+        ProductInfo.objects.create(shop=shop, product=product, external_id=1, quantity=5, price='99.90',
+                                   price_rrc=100)
+        self.url = reverse('backend:products')
+
+    def test_formats_carry_the_same_data(self):
+        data = self.client.get(self.url, HTTP_ACCEPT='application/json').json()
+        response = self.client.get(self.url, HTTP_ACCEPT='application/yaml')
+        self.assertEqual(response['Content-Type'], 'application/yaml; charset=utf-8')
+        self.assertEqual(yaml.safe_load(response.content), data)
+        self.assertEqual(data['results'][0]['product']['name'], 'Смартфон "Apple": iPhone')
+        self.assertEqual(self.client.get(self.url, {'format': 'yaml'}).content, response.content)
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        data = self.client.get(self.url, HTTP_ACCEPT='application/json').json()
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), data)
+
+
+class FastSerializerParityTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.partner = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            ShopImporter(self.partner.id).run(yaml.safe_load(stream))
+        other = Shop.objects.create(name='Other Shop', address='Lenina, 1', user=User.objects.create_user(
+            email='other@example.com', password='testpassword', type='shop'))
+        category = Category.objects.first()
+        category.shops.add(other)
+        product = Product.objects.create(name='No Brand', category=category)
+        self.unbranded = ProductInfo.objects.create(shop=other, product=product, external_id=1, quantity=3,
+                                                    price='10.50', price_rrc=12)
+        refresh_listings(shop_id=other.id)
+
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='testpassword', type='buyer')
+        contact = Contact.objects.create(user=self.buyer, city='Moscow', street='Lenina', house='1',
+                                         phone='81234567890')
+        infos = list(ProductInfo.objects.filter(shop__user=self.partner).order_by('id')[:3])
+        first = Order.objects.create(user=self.buyer, contact=contact, state='new')
+        for quantity, info in enumerate(infos + [self.unbranded], start=1):
+            OrderItem.objects.create(order=first, product_info=info, quantity=quantity)
+        second = Order.objects.create(user=self.buyer, state='confirmed')
+        OrderItem.objects.create(order=second, product_info=infos[0], quantity=5)
+        Order.objects.create(user=self.buyer, state='canceled')
+        Order.objects.create(user=self.buyer, state='basket')
+
+    def serialized_orders(self, **filters):
+        queryset = Order.objects.filter(**filters).exclude(state='basket').annotate(
+            total_sum=Sum(F('order_items__quantity') * F('order_items__product_info__price'))).distinct().order_by(
+            '-created', '-id')
+        return json.loads(json.dumps(OrderSerializer(queryset, many=True).data))
+
+    def test_products(self):
+        for params in ({'page_size': 100}, {'ordering': '-price', 'page_size': 3}, {'shop_id': self.unbranded.shop_id}):
+            page = self.client.get(reverse('backend:products'), params, HTTP_ACCEPT='application/json').json()
+            ids = [item['id'] for item in page['results']]
+            rows = sorted(ProductListing.objects.filter(product_info_id__in=ids),
+                          key=lambda row: ids.index(row.product_info_id))
+            expected = ProductListingSerializer(rows, many=True).data
+            self.assertEqual(page['results'], json.loads(json.dumps(expected)))
+        self.assertIn(None, [item['brand'] for item in self.client.get(
+            reverse('backend:products'), {'page_size': 100}, HTTP_ACCEPT='application/json').json()['results']])
+
+    def test_buyer_orders(self):
+        self.client.force_authenticate(user=self.buyer)
+        data = self.client.get(reverse('backend:order'), HTTP_ACCEPT='application/json').json()
+        self.assertEqual(data, self.serialized_orders(user=self.buyer))
+        self.assertEqual([len(order['order_items']) for order in data], [0, 1, 4])
+        self.assertIsNone(data[0]['total_sum'])
+
+    def test_partner_orders(self):
+        self.client.force_authenticate(user=self.partner)
+        data = self.client.get(reverse('backend:partner-orders'), HTTP_ACCEPT='application/json').json()
+        self.assertEqual(data, self.serialized_orders(order_items__product_info__shop__user=self.partner))
+        self.assertEqual([len(order['order_items']) for order in data], [1, 4])
+
+    def test_product_fields(self):
+        url = reverse('backend:products')
+        full = self.client.get(url, {'ordering': 'price', 'page_size': 5}, HTTP_ACCEPT='application/json').json()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {'ordering': 'price', 'page_size': 5, 'fields': 'price,id'},
+                                   HTTP_ACCEPT='application/json').json()
+        listing_query = next(query['sql'] for query in queries if 'backend_productlisting' in query['sql'])
+        self.assertNotIn('parameters', listing_query.split('FROM')[0])
+        self.assertEqual(data['results'], [{'id': item['id'], 'price': item['price']} for item in full['results']])
+        self.assertEqual(self.client.get(data['next'], HTTP_ACCEPT='application/json').json()['results'][0],
+                         {key: value for key, value in self.client.get(full['next']).json()['results'][0].items()
+                          if key in ('id', 'price')})
+
+    def test_order_fields_and_includes(self):
+        self.client.force_authenticate(user=self.buyer)
+        url = reverse('backend:order')
+        full = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'fields': 'id,state'}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(data, [{'id': order['id'], 'state': order['state']} for order in full])
+
+        with self.assertNumQueries(3):
+            data = self.client.get(url, {'fields': 'id,order_items,contact', 'include': 'contact'},
+                                   HTTP_ACCEPT='application/json').json()
+        items = [item for order in data for item in order['order_items']]
+        self.assertTrue(all(isinstance(item['product_info'], int) for item in items))
+        self.assertEqual([order['contact'] for order in data], [order['contact'] for order in full])
+
+        data = self.client.get(url, {'include': 'product_info'}, HTTP_ACCEPT='application/json').json()
+        product_info = data[-1]['order_items'][0]['product_info']
+        self.assertNotIn('parameters', product_info)
+        self.assertEqual(dict(product_info, parameters=full[-1]['order_items'][0]['product_info']['parameters']),
+                         full[-1]['order_items'][0]['product_info'])
+        self.assertEqual(data[-1]['contact'], full[-1]['contact']['id'])
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('backend:products'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'Status': False, 'Error': 'Неизвестные поля: secret'})
+        self.client.force_authenticate(user=self.partner)
+        response = self.client.get(reverse('backend:partner-orders'), {'include': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_categories(self):
+        data = self.client.get(reverse('backend:categories'), HTTP_ACCEPT='application/json').json()
+        expected = CategorySerializer(Category.objects.all(), many=True).data
+        self.assertEqual(data, json.loads(json.dumps(expected)))
+        self.assertTrue(any(len(category['shops']) == 2 for category in data))
+
+
+class ProductExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            ShopImporter(self.user.id).run(yaml.safe_load(stream))
+        self.shop = Shop.objects.get(user=self.user)
+        self.url = reverse('backend:product-export')
+
+    def test_ndjson_lines_match_product_view(self):
+        response = self.client.get(self.url, {'shop_id': self.shop.id})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        page = self.client.get(reverse('backend:products'), {'shop_id': self.shop.id, 'page_size': 100},
+                               HTTP_ACCEPT='application/json').json()
+        self.assertEqual([json.loads(line) for line in lines], page['results'])
+
+        response = self.client.get(self.url, {'fields': 'id,price', 'brand': 'Nicarho'})
+        self.assertEqual([json.loads(line) for line in b''.join(response.streaming_content).splitlines()],
+                         [{'id': item['id'], 'price': item['price']} for item in page['results']
+                          if item['brand'] == {'name': 'Nicarho'}])
+
+    def test_rows_are_read_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(ndjson_chunks(ProductListing.objects.all(), chunk_size=4))
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [4, 4, 4, 2])
+        self.assertEqual(len(queries), 1)
+
+    def test_shop_yaml_can_be_imported_again(self):
+        response = self.client.get(self.url, {'shop_id': self.shop.id, 'format': 'yaml'})
+        self.assertEqual(response['Content-Type'], 'application/yaml; charset=utf-8')
+        feed = yaml.safe_load(b''.join(response.streaming_content))
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            original = yaml.safe_load(stream)
+        self.assertEqual(feed['shop'], original['shop'])
+        self.assertEqual(sorted(category['id'] for category in feed['categories']),
+                         sorted(category['id'] for category in original['categories']))
+        report = validate_feed(feed, FeedDiff(self.user.id))
+        self.assertTrue(report['valid'])
+        self.assertEqual((report['diff']['inserted'], report['diff']['updated'], report['diff']['unchanged']),
+                         (0, 0, 14))
+
+    def test_errors(self):
+        response = self.client.get(self.url, {'format': 'yaml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(yaml.safe_load(response.content)['Status'], False)
+        response = self.client.get(self.url, {'fields': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {'Status': False, 'Error': 'Неизвестные поля: secret'})
+
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            ShopImporter(self.user.id).run(yaml.safe_load(stream))
+        refresh_autocomplete()
+        self.url = reverse('backend:product-autocomplete')
+
+    def suggest(self, text, **params):
+        response = self.client.get(self.url, dict(params, q=text), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['results']
+
+    def test_word_prefixes(self):
+        names = [item['name'] for item in self.suggest('IPHONE xs')]
+        self.assertTrue(names)
+        self.assertTrue(all('iphone xs' in name.casefold() for name in names))
+        self.assertEqual(self.suggest('nicar'), [
+            {'kind': 'brand', 'id': Brand.objects.get(name='Nicarho').id, 'name': 'Nicarho'}])
+        self.assertIn('model', {item['kind'] for item in self.suggest('apple/iph')})
+        self.assertEqual(len(self.suggest('с', limit=3)), 3)
+        self.assertEqual(self.suggest(' '), [])
+
+    def test_keystrokes_skip_database(self):
+        self.suggest('смарт')
+        with self.assertNumQueries(0):
+            self.suggest('смартф')
+
+    def test_missing_snapshot_is_queued_not_built(self):
+        self.assertTrue(self.suggest('смартфон'))
+        cache.clear()
+        with patch('djangoProjectFinalWork.tasks.refresh_autocomplete_task.delay') as delay:
+            with self.assertNumQueries(0):
+                self.assertTrue(self.suggest('смартфон'))
+                self.suggest('смартф')
+        delay.assert_called_once_with()
+
+        refresh_autocomplete()
+        self.assertTrue(self.suggest('смартф'))
+        self.assertIsNone(cache.get(QUEUED_KEY))
+
+    def test_snapshot_follows_partner_state(self):
+        self.assertTrue(self.suggest('смартфон'))
+        self.client.force_authenticate(user=self.user)
+        with patch('djangoProjectFinalWork.tasks.refresh_autocomplete_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('backend:partner-state'), {'state': 'false'})
+        shop_ids = list(Shop.objects.filter(user=self.user).values_list('id', flat=True))
+        delay.assert_called_once_with(shop_ids)
+        self.assertTrue(self.suggest('смартфон'))
+
+        refresh_autocomplete(*delay.call_args.args)
+        self.assertEqual(self.suggest('смартфон'), [])
+
+    def test_refresh_waits_for_the_lock(self):
+        cache.set(LOCK_KEY, 'other', 60)
+        with patch('backend.autocomplete.LOCK_TIMEOUT', 0.2), patch('backend.autocomplete.time.sleep') as sleep:
+            refresh_autocomplete()
+        self.assertTrue(sleep.called)
+        self.assertEqual(cache.get(LOCK_KEY), 'other')
+
+        cache.delete(LOCK_KEY)
+        refresh_autocomplete()
+        self.assertIsNone(cache.get(LOCK_KEY))
+
+    def test_incremental_refresh_keeps_other_shops(self):
+        other = Shop.objects.create(name='Other Shop', user=User.objects.create_user(
+            email='other@example.com', password='testpassword', type='shop'))
+        product = Product.objects.create(name='Пылесос Zephyr', category=Category.objects.first())
+        ProductInfo.objects.create(shop=other, product=product, external_id=1, quantity=1, price=10, price_rrc=10)
+        refresh_autocomplete()
+        self.assertEqual([item['name'] for item in self.suggest('zeph')], ['Пылесос Zephyr'])
+
+        with CaptureQueriesContext(connection) as queries:
+            refresh_autocomplete([other.id])
+        listing_query = next(query['sql'] for query in queries if 'backend_productlisting' in query['sql'])
+        self.assertIn(f'IN ({other.id})', listing_query)
+        self.assertTrue(self.suggest('смартфон'))
+
+
+class ProductBatchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = User.objects.create_user(email='shop@example.com', password='testpassword', type='shop')
+        with open(SHOP_YAML, encoding='utf-8') as stream:
+            ShopImporter(user.id).run(yaml.safe_load(stream))
+        self.ids = list(ProductInfo.objects.order_by('-id').values_list('id', flat=True)[:5])
+        self.url = reverse('backend:product-batch')
+
+    def get(self, **params):
+        return self.client.get(self.url, params, HTTP_ACCEPT='application/json')
+
+    def test_products_in_input_order(self):
+        hidden = ProductInfo.objects.get(id=self.ids[1])
+        hidden.is_active = False
+        hidden.save()
+        with self.assertNumQueries(1):
+            data = self.get(ids=','.join(map(str, self.ids + [self.ids[0], 0]))).json()
+        expected = [pk for pk in self.ids if pk != hidden.id]
+        self.assertEqual([item['id'] for item in data['results']], expected)
+        self.assertEqual(data['missing'], [hidden.id, 0])
+        page = self.client.get(reverse('backend:products'), {'page_size': 100}, HTTP_ACCEPT='application/json').json()
+        by_id = {item['id']: item for item in page['results']}
+        self.assertEqual(data['results'], [by_id[pk] for pk in expected])
+        self.assertEqual(self.get(ids=self.ids[0], fields='id,price').json()['results'],
+                         [{'id': self.ids[0], 'price': by_id[self.ids[0]]['price']}])
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=60)
+    def test_per_id_cache(self):
+        self.get(ids=f'{self.ids[0]},{self.ids[1]}')
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(ids=','.join(map(str, self.ids[:3]))).json()
+        self.assertEqual(len(queries), 1)
+        self.assertIn(f'IN ({self.ids[2]})', queries[0]['sql'])
+        self.assertEqual([item['id'] for item in data['results']], self.ids[:3])
+        with self.assertNumQueries(0):
+            self.get(ids=','.join(map(str, self.ids[:3])))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.get().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get(ids='1,x').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.get(ids=','.join(map(str, range(1, 102))))
+        self.assertEqual(response.json(), {'Status': False, 'Error': 'Не больше 100 ids за запрос'})